@@ -1,4 +1,4 @@
-from alpaca.data import StockHistoricalDataClient, StockQuotesRequest
+from alpaca.data import StockHistoricalDataClient, TimeFrame
 from collections import deque
 from contextlib import contextmanager
 from datetime import datetime, timedelta
@@ -10,7 +10,7 @@ import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
 import os
-import pickle
+from sherwood.bars import alpaca_bar_fetcher, BarStore
 from sherwood.db import get_db, POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME, Session
 from sherwood.errors import InternalServerError
 from sherwood.models import BaseModel, Transaction, TransactionType, User
@@ -23,6 +23,8 @@ from tqdm import tqdm
 ALPACA_API_KEY_ENV_VAR_NAME = "ALPACA_API_KEY"
 ALPACA_SECRET_KEY_ENV_VAR_NAME = "ALPACA_SECRET_KEY"
 
+BARS_DIRECTORY = "bars/minute"
+
 
 def _validate_env() -> None:
     if os.environ.get(POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME) is None:
@@ -64,25 +66,15 @@ if __name__ == "__main__":
         secret_key=os.environ.get(ALPACA_SECRET_KEY_ENV_VAR_NAME),
     )
 
-    if os.path.exists("prices.pkl"):
-        with open("prices.pkl", "rb") as f:
-            _prices = pickle.load(f)
-    else:
-        _prices = {}
+    bar_store = BarStore(
+        BARS_DIRECTORY,
+        alpaca_bar_fetcher(stock_historical_data_client, TimeFrame.Minute),
+    )
 
     def get_price(symbol, timestamp):
         if symbol == DOLLAR_SYMBOL:
             return 1
-        key = (symbol, timestamp)
-        if key in _prices:
-            return _prices[key]
-        # raise ValueError()
-        request = StockQuotesRequest(symbol_or_symbols=symbol, start=timestamp, limit=1)
-        response = stock_historical_data_client.get_stock_quotes(request)
-        quote = response[symbol][0]
-        price = 0.5 * (quote.bid_price + quote.ask_price)
-        _prices[key] = price
-        return price
+        return bar_store.price_at(symbol, timestamp)
 
     postgresql_database_url = URL.create(
         drivername="postgresql",
@@ -111,6 +103,24 @@ if __name__ == "__main__":
         users = db.query(User).all()
         transactions = db.query(Transaction).all()
 
+        # holdings are priced at every later transaction
+        last_transaction_created = max(txn.created for txn in transactions)
+        range_by_symbol = {}
+        for transaction in transactions:
+            if transaction.asset == DOLLAR_SYMBOL or transaction.type not in {
+                TransactionType.BUY,
+                TransactionType.SELL,
+            }:
+                continue
+            start, _ = range_by_symbol.get(
+                transaction.asset, (transaction.created, None)
+            )
+            range_by_symbol[transaction.asset] = (
+                min(start, transaction.created - timedelta(days=1)),
+                last_transaction_created + timedelta(minutes=1),
+            )
+        bar_store.ensure(range_by_symbol)
+
         user_by_timestamp = {user.created: user for user in users}
         transaction_by_timestamp = {
             transaction.created: transaction for transaction in transactions
@@ -345,9 +355,6 @@ if __name__ == "__main__":
         )
         # plt.show()
 
-        with open("prices.pkl", "wb") as f:
-            pickle.dump(_prices, f)
-
         with tqdm(total=frames) as pbar:
             ani.save(
                 "network_evolution.mp4",
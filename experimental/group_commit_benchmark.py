@@ -0,0 +1,81 @@
+"""Measures queued order throughput with and without group commit.
+
+Runs against a scratch database whose tables it drops and recreates, e.g. a
+local Postgres:
+
+  createdb sherwood_benchmark
+  python experimental/group_commit_benchmark.py \
+      --database-url postgresql://postgres@localhost/sherwood_benchmark
+"""
+
+import argparse
+from datetime import datetime, timezone
+import random
+import time
+from sherwood.broker import Order
+from sherwood.db import Session
+from sherwood.market_data import quote_cache, set_provider
+from sherwood.market_data_providers import ReplayProvider
+from sherwood.models import create_user, BaseModel, TransactionType
+from sherwood.order_queue import enqueue_order, OrderExecutor
+from sqlalchemy import create_engine
+
+SYMBOLS = ["AAA", "BBB", "CCC", "DDD"]
+
+
+def _setup(engine, users: int, orders: int, seed: int) -> None:
+    BaseModel.metadata.drop_all(engine)
+    BaseModel.metadata.create_all(engine)
+    quote_cache.clear()
+    rng = random.Random(seed)
+    db = Session()
+    try:
+        for i in range(users):
+            create_user(db, f"user{i}@web.com", f"user{i}", "Abcd@1234", 1_000_000)
+        for _ in range(orders):
+            enqueue_order(
+                db,
+                rng.randint(1, users),
+                Order(TransactionType.BUY, dollars=1, symbol=rng.choice(SYMBOLS)),
+            )
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument(
+        "--group-commit-sizes", type=int, nargs="+", default=[1, 8, 32, 128]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    Session.configure(bind=engine)
+    recorded_at = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    set_provider(
+        ReplayProvider(
+            {(symbol, recorded_at): 1 + i for i, symbol in enumerate(SYMBOLS)},
+            speed=0,
+        )
+    )
+    try:
+        for group_commit_size in args.group_commit_sizes:
+            _setup(engine, args.users, args.orders, args.seed)
+            start = time.perf_counter()
+            executed = OrderExecutor(group_commit_size=group_commit_size).drain()
+            seconds = time.perf_counter() - start
+            print(
+                f"group commit size {group_commit_size:>4}: "
+                f"{executed} orders in {seconds:.2f}s, "
+                f"{executed / seconds:.0f} trades/s"
+            )
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
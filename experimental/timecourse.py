@@ -1,10 +1,12 @@
-from alpaca.data import StockBarsRequest, TimeFrame
+from alpaca.data import TimeFrame
 from alpaca.data.historical import StockHistoricalDataClient
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import matplotlib.pyplot as plt
+import numpy as np
 import os
+from sherwood.bars import alpaca_bar_fetcher, BarStore
 from sherwood.db import get_db, POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME, Session
 from sherwood.errors import InternalServerError
 from sherwood.models import BaseModel, TransactionType, User
@@ -17,6 +19,8 @@ from sqlalchemy.engine import URL
 ALPACA_API_KEY_ENV_VAR_NAME = "ALPACA_API_KEY"
 ALPACA_SECRET_KEY_ENV_VAR_NAME = "ALPACA_SECRET_KEY"
 
+BARS_DIRECTORY = "bars/hour"
+
 
 def _validate_env() -> None:
     if os.environ.get(POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME) is None:
@@ -77,31 +81,44 @@ if __name__ == "__main__":
         symbols = list(symbols)
 
         start = user.portfolio.created
-        end = datetime.now()
+        end = datetime.now(timezone.utc)
 
     stock_historical_data_client = StockHistoricalDataClient(
         api_key=os.environ.get(ALPACA_API_KEY_ENV_VAR_NAME),
         secret_key=os.environ.get(ALPACA_SECRET_KEY_ENV_VAR_NAME),
     )
 
-    request = StockBarsRequest(
-        symbol_or_symbols=symbols,
-        timeframe=TimeFrame.Hour,
-        start=start,
-        end=end,
+    bar_store = BarStore(
+        BARS_DIRECTORY,
+        alpaca_bar_fetcher(stock_historical_data_client, TimeFrame.Hour),
     )
+    bar_store.ensure({symbol: (start, end) for symbol in symbols})
 
-    bars = stock_historical_data_client.get_stock_bars(request)
-
-    timestamps = bars.df.index.get_level_values(1).unique().sort_values()
+    timestamps = np.unique(
+        np.concatenate([bar_store.bars(symbol)["timestamp"] for symbol in symbols])
+    )
+    timestamps = timestamps[
+        (timestamps >= start.replace(tzinfo=timezone.utc).timestamp())
+        & (timestamps <= end.timestamp())
+    ]
+    open_by_symbol = {
+        symbol: bar_store.prices_at(symbol, timestamps) for symbol in symbols
+    }
 
     prices = {DOLLAR_SYMBOL: 1}
     units = {DOLLAR_SYMBOL: STARTING_BALANCE}
 
     i_txn = 0
     timecourse = []
-    for timestamp in timestamps:
-        prices.update(bars.df.xs(timestamp, level="timestamp")["open"].to_dict())
+    for i, timestamp in enumerate(timestamps):
+        timestamp = datetime.fromtimestamp(timestamp, timezone.utc)
+        prices.update(
+            {
+                symbol: price
+                for symbol in symbols
+                if not np.isnan(price := open_by_symbol[symbol][i])
+            }
+        )
 
         if i_txn < len(transactions) and transactions[
             i_txn
@@ -135,16 +135,26 @@ setup_sherwood() {
     git clone "${SHERWOOD_REPO}" "${SHERWOOD_DIR}"
   fi
   "${PYTHON}" -m pip install "${SHERWOOD_DIR}" --no-cache-dir
+  # adds columns new code maps before any service starts, converts no data
+  "${PYTHON}" -m sherwood.migrations columns
 
   sudo cp "${SHERWOOD_DIR}"/service /etc/systemd/system/sherwood.service
+  sudo cp "${SHERWOOD_DIR}"/market-data.service /etc/systemd/system/sherwood-market-data.service
+  sudo cp "${SHERWOOD_DIR}"/order-executor.service /etc/systemd/system/sherwood-order-executor.service
   # TODO: --env-file=/root/.env
   sudo systemctl daemon-reload
+  sudo systemctl enable sherwood-market-data
+  sudo systemctl start sherwood-market-data
+  sudo systemctl enable sherwood-order-executor
+  sudo systemctl start sherwood-order-executor
   sudo systemctl enable sherwood
   sudo systemctl start sherwood
 
   sudo mkdir -p /var/www/html/sherwood
   sudo rsync -a --delete /root/sherwood/ui/ /var/www/html/sherwood
 
+  sudo systemctl restart sherwood-market-data
+  sudo systemctl restart sherwood-order-executor
   sudo systemctl restart sherwood
 
   # sudo systemctl status sherwood
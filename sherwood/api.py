@@ -1,8 +1,10 @@
-from datetime import datetime, timezone
+import asyncio
 from fastapi import APIRouter, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
 import logging
 from sherwood.auth import (
+    consume_quote_token,
+    generate_quote_token,
     validate_display_name,
     validate_password,
     AuthorizedUser,
@@ -12,21 +14,47 @@ from sherwood.auth import (
 )
 from sherwood.broker import (
     buy_portfolio_holding,
+    execute_orders,
     sell_portfolio_holding,
     invest_in_portfolio,
     divest_from_portfolio,
+    rebalance_portfolio,
+    Order,
 )
 from sherwood.caching import Cache as cache
-from sherwood.db import Database
+from sherwood.db import retry_transaction, run_sync, AsyncDatabase
 from sherwood.errors import *
 from sherwood.error_handling import HandleErrors as handle_errors
-from sherwood.market_data import get_prices
+from sherwood.exposure import look_through_exposure
+from sherwood.idempotency import Idempotent as idempotent, IdempotencyKey
+from sherwood.investment_graph import investment_graph
+from sherwood.market_data import (
+    circuit_breaker,
+    get_price,
+    get_quotes,
+    negative_cache,
+    quote_cache,
+)
 from sherwood.messages import *
-from sherwood.models import now, to_dict, Ownership, Portfolio, User
+from sherwood.models import (
+    as_utc,
+    now,
+    ownership_percent,
+    to_dict,
+    Ownership,
+    Portfolio,
+    QueuedOrderStatus,
+    User,
+)
+from sherwood.order_queue import enqueue_order, get_queued_order
+from sherwood.quote_hub import quote_hub
 from sherwood.registrar import sign_up_user, sign_in_user
+from sherwood.symbols import get_symbol_index, is_valid_symbol
 
 api_router = APIRouter(prefix="/api")
 
+_QUEUED_ORDER_POLL_INTERVAL_SECONDS = 0.5
+
 
 ###################################################
 # user account routes
@@ -39,7 +67,8 @@ api_router = APIRouter(prefix="/api")
         InternalServerError,
     )
 )
-async def api_sign_up_post(request: SignUpRequest, db: Database) -> SignUpResponse:
+@run_sync
+def api_sign_up_post(request: SignUpRequest, db: AsyncDatabase) -> SignUpResponse:
     sign_up_user(db, request.email, request.display_name, request.password)
     return SignUpResponse(redirect_url="/sherwood/sign-in")
 
@@ -53,8 +82,9 @@ async def api_sign_up_post(request: SignUpRequest, db: Database) -> SignUpRespon
         MissingUserError,
     )
 )
-async def api_sign_in_post(
-    request: SignInRequest, db: Database, secure: CookieSecurity
+@run_sync
+def api_sign_in_post(
+    request: SignInRequest, db: AsyncDatabase, secure: CookieSecurity
 ) -> SignInResponse:
     from sherwood.auth import _decode_access_token
 
@@ -87,13 +117,15 @@ async def api_sign_out_post(response: Response):
         MissingUserError,
     )
 )
-async def api_user_get(user: AuthorizedUser):
+@run_sync
+def api_user_get(db: AsyncDatabase, user: AuthorizedUser):
     return to_dict(user)
 
 
 @api_router.get("/user/{user_id}")
 @handle_errors(tuple())
-async def api_user_user_id_get(db: Database, user_id: int):
+@run_sync
+def api_user_user_id_get(db: AsyncDatabase, user_id: int):
     return to_dict(db.get(User, user_id))
 
 
@@ -101,21 +133,58 @@ async def api_user_user_id_get(db: Database, user_id: int):
 # broker routes
 
 
+@api_router.post("/quote")
+@handle_errors(
+    (
+        InternalServerError,
+        InvalidAccessTokenError,
+        MarketDataProviderError,
+        MissingUserError,
+    )
+)
+@run_sync
+def api_quote_post(
+    request: QuoteRequest, db: AsyncDatabase, user: AuthorizedUser
+) -> QuoteResponse:
+    price = get_price(db, request.symbol, freshness="trade")
+    quote_token, expiration = generate_quote_token(user, request.symbol, price)
+    return QuoteResponse(
+        symbol=request.symbol,
+        price=price,
+        expiration=expiration,
+        quote_token=quote_token,
+    )
+
+
 @api_router.post("/buy")
 @handle_errors(
     (
         DuplicatePortfolioError,
+        IdempotencyKeyInProgressError,
         InsufficientCashError,
         InternalServerError,
         InvalidAccessTokenError,
+        InvalidQuoteTokenError,
+        MarketDataProviderError,
         MissingPortfolioError,
         MissingUserError,
+        RequestValueError,
     )
 )
-async def api_buy_post(
-    request: BuyRequest, db: Database, user: AuthorizedUser
+@run_sync
+@idempotent()
+def api_buy_post(
+    request: BuyRequest,
+    db: AsyncDatabase,
+    user: AuthorizedUser,
+    idempotency_key: IdempotencyKey = None,
 ) -> BuyResponse:
-    buy_portfolio_holding(db, user.portfolio.id, request.symbol, request.dollars)
+    price = None
+    if request.quote_token is not None:
+        price = consume_quote_token(db, request.quote_token, user, request.symbol)
+    buy_portfolio_holding(
+        db, user.portfolio.id, request.symbol, request.dollars, price=price
+    )
     return BuyResponse()
 
 
@@ -123,23 +192,38 @@ async def api_buy_post(
 @handle_errors(
     (
         DuplicatePortfolioError,
+        IdempotencyKeyInProgressError,
         InsufficientHoldingsError,
         InternalServerError,
         InvalidAccessTokenError,
+        InvalidQuoteTokenError,
+        MarketDataProviderError,
         MissingPortfolioError,
         MissingUserError,
+        RequestValueError,
     )
 )
-async def api_sell_post(
-    request: SellRequest, db: Database, user: AuthorizedUser
+@run_sync
+@idempotent()
+def api_sell_post(
+    request: SellRequest,
+    db: AsyncDatabase,
+    user: AuthorizedUser,
+    idempotency_key: IdempotencyKey = None,
 ) -> BuyResponse:
-    sell_portfolio_holding(db, user.portfolio.id, request.symbol, request.dollars)
+    price = None
+    if request.quote_token is not None:
+        price = consume_quote_token(db, request.quote_token, user, request.symbol)
+    sell_portfolio_holding(
+        db, user.portfolio.id, request.symbol, request.dollars, price=price
+    )
     return SellResponse()
 
 
 @api_router.post("/invest")
 @handle_errors(
     (
+        IdempotencyKeyInProgressError,
         InsufficientCashError,
         InsufficientHoldingsError,
         InternalServerError,
@@ -148,8 +232,13 @@ async def api_sell_post(
         RequestValueError,
     )
 )
-async def api_invest_post(
-    request: InvestRequest, db: Database, user: AuthorizedUser
+@run_sync
+@idempotent()
+def api_invest_post(
+    request: InvestRequest,
+    db: AsyncDatabase,
+    user: AuthorizedUser,
+    idempotency_key: IdempotencyKey = None,
 ) -> InvestResponse:
     invest_in_portfolio(
         db,
@@ -163,6 +252,7 @@ async def api_invest_post(
 @api_router.post("/divest")
 @handle_errors(
     (
+        IdempotencyKeyInProgressError,
         InsufficientHoldingsError,
         InternalServerError,
         InvalidAccessTokenError,
@@ -170,8 +260,13 @@ async def api_invest_post(
         RequestValueError,
     )
 )
-async def api_divest_post(
-    request: DivestRequest, db: Database, user: AuthorizedUser
+@run_sync
+@idempotent()
+def api_divest_post(
+    request: DivestRequest,
+    db: AsyncDatabase,
+    user: AuthorizedUser,
+    idempotency_key: IdempotencyKey = None,
 ) -> DivestResponse:
     divest_from_portfolio(
         db,
@@ -182,6 +277,140 @@ async def api_divest_post(
     return DivestResponse()
 
 
+@api_router.post("/orders")
+@handle_errors(
+    (
+        IdempotencyKeyInProgressError,
+        InsufficientCashError,
+        InsufficientHoldingsError,
+        InternalServerError,
+        InvalidAccessTokenError,
+        MarketDataProviderError,
+        MissingHoldingError,
+        MissingOwnershipError,
+        MissingPortfolioError,
+        MissingUserError,
+        RequestValueError,
+    )
+)
+@run_sync
+@idempotent()
+def api_orders_post(
+    request: OrdersRequest,
+    db: AsyncDatabase,
+    user: AuthorizedUser,
+    idempotency_key: IdempotencyKey = None,
+) -> OrdersResponse:
+    execute_orders(
+        db,
+        user.portfolio.id,
+        [
+            Order(
+                order.type,
+                dollars=order.dollars,
+                symbol=order.symbol,
+                investee_portfolio_id=order.investee_portfolio_id,
+            )
+            for order in request.orders
+        ],
+    )
+    return OrdersResponse()
+
+
+@api_router.post("/rebalance")
+@handle_errors(
+    (
+        IdempotencyKeyInProgressError,
+        InsufficientCashError,
+        InsufficientHoldingsError,
+        InternalServerError,
+        InvalidAccessTokenError,
+        MarketDataProviderError,
+        MissingOwnershipError,
+        MissingPortfolioError,
+        MissingUserError,
+        RequestValueError,
+    )
+)
+@run_sync
+@idempotent()
+def api_rebalance_post(
+    request: RebalanceRequest,
+    db: AsyncDatabase,
+    user: AuthorizedUser,
+    idempotency_key: IdempotencyKey = None,
+) -> RebalanceResponse:
+    orders = rebalance_portfolio(
+        db, user.portfolio.id, request.weights, dry_run=request.dry_run
+    )
+    return RebalanceResponse(
+        trades=[
+            OrdersRequest.Order(
+                type=order.type, symbol=order.symbol, dollars=order.dollars
+            )
+            for order in orders
+        ]
+    )
+
+
+@api_router.post("/order-queue")
+@handle_errors(
+    (
+        IdempotencyKeyInProgressError,
+        InternalServerError,
+        InvalidAccessTokenError,
+        MissingUserError,
+        RequestValueError,
+    )
+)
+@run_sync
+@idempotent()
+def api_order_queue_post(
+    request: QueuedOrderRequest,
+    db: AsyncDatabase,
+    user: AuthorizedUser,
+    idempotency_key: IdempotencyKey = None,
+) -> QueuedOrderResponse:
+    order_id = enqueue_order(
+        db,
+        user.portfolio.id,
+        Order(
+            request.type,
+            dollars=request.dollars,
+            symbol=request.symbol,
+            investee_portfolio_id=request.investee_portfolio_id,
+        ),
+    )
+    return QueuedOrderResponse(order_id=order_id, status="queued")
+
+
+def _queued_order_response(db, user, order_id: int) -> QueuedOrderResponse:
+    queued_order = get_queued_order(db, user.portfolio.id, order_id)
+    if queued_order is None:
+        raise MissingQueuedOrderError(order_id)
+    return QueuedOrderResponse(
+        order_id=queued_order.id,
+        status=queued_order.status.value,
+        detail=queued_order.detail,
+    )
+
+
+@api_router.get("/order-queue/{order_id}")
+@handle_errors(
+    (
+        InternalServerError,
+        InvalidAccessTokenError,
+        MissingQueuedOrderError,
+        MissingUserError,
+    )
+)
+@run_sync
+def api_order_queue_order_id_get(
+    order_id: int, db: AsyncDatabase, user: AuthorizedUser
+) -> QueuedOrderResponse:
+    return _queued_order_response(db, user, order_id)
+
+
 ###################################################
 # websockets
 
@@ -210,39 +439,130 @@ async def api_validate_password_websocket(web_socket: WebSocket):
         logging.info("validate password client disconnected")
 
 
+@api_router.websocket("/quotes")
+async def api_quotes_websocket(web_socket: WebSocket):
+    """Clients send {"subscribe": [...]} or {"unsubscribe": [...]} and receive
+    {"symbol": ..., "price": ..., "as_of": ...} whenever a price changes."""
+    await web_socket.accept()
+    subscription = quote_hub.subscription()
+
+    async def _send_forever():
+        while True:
+            await web_socket.send_json(await subscription.get())
+
+    sender = asyncio.create_task(_send_forever())
+    try:
+        while True:
+            request = await web_socket.receive_json()
+            symbols = request.get("subscribe", [])
+            if invalid_symbols := [s for s in symbols if not is_valid_symbol(s)]:
+                subscription.put_latest({"invalid_symbols": invalid_symbols})
+            quote_hub.subscribe(
+                subscription, [s for s in symbols if s not in invalid_symbols]
+            )
+            quote_hub.unsubscribe(subscription, request.get("unsubscribe", []))
+    except WebSocketDisconnect:
+        logging.info("quotes client disconnected")
+    finally:
+        sender.cancel()
+        quote_hub.unsubscribe(subscription)
+
+
+@api_router.websocket("/order-queue/{order_id}")
+async def api_order_queue_websocket(
+    web_socket: WebSocket, order_id: int, db: AsyncDatabase, user: AuthorizedUser
+):
+    """Sends the order's QueuedOrderResponse once it's executed or failed."""
+    await web_socket.accept()
+    try:
+        while True:
+            try:
+                response = await db.run_sync(_queued_order_response, user, order_id)
+            except MissingQueuedOrderError as exc:
+                await web_socket.send_json({"error": {"detail": exc.detail}})
+                break
+            if response.status != QueuedOrderStatus.QUEUED.value:
+                await web_socket.send_json(response.model_dump())
+                break
+            # releases the connection while waiting
+            await db.rollback()
+            await asyncio.sleep(_QUEUED_ORDER_POLL_INTERVAL_SECONDS)
+        await web_socket.close()
+    except WebSocketDisconnect:
+        logging.info("order queue client disconnected")
+
+
+###################################################
+# market data routes
+
+
+@api_router.get("/symbols")
+@handle_errors(tuple())
+async def api_symbols_get(prefix: str, limit: int = 20) -> SymbolsResponse:
+    response = SymbolsResponse(rows=[])
+    if (symbol_index := get_symbol_index()) is None or not prefix:
+        return response
+    for symbol, name in symbol_index.search(prefix.upper(), limit):
+        response.rows.append(SymbolsResponse.Row(symbol=symbol, name=name))
+    return response
+
+
+###################################################
+# instrumentation routes
+
+
+@api_router.get("/status")
+@handle_errors(tuple())
+async def api_status_get() -> StatusResponse:
+    return StatusResponse(
+        quote_cache=quote_cache.stats(),
+        negative_cache=negative_cache.stats(),
+        circuit_breaker=circuit_breaker.stats(),
+        quote_hub=quote_hub.stats(),
+        transactions=retry_transaction.stats(),
+        exposure=look_through_exposure.stats(),
+        investment_graph=investment_graph.stats(),
+    )
+
+
 ###################################################
 # in development
 
 
-def _portfolio_lifetime_return(db, portfolio):
-    price_by_symbol = get_prices(db, [holding.symbol for holding in portfolio.holdings])
+def _get_read_quotes(db, symbols):
+    """Read endpoints serve the last known prices rather than wait on a refresh.
+
+    Returns the prices and the observation time of the oldest one.
+    """
+    quote_by_symbol = get_quotes(db, list(symbols), stale_while_revalidate=True)
+    price_by_symbol = {symbol: price for symbol, (price, _) in quote_by_symbol.items()}
+    as_of = min((as_of for _, as_of in quote_by_symbol.values()), default=None)
+    return price_by_symbol, as_of
+
+
+def _portfolio_lifetime_return(db, portfolio, price_by_symbol):
     self_ownership = db.get(Ownership, (portfolio.id, portfolio.id))
     if self_ownership is None:
         raise MissingOwnershipError(portfolio.id, portfolio.id)
     # should add up to STARTING_BALANCE-cash invested in other portfolios
     cost = sum(holding.cost for holding in portfolio.holdings)
-    value = self_ownership.percent * sum(
+    value = ownership_percent(self_ownership) * sum(
         holding.units * price_by_symbol[holding.symbol]
         for holding in portfolio.holdings
     )
     return value - cost
 
 
-def _portfolio_average_daily_return(db, portfolio):
-    average_daily_return = _portfolio_lifetime_return(db, portfolio)
-    created = portfolio.created
-    if created.tzinfo is None:
-        created = created.replace(tzinfo=timezone.utc)
+def _portfolio_average_daily_return(db, portfolio, price_by_symbol):
+    average_daily_return = _portfolio_lifetime_return(db, portfolio, price_by_symbol)
+    created = as_utc(portfolio.created)
     days = (now() - created).days
     if days > 0:
         average_daily_return /= days
     return average_daily_return
 
 
-def _assets_under_management(db, user):
-    price_by_symbol = get_prices(
-        db, [holding.symbol for holding in user.portfolio.holdings]
-    )
+def _assets_under_management(user, price_by_symbol):
     return sum(
         holding.units * price_by_symbol[holding.symbol]
         for holding in user.portfolio.holdings
@@ -259,25 +579,33 @@ def _assets_under_management(db, user):
         RequestValueError,
     )
 )
-async def api_leaderboard_post(
-    request: LeaderboardRequest, db: Database
+@run_sync
+def api_leaderboard_post(
+    request: LeaderboardRequest, db: AsyncDatabase
 ) -> LeaderboardResponse:
     if request.sort_by not in request.columns:
         raise RequestValueError("sort_by not in columns")
 
+    users = db.query(User).all()
+    price_by_symbol, as_of = _get_read_quotes(
+        db, {holding.symbol for user in users for holding in user.portfolio.holdings}
+    )
+
     Column = LeaderboardRequest.Column
     column_fns = {
         Column.LIFETIME_RETURN: lambda user: _portfolio_lifetime_return(
-            db, user.portfolio
+            db, user.portfolio, price_by_symbol
         ),
         Column.AVERAGE_DAILY_RETURN: lambda user: _portfolio_average_daily_return(
-            db, user.portfolio
+            db, user.portfolio, price_by_symbol
+        ),
+        Column.ASSETS_UNDER_MANAGEMENT: lambda user: _assets_under_management(
+            user, price_by_symbol
         ),
-        Column.ASSETS_UNDER_MANAGEMENT: lambda user: _assets_under_management(db, user),
     }
 
-    response = LeaderboardResponse(rows=[])
-    for user in db.query(User).all():
+    response = LeaderboardResponse(rows=[], as_of=as_of)
+    for user in users:
         row = LeaderboardResponse.Row(
             user_id=user.id,
             user_display_name=user.display_name,
@@ -292,6 +620,29 @@ async def api_leaderboard_post(
     return response
 
 
+def _look_through_holdings(db, request, owner_id):
+    Column = PortfolioHoldingsRequest.Column
+    if unsupported := set(request.columns) - {Column.UNITS, Column.PRICE, Column.VALUE}:
+        raise RequestValueError(
+            f"Unsupported look-through columns: {sorted(c.value for c in unsupported)}."
+        )
+    units_by_symbol = look_through_exposure.units_by_symbol(db, owner_id)
+    response = PortfolioHoldingsResponse(rows=[])
+    price_by_symbol, response.as_of = _get_read_quotes(db, units_by_symbol)
+    column_fns = {
+        Column.UNITS: lambda symbol: units_by_symbol[symbol],
+        Column.PRICE: lambda symbol: price_by_symbol[symbol],
+        Column.VALUE: lambda symbol: units_by_symbol[symbol] * price_by_symbol[symbol],
+    }
+    for symbol in units_by_symbol:
+        row = PortfolioHoldingsResponse.Row(symbol=symbol, columns={})
+        for column in request.columns:
+            row.columns[column] = column_fns[column](symbol)
+        response.rows.append(row)
+    response.rows.sort(key=lambda row: row.columns[request.sort_by], reverse=True)
+    return response
+
+
 @api_router.post("/portfolio-holdings")
 @handle_errors(
     (
@@ -302,14 +653,17 @@ async def api_leaderboard_post(
         RequestValueError,
     )
 )
-async def api_portfolio_holdings_post(
-    request: PortfolioHoldingsRequest, db: Database
+@run_sync
+def api_portfolio_holdings_post(
+    request: PortfolioHoldingsRequest, db: AsyncDatabase
 ) -> PortfolioHoldingsResponse:
     if request.sort_by not in request.columns:
         raise RequestValueError("sort_by not in columns")
     portfolio = db.get(Portfolio, request.portfolio_id)
     if portfolio is None:
         raise MissingPortfolioError(request.portfolio_id)
+    if request.look_through:
+        return _look_through_holdings(db, request, portfolio.id)
     response = PortfolioHoldingsResponse(rows=[])
     if not portfolio.holdings:
         return response
@@ -317,10 +671,12 @@ async def api_portfolio_holdings_post(
     if self_ownership is None:
         raise MissingOwnershipError(portfolio.id, portfolio.id)
 
-    price_by_symbol = get_prices(db, [holding.symbol for holding in portfolio.holdings])
+    price_by_symbol, response.as_of = _get_read_quotes(
+        db, [holding.symbol for holding in portfolio.holdings]
+    )
 
     def _units(h):
-        return h.units * self_ownership.percent
+        return h.units * ownership_percent(self_ownership)
 
     def _value(h):
         return _units(h) * price_by_symbol[h.symbol]
@@ -329,9 +685,7 @@ async def api_portfolio_holdings_post(
         return _value(h) - h.cost
 
     def _average_daily_return(h):
-        created = h.created
-        if created.tzinfo is None:
-            created = created.replace(tzinfo=timezone.utc)
+        created = as_utc(h.created)
         days = (now() - created).days
         if days > 0:
             return _lifetime_return(h) / days
@@ -367,8 +721,9 @@ async def api_portfolio_holdings_post(
         RequestValueError,
     )
 )
-async def api_portfolio_investors_post(
-    request: PortfolioInvestorsRequest, db: Database
+@run_sync
+def api_portfolio_investors_post(
+    request: PortfolioInvestorsRequest, db: AsyncDatabase
 ) -> PortfolioInvestorsResponse:
     if request.sort_by not in request.columns:
         raise RequestValueError("sort_by not in columns")
@@ -386,7 +741,9 @@ async def api_portfolio_investors_post(
     users = db.query(User).filter(User.id.in_(user_ids)).all()
     display_name_by_id = {user.id: user.display_name for user in users}
 
-    price_by_symbol = get_prices(db, [holding.symbol for holding in portfolio.holdings])
+    price_by_symbol, response.as_of = _get_read_quotes(
+        db, [holding.symbol for holding in portfolio.holdings]
+    )
     portfolio_value = sum(
         holding.units * price_by_symbol[holding.symbol]
         for holding in portfolio.holdings
@@ -395,15 +752,16 @@ async def api_portfolio_investors_post(
     Column = PortfolioInvestorsRequest.Column
 
     def _average_daily_return(o):
-        created = o.created
-        if created.tzinfo is None:
-            created.replace(tzinfo=timezone.utc)
-        return (portfolio_value * o.percent - o.cost) / max(1, (now() - created).days)
+        created = as_utc(o.created)
+        return (portfolio_value * ownership_percent(o) - o.cost) / max(
+            1, (now() - created).days
+        )
 
     column_fns = {
         Column.AMOUNT_INVESTED: lambda o: o.cost,
-        Column.VALUE: lambda o: portfolio_value * o.percent,
-        Column.LIFETIME_RETURN: lambda o: portfolio_value * o.percent - o.cost,
+        Column.VALUE: lambda o: portfolio_value * ownership_percent(o),
+        Column.LIFETIME_RETURN: lambda o: portfolio_value * ownership_percent(o)
+        - o.cost,
         Column.AVERAGE_DAILY_RETURN: _average_daily_return,
     }
 
@@ -428,8 +786,9 @@ async def api_portfolio_investors_post(
         MissingPortfolioError,
     )
 )
-async def api_portfolio_history_post(
-    request: PortfolioHistoryRequest, db: Database
+@run_sync
+def api_portfolio_history_post(
+    request: PortfolioHistoryRequest, db: AsyncDatabase
 ) -> PortfolioHistoryResponse:
     portfolio = db.get(Portfolio, request.portfolio_id)
     if portfolio is None:
@@ -459,8 +818,9 @@ async def api_portfolio_history_post(
 
 @api_router.post("/user-investments")
 @handle_errors((InternalServerError,))
-async def api_user_investments_post(
-    request: UserInvestmentsRequest, db: Database
+@run_sync
+def api_user_investments_post(
+    request: UserInvestmentsRequest, db: AsyncDatabase
 ) -> UserInvestmentsResponse:
 
     ownership = db.query(Ownership).filter_by(owner_id=request.user_id).all()
@@ -479,7 +839,7 @@ async def api_user_investments_post(
     symbols = set(
         [holding.symbol for user in users for holding in user.portfolio.holdings]
     )
-    price_by_symbol = get_prices(db, list(symbols))
+    price_by_symbol, response.as_of = _get_read_quotes(db, symbols)
 
     Column = UserInvestmentsRequest.Column
 
@@ -496,17 +856,16 @@ async def api_user_investments_post(
         )
 
         def _average_daily_return(o):
-            created = o.created
-            if created.tzinfo is None:
-                created.replace(tzinfo=timezone.utc)
-            return (portfolio_value * o.percent - o.cost) / max(
+            created = as_utc(o.created)
+            return (portfolio_value * ownership_percent(o) - o.cost) / max(
                 1, (now() - created).days
             )
 
         column_fns = {
             Column.AMOUNT_INVESTED: lambda o: o.cost,
-            Column.VALUE: lambda o: portfolio_value * o.percent,
-            Column.LIFETIME_RETURN: lambda o: portfolio_value * o.percent - o.cost,
+            Column.VALUE: lambda o: portfolio_value * ownership_percent(o),
+            Column.LIFETIME_RETURN: lambda o: portfolio_value * ownership_percent(o)
+            - o.cost,
             Column.AVERAGE_DAILY_RETURN: _average_daily_return,
         }
         for column in request.columns:
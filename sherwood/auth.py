@@ -6,16 +6,19 @@ import jose.jwt
 import os
 from passlib.context import CryptContext
 import re
-from sherwood.db import Database
+from sherwood.db import AsyncDatabase
 from sherwood.errors import (
     InternalServerError,
     InvalidAccessTokenError,
     InvalidDisplayNameError,
     InvalidPasswordError,
+    InvalidQuoteTokenError,
     MissingUserError,
 )
-from sherwood.models import User
+from sherwood.models import IdempotencyRecord, User
 from sqlalchemy.event import listens_for
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 from typing import Annotated
 from uuid import uuid4
 
@@ -28,6 +31,9 @@ _JWT_ISSUER = "sherwood"
 _JWT_ALGORITHM = "HS256"
 _JWT_LIFETIME_HOURS = 4
 
+_QUOTE_TOKEN_AUDIENCE = "quote"
+_QUOTE_TOKEN_LIFETIME_SECONDS = 10
+
 _MIN_DISPLAY_NAME_LENGTH = 3
 _MAX_DISPLAY_NAME_LENGTH = 32
 
@@ -144,8 +150,91 @@ def _decode_access_token(access_token: str) -> dict[str, str]:
         ) from exc
 
 
+def generate_quote_token(
+    user, symbol: str, price: float, seconds: float = _QUOTE_TOKEN_LIFETIME_SECONDS
+) -> tuple[str, datetime.datetime]:
+    """Signs a price for user to trade symbol at until the returned expiration."""
+    _validate_env()
+    issued_at = datetime.datetime.now(datetime.timezone.utc)
+    expiration = issued_at + datetime.timedelta(seconds=seconds)
+    try:
+        quote_token = jose.jwt.encode(
+            claims={
+                "iss": _JWT_ISSUER,
+                "aud": _QUOTE_TOKEN_AUDIENCE,
+                "sub": str(user.id),
+                "exp": timegm(expiration.utctimetuple()),
+                "iat": timegm(issued_at.utctimetuple()),
+                "jti": str(uuid4()),
+                "symbol": symbol,
+                "price": price,
+            },
+            key=os.environ[JWT_SECRET_KEY_ENV_VAR_NAME],
+            algorithm=_JWT_ALGORITHM,
+        )
+    except jose.jwt.JWTError as exc:
+        raise InternalServerError(
+            f"Failed to generate quote token. Error: {exc}"
+        ) from exc
+    return quote_token, expiration
+
+
+def _decode_quote_token_claims(quote_token: str, user, symbol: str) -> dict:
+    _validate_env()
+    try:
+        claims = jose.jwt.decode(
+            quote_token,
+            key=os.environ[JWT_SECRET_KEY_ENV_VAR_NAME],
+            algorithms=[_JWT_ALGORITHM],
+            issuer=_JWT_ISSUER,
+            audience=_QUOTE_TOKEN_AUDIENCE,
+            options={"require_aud": True},
+        )
+    except (
+        jose.jwt.ExpiredSignatureError,
+        jose.jwt.JWTClaimsError,
+        jose.jwt.JWTError,
+    ) as exc:
+        raise InvalidQuoteTokenError(f"Failed to decode. Error: {exc}.") from exc
+    if claims["sub"] != str(user.id):
+        raise InvalidQuoteTokenError("Quoted for another user.")
+    if claims["symbol"] != symbol:
+        raise InvalidQuoteTokenError(f"Quoted for {claims['symbol']}, not {symbol}.")
+    return claims
+
+
+def decode_quote_token(quote_token: str, user, symbol: str) -> float:
+    """Gets the price signed for user and symbol, if the quote hasn't expired."""
+    return _decode_quote_token_claims(quote_token, user, symbol)["price"]
+
+
+def consume_quote_token(db: Session, quote_token: str, user, symbol: str) -> float:
+    """Like decode_quote_token, but each quote token can only be used once.
+
+    The token's jti is recorded as an idempotency record, which outlives the
+    token and is purged with the rest, see idempotency. A token is spent even if
+    the order it's used for then fails.
+    """
+    claims = _decode_quote_token_claims(quote_token, user, symbol)
+    db.add(
+        IdempotencyRecord(
+            user_id=user.id,
+            key=f"{_QUOTE_TOKEN_AUDIENCE}:{claims['jti']}",
+            fingerprint=claims["jti"],
+            status_code=200,
+            response="null",
+        )
+    )
+    try:
+        db.commit()
+    except IntegrityError as exc:
+        db.rollback()
+        raise InvalidQuoteTokenError("Quote token was already used.") from exc
+    return claims["price"]
+
+
 async def authorized_user(
-    db: Database, x_sherwood_authorization: Annotated[str | None, Cookie()] = None
+    db: AsyncDatabase, x_sherwood_authorization: Annotated[str | None, Cookie()] = None
 ):
     if x_sherwood_authorization is None:
         raise InvalidAccessTokenError(detail="Missing X-Sherwood-Authorization.")
@@ -157,7 +246,7 @@ async def authorized_user(
     payload = _decode_access_token(access_token)
 
     user_id = payload["sub"]
-    if (user := db.get(User, user_id)) is None:
+    if (user := await db.get(User, int(user_id))) is None:
         raise MissingUserError(user_id=user_id)
 
     return user
@@ -0,0 +1,180 @@
+"""Local historical bar store.
+
+Bars are kept per symbol in a directory as one .npy file per column, sorted by
+timestamp and memory-mapped on read, so a scan over one column doesn't page in
+the others:
+
+  {symbol}.timestamp.npy int64 epoch seconds
+  {symbol}.open.npy      float64 open prices
+  {symbol}.close.npy     float64 close prices
+  {symbol}.coverage.npy  (n, 2) array of the [start, end] ranges already
+                         fetched, so gaps without bars (nights, weekends) aren't
+                         fetched again
+
+BarStore.ensure works out which parts of the requested ranges are missing and
+fetches them in bulk, one request per distinct range for all symbols missing it.
+"""
+
+from alpaca.data import StockBarsRequest
+from collections.abc import Callable
+from datetime import datetime, timezone
+import numpy as np
+import os
+from sherwood.models import as_utc
+
+BAR_DTYPE_BY_FIELD = {"timestamp": "<i8", "open": "<f8", "close": "<f8"}
+
+# fetch_bars(symbols, start, end) -> {symbol: (timestamps, opens, closes)}
+BarFetcher = Callable[[list[str], datetime, datetime], dict[str, tuple]]
+
+
+def _epoch_seconds(timestamp: datetime) -> int:
+    return int(as_utc(timestamp).timestamp())
+
+
+def _merge_ranges(ranges) -> list[tuple[int, int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _missing_ranges(covered, start: int, end: int) -> list[tuple[int, int]]:
+    missing = []
+    for covered_start, covered_end in covered:
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+class BarStore:
+    def __init__(self, directory: str, fetch_bars: BarFetcher):
+        self._directory = directory
+        self._fetch_bars = fetch_bars
+        self._bars_by_symbol: dict[str, dict[str, np.ndarray]] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, symbol: str, suffix: str = "") -> str:
+        return os.path.join(
+            self._directory, f"{symbol.replace(os.sep, '_')}{suffix}.npy"
+        )
+
+    def _coverage(self, symbol: str) -> list[tuple[int, int]]:
+        if not os.path.exists(path := self._path(symbol, ".coverage")):
+            return []
+        return [(int(start), int(end)) for start, end in np.load(path)]
+
+    def bars(self, symbol: str) -> dict[str, np.ndarray]:
+        """Gets the symbol's stored bars by field, each column memory-mapped."""
+        if (bars := self._bars_by_symbol.get(symbol)) is None:
+            bars = {}
+            for field, dtype in BAR_DTYPE_BY_FIELD.items():
+                if os.path.exists(path := self._path(symbol, f".{field}")):
+                    bars[field] = np.load(path, mmap_mode="r")
+                else:
+                    bars[field] = np.empty(0, dtype=dtype)
+            self._bars_by_symbol[symbol] = bars
+        return bars
+
+    def _save(self, path: str, array: np.ndarray) -> None:
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+    def _store(self, symbol: str, new_bars: dict[str, np.ndarray], ranges) -> None:
+        bars = {
+            field: np.concatenate([self.bars(symbol)[field], new_bars[field]])
+            for field in BAR_DTYPE_BY_FIELD
+        }
+        # later fetches win for duplicate timestamps
+        _, i = np.unique(bars["timestamp"][::-1], return_index=True)
+        self._bars_by_symbol.pop(symbol, None)
+        for field, column in bars.items():
+            self._save(self._path(symbol, f".{field}"), column[::-1][i])
+        coverage = _merge_ranges(self._coverage(symbol) + list(ranges))
+        self._save(self._path(symbol, ".coverage"), np.array(coverage, dtype="<i8"))
+
+    def ensure(self, range_by_symbol: dict[str, tuple[datetime, datetime]]) -> None:
+        """Fetches whatever parts of the symbols' ranges aren't stored yet."""
+        symbols_by_range = {}
+        for symbol, (start, end) in range_by_symbol.items():
+            for missing in _missing_ranges(
+                self._coverage(symbol), _epoch_seconds(start), _epoch_seconds(end)
+            ):
+                symbols_by_range.setdefault(missing, []).append(symbol)
+
+        ranges_by_symbol, fetched_by_symbol = {}, {}
+        for (start, end), symbols in sorted(symbols_by_range.items()):
+            bars_by_symbol = self._fetch_bars(
+                symbols,
+                datetime.fromtimestamp(start, timezone.utc),
+                datetime.fromtimestamp(end, timezone.utc),
+            )
+            for symbol in symbols:
+                ranges_by_symbol.setdefault(symbol, []).append((start, end))
+                if symbol not in bars_by_symbol:
+                    continue
+                fetched_by_symbol.setdefault(symbol, []).append(
+                    dict(zip(BAR_DTYPE_BY_FIELD, bars_by_symbol[symbol]))
+                )
+
+        for symbol, ranges in ranges_by_symbol.items():
+            fetched = fetched_by_symbol.get(symbol, [])
+            new_bars = {
+                field: np.concatenate(
+                    [np.asarray(bars[field], dtype=dtype) for bars in fetched]
+                    + [np.empty(0, dtype=dtype)]
+                )
+                for field, dtype in BAR_DTYPE_BY_FIELD.items()
+            }
+            self._store(symbol, new_bars, ranges)
+
+    def prices_at(self, symbol: str, timestamps, field: str = "open") -> np.ndarray:
+        """Gets the price of the last bar at or before each timestamp (epoch
+        seconds or datetimes), NaN before the first bar."""
+        timestamps = np.asarray(
+            [
+                _epoch_seconds(t) if isinstance(t, datetime) else t
+                for t in np.atleast_1d(timestamps)
+            ],
+            dtype="<i8",
+        )
+        bars = self.bars(symbol)
+        i = np.searchsorted(bars["timestamp"], timestamps, side="right") - 1
+        prices = np.full(len(timestamps), np.nan)
+        prices[i >= 0] = bars[field][i[i >= 0]]
+        return prices
+
+    def price_at(self, symbol: str, timestamp, field: str = "open") -> float:
+        return float(self.prices_at(symbol, [timestamp], field)[0])
+
+
+def alpaca_bar_fetcher(client, timeframe) -> BarFetcher:
+    """Fetches bars from Alpaca, e.g. alpaca_bar_fetcher(client, TimeFrame.Hour)."""
+
+    def fetch_bars(symbols, start, end):
+        request = StockBarsRequest(
+            symbol_or_symbols=symbols, timeframe=timeframe, start=start, end=end
+        )
+        df = client.get_stock_bars(request).df
+        if df.empty:
+            return {}
+        bars_by_symbol = {}
+        for symbol in df.index.get_level_values("symbol").unique():
+            rows = df.xs(symbol, level="symbol")
+            bars_by_symbol[symbol] = (
+                rows.index.map(_epoch_seconds).to_numpy(dtype="<i8"),
+                rows["open"].to_numpy(dtype="<f8"),
+                rows["close"].to_numpy(dtype="<f8"),
+            )
+        return bars_by_symbol
+
+    return fetch_bars
@@ -1,3 +1,5 @@
+from dataclasses import dataclass
+import numpy as np
 from sherwood.errors import (
     InsufficientCashError,
     InsufficientHoldingsError,
@@ -7,15 +9,28 @@ from sherwood.errors import (
     MissingPortfolioError,
     RequestValueError,
 )
-from sherwood.db import maybe_commit
+from sherwood.db import maybe_commit, retry_transaction
+from sherwood.investment_graph import investment_graph
 from sherwood.market_data import get_price, get_prices, DOLLAR_SYMBOL
-from sherwood.models import Holding, Ownership, Portfolio, Transaction, TransactionType
-from sqlalchemy.orm import Session
-
+from sherwood.models import (
+    ownership_percent,
+    Holding,
+    Ownership,
+    Portfolio,
+    Transaction,
+    TransactionType,
+)
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload, Session
+import time
 
 _MIN_INVESTEE_PORTFOLIO_VALUE = 0.01
 _MIN_INVESTOR_PORTFOLIO_OWNERSHIP_PERCENT = 0.01
 
+_MAX_PRICING_ATTEMPTS = 3
+_MIN_REBALANCE_DOLLARS = 0.01
+_MAX_REBALANCE_WEIGHT_ERROR = 1e-6
+
 
 # holding.cost: from owner's perspective
 # holding.units: from fund's perspective
@@ -28,89 +43,181 @@ _MIN_INVESTOR_PORTFOLIO_OWNERSHIP_PERCENT = 0.01
 def _lock_portfolios(db: Session, portfolio_ids: list[int]) -> dict[int, Portfolio]:
     if not portfolio_ids:
         raise ValueError("Must provide at least 1 portfolio to lock")
-    condition = Portfolio.id == portfolio_ids[0]
-    for portfolio_id in portfolio_ids[1:]:
-        condition |= Portfolio.id == portfolio_id
-    portfolios = db.query(Portfolio).filter(condition).with_for_update().all()
+    # rows are locked in id order so concurrent transactions can't deadlock
+    portfolio_ids = sorted(set(portfolio_ids))
+    # the locking statement is timed on its own, without the eager loads
+    start = time.monotonic()
+    db.execute(
+        select(Portfolio.id)
+        .where(Portfolio.id.in_(portfolio_ids))
+        .order_by(Portfolio.id)
+        .with_for_update()
+    ).all()
+    retry_transaction.record_lock_wait(time.monotonic() - start)
+    # populate_existing and the eager loads refresh state read before the lock
+    portfolios = (
+        db.query(Portfolio)
+        .filter(Portfolio.id.in_(portfolio_ids))
+        .order_by(Portfolio.id)
+        .options(selectinload(Portfolio.holdings), selectinload(Portfolio.ownership))
+        .populate_existing()
+        .all()
+    )
     portfolio_by_id = {portfolio.id: portfolio for portfolio in portfolios}
     if missing := set(portfolio_ids) - set(portfolio_by_id):
         raise MissingPortfolioError(", ".join(map(str, missing)))
     return portfolio_by_id
 
 
+def _lock_priced_portfolios(
+    db: Session, portfolio_ids: list[int], symbols=()
+) -> tuple[dict[int, Portfolio], dict[str, float]]:
+    """Prices every holding of the portfolios, and symbols, with no locks held,
+    then locks the portfolios.
+
+    Prices can take a provider round trip, so they're resolved before the lock.
+    If a holding appeared in between (e.g. a concurrent buy), the prices no longer
+    cover the portfolios, so the lock is released and pricing retried.
+    """
+    for _ in range(_MAX_PRICING_ATTEMPTS):
+        held_symbols = {
+            symbol
+            for (symbol,) in db.query(Holding.symbol)
+            .filter(Holding.portfolio_id.in_(portfolio_ids))
+            .distinct()
+        }
+        price_by_symbol = get_prices(
+            db, sorted(held_symbols.union(symbols)), freshness="trade"
+        )
+        portfolio_by_id = _lock_portfolios(db, portfolio_ids)
+        locked_symbols = {
+            holding.symbol
+            for portfolio in portfolio_by_id.values()
+            for holding in portfolio.holdings
+        }
+        if locked_symbols <= set(price_by_symbol):
+            return portfolio_by_id, price_by_symbol
+        db.rollback()
+    raise InternalServerError(
+        f"Holdings changed while pricing portfolios: {portfolio_ids}."
+    )
+
+
 def _convert_dollars_to_units(db, symbol: str, dollars: float) -> float:
-    return dollars / get_price(db, symbol=symbol, delay_seconds=0)
+    return dollars / get_price(db, symbol=symbol, freshness="trade")
 
 
-def buy_portfolio_holding(db: Session, portfolio_id, symbol: str, dollars: float):
-    """Buys holding in owner's portfolio."""
-    portfolio = _lock_portfolios(db, [portfolio_id])[portfolio_id]
-    self_ownership = db.get(Ownership, (portfolio_id, portfolio_id))
+def _find_holding(portfolio: Portfolio, symbol: str) -> Holding | None:
+    # the loaded collections, unlike db.get, see holdings added by earlier orders
+    return next((h for h in portfolio.holdings if h.symbol == symbol), None)
+
+
+def _find_ownership(portfolio: Portfolio, owner_id: int) -> Ownership | None:
+    return next((o for o in portfolio.ownership if o.owner_id == owner_id), None)
+
+
+def _new_ownership(portfolio: Portfolio, owner_id: int) -> Ownership:
+    if portfolio.shares is None:
+        return Ownership(portfolio.id, owner_id, 0, 0)
+    return Ownership(portfolio.id, owner_id, 0, None, shares=0)
+
+
+def _redeem(portfolio: Portfolio, dollars: float, price_by_symbol: dict[str, float]):
+    """Pays dollars out of a share-based portfolio, from its cash first and only
+    then by selling the other holdings pro rata."""
+    dollar_holding = _find_holding(portfolio, DOLLAR_SYMBOL)
+    cash = 0 if dollar_holding is None else dollar_holding.units
+    if dollars <= cash:
+        dollar_holding.units -= dollars
+        return
+    if dollar_holding is not None:
+        dollar_holding.units = 0
+    holdings = [h for h in portfolio.holdings if h.symbol != DOLLAR_SYMBOL]
+    value = sum(h.units * price_by_symbol[h.symbol] for h in holdings)
+    for holding in holdings:
+        holding.units *= 1 - (dollars - cash) / value
+
+
+def _apply_buy(
+    db: Session, portfolio: Portfolio, symbol: str, dollars: float, price: float
+):
+    self_ownership = _find_ownership(portfolio, portfolio.id)
     if self_ownership is None:
-        raise MissingOwnershipError(portfolio_id, portfolio_id)
-    dollar_holding = db.get(Holding, (portfolio.id, DOLLAR_SYMBOL))
+        raise MissingOwnershipError(portfolio.id, portfolio.id)
+    self_percent = ownership_percent(self_ownership)
+    dollar_holding = _find_holding(portfolio, DOLLAR_SYMBOL)
     if dollar_holding is None:
         raise MissingHoldingError(portfolio.id, DOLLAR_SYMBOL)
-    if dollars > dollar_holding.units * self_ownership.percent:
+    if dollars > dollar_holding.units * self_percent:
         raise InsufficientCashError(
-            needed=dollars, actual=dollar_holding.units * self_ownership.percent
+            needed=dollars, actual=dollar_holding.units * self_percent
         )
-    holding = db.get(Holding, (portfolio_id, symbol))
+    holding = _find_holding(portfolio, symbol)
     if holding is None:
-        portfolio.holdings.append(Holding(portfolio_id, symbol, 0, 0))
+        portfolio.holdings.append(Holding(portfolio.id, symbol, 0, 0))
         holding = portfolio.holdings[-1]
     dollar_holding.cost -= dollars
     holding.cost += dollars
-    group_dollars = dollars / self_ownership.percent
+    group_dollars = dollars / self_percent
     dollar_holding.units -= group_dollars
-    price = get_price(db, symbol=symbol, delay_seconds=0)
     holding.units += group_dollars / price
     txn = Transaction(
-        portfolio_id=portfolio_id,
+        portfolio_id=portfolio.id,
         type=TransactionType.BUY,
         asset=symbol,
         dollars=dollars,
         price=price,
     )
     db.add(txn)
-    maybe_commit(db, "Failed to buy holding.")
 
 
-def sell_portfolio_holding(db: Session, portfolio_id: int, symbol: str, dollars: float):
-    """Sells holding in owner's portfolio."""
-    portfolio = _lock_portfolios(db, [portfolio_id])[portfolio_id]
-    holding = db.get(Holding, (portfolio_id, symbol))
+def _apply_sell(
+    db: Session,
+    portfolio: Portfolio,
+    symbol: str,
+    dollars: float | None,
+    price: float,
+):
+    """Sells dollars of the holding, or all of it if dollars is None."""
+    holding = _find_holding(portfolio, symbol)
     if holding is None:
-        raise MissingHoldingError(portfolio_id, symbol)
-    dollar_holding = db.get(Holding, (portfolio.id, DOLLAR_SYMBOL))
+        raise MissingHoldingError(portfolio.id, symbol)
+    dollar_holding = _find_holding(portfolio, DOLLAR_SYMBOL)
     if dollar_holding is None:
         raise MissingHoldingError(portfolio.id, DOLLAR_SYMBOL)
-    self_ownership = db.get(Ownership, (portfolio_id, portfolio_id))
+    self_ownership = _find_ownership(portfolio, portfolio.id)
     if self_ownership is None:
-        raise MissingOwnershipError(portfolio_id, portfolio_id)
-    price = get_price(db, symbol=symbol, delay_seconds=0)
-    units = dollars / price
-    if units > holding.units * self_ownership.percent:
+        raise MissingOwnershipError(portfolio.id, portfolio.id)
+    self_percent = ownership_percent(self_ownership)
+    if dollars is None:
+        units = holding.units * self_percent
+        dollars = units * price
+    else:
+        units = dollars / price
+    if units > holding.units * self_percent:
         raise InsufficientHoldingsError(
-            symbol, needed=units / self_ownership.percent, actual=holding.units
+            symbol, needed=units / self_percent, actual=holding.units
         )
     holding.cost -= dollars
     dollar_holding.cost += dollars
-    holding.units -= units / self_ownership.percent
-    dollar_holding.units += dollars / self_ownership.percent
+    holding.units -= units / self_percent
+    dollar_holding.units += dollars / self_percent
     txn = Transaction(
-        portfolio_id=portfolio_id,
+        portfolio_id=portfolio.id,
         type=TransactionType.SELL,
         asset=symbol,
         dollars=dollars,
         price=price,
     )
     db.add(txn)
-    maybe_commit(db, "Failed to sell holding.")
 
 
-def invest_in_portfolio(
-    db: Session, investee_portfolio_id: int, investor_portfolio_id: int, dollars: float
+def _apply_invest(
+    db: Session,
+    investee_portfolio: Portfolio,
+    investor_portfolio: Portfolio,
+    dollars: float,
+    price_by_symbol: dict[str, float],
 ):
     """
 
@@ -120,26 +227,24 @@ def invest_in_portfolio(
     p2 invests all cash in p3
 
     """
-    if investee_portfolio_id == investor_portfolio_id:
-        raise RequestValueError("Self-invest prohibited")
+    investee_portfolio_id = investee_portfolio.id
+    investor_portfolio_id = investor_portfolio.id
 
-    portfolio_by_id = _lock_portfolios(
-        db, [investee_portfolio_id, investor_portfolio_id]
-    )
-    investee_portfolio = portfolio_by_id[investee_portfolio_id]
-    investor_portfolio = portfolio_by_id[investor_portfolio_id]
+    if investment_graph.would_create_cycle(
+        db, investor_portfolio_id, investee_portfolio_id
+    ):
+        raise RequestValueError("Investment cycle prohibited")
 
-    investor_dollar_holding = db.get(Holding, (investor_portfolio_id, DOLLAR_SYMBOL))
+    investor_dollar_holding = _find_holding(investor_portfolio, DOLLAR_SYMBOL)
     if investor_dollar_holding is None:
         raise MissingHoldingError(investor_portfolio_id, DOLLAR_SYMBOL)
-    investor_self_ownership = db.get(
-        Ownership, (investor_portfolio_id, investor_portfolio_id)
-    )
+    investor_self_ownership = _find_ownership(investor_portfolio, investor_portfolio_id)
     if investor_self_ownership is None:
         raise MissingOwnershipError(investor_portfolio_id, investor_portfolio_id)
-    if dollars > investor_dollar_holding.units * investor_self_ownership.percent:
+    investor_self_percent = ownership_percent(investor_self_ownership)
+    if dollars > investor_dollar_holding.units * investor_self_percent:
         raise InsufficientCashError(
-            dollars, investor_dollar_holding.units * investor_self_ownership.percent
+            dollars, investor_dollar_holding.units * investor_self_percent
         )
 
     investee_portfolio_owner_ids = set(
@@ -148,15 +253,6 @@ def invest_in_portfolio(
     if investee_portfolio_id not in investee_portfolio_owner_ids:
         raise MissingOwnershipError(investee_portfolio_id, investee_portfolio_id)
 
-    price_by_symbol = get_prices(
-        db,
-        symbols=[
-            holding.symbol
-            for holding in investee_portfolio.holdings + investor_portfolio.holdings
-        ],
-        delay_seconds=0,
-    )
-
     investee_portfolio_value = sum(
         holding.units * price_by_symbol[holding.symbol]
         for holding in investee_portfolio.holdings
@@ -172,7 +268,7 @@ def invest_in_portfolio(
     investee_portfolio_value_percent_increase = dollars / investee_portfolio_value
     investor_portfolio_value_percent_decrease = dollars / investor_portfolio_value
 
-    if (investor_self_ownership.percent - investor_portfolio_value_percent_decrease) / (
+    if (investor_self_percent - investor_portfolio_value_percent_decrease) / (
         1 - investor_portfolio_value_percent_decrease
     ) < _MIN_INVESTOR_PORTFOLIO_OWNERSHIP_PERCENT:
         raise InternalServerError(
@@ -181,32 +277,49 @@ def invest_in_portfolio(
 
     investor_dollar_holding.units -= dollars
     investor_dollar_holding.cost -= dollars
-    for holding in investee_portfolio.holdings:
-        holding.units *= 1 + investee_portfolio_value_percent_increase
 
     if investor_portfolio_id in investee_portfolio_owner_ids:
-        is_investors = lambda ownership: ownership.owner_id == investor_portfolio_id
-        investee_portfolio_investor_ownership = next(
-            filter(is_investors, investee_portfolio.ownership)
+        investee_portfolio_investor_ownership = _find_ownership(
+            investee_portfolio, investor_portfolio_id
         )
     else:
-        ownership = Ownership(investee_portfolio_id, investor_portfolio_id, 0, 0)
-        investee_portfolio.ownership.append(ownership)
+        investee_portfolio.ownership.append(
+            _new_ownership(investee_portfolio, investor_portfolio_id)
+        )
         investee_portfolio_investor_ownership = investee_portfolio.ownership[-1]
 
     investee_portfolio_investor_ownership.cost += dollars
     investor_self_ownership.cost -= dollars
 
-    investee_portfolio_investor_ownership.percent += (
-        investee_portfolio_value_percent_increase
-    )
-    investor_self_ownership.percent -= investor_portfolio_value_percent_decrease
-
-    for ownership in investee_portfolio.ownership:
-        ownership.percent /= 1 + investee_portfolio_value_percent_increase
-
-    for ownership in investor_portfolio.ownership:
-        ownership.percent /= 1 - investor_portfolio_value_percent_decrease
+    if investee_portfolio.shares is None:
+        for holding in investee_portfolio.holdings:
+            holding.units *= 1 + investee_portfolio_value_percent_increase
+        investee_portfolio_investor_ownership.percent += (
+            investee_portfolio_value_percent_increase
+        )
+        for ownership in investee_portfolio.ownership:
+            ownership.percent /= 1 + investee_portfolio_value_percent_increase
+    else:
+        # mints shares at NAV and keeps the dollars as cash, touching O(1) rows
+        shares = investee_portfolio_value_percent_increase * investee_portfolio.shares
+        investee_portfolio.shares += shares
+        investee_portfolio_investor_ownership.shares += shares
+        investee_dollar_holding = _find_holding(investee_portfolio, DOLLAR_SYMBOL)
+        if investee_dollar_holding is None:
+            investee_portfolio.holdings.append(
+                Holding(investee_portfolio_id, DOLLAR_SYMBOL, 0, 0)
+            )
+            investee_dollar_holding = investee_portfolio.holdings[-1]
+        investee_dollar_holding.units += dollars
+
+    if investor_portfolio.shares is None:
+        investor_self_ownership.percent -= investor_portfolio_value_percent_decrease
+        for ownership in investor_portfolio.ownership:
+            ownership.percent /= 1 - investor_portfolio_value_percent_decrease
+    else:
+        shares = investor_portfolio_value_percent_decrease * investor_portfolio.shares
+        investor_portfolio.shares -= shares
+        investor_self_ownership.shares -= shares
 
     txn = Transaction(
         portfolio_id=investor_portfolio_id,
@@ -215,54 +328,39 @@ def invest_in_portfolio(
         dollars=dollars,
     )
     db.add(txn)
-    maybe_commit(db, "Failed to invest in portfolio.")
 
 
-def divest_from_portfolio(
-    db: Session, investee_portfolio_id: int, investor_portfolio_id: int, dollars: float
+def _apply_divest(
+    db: Session,
+    investee_portfolio: Portfolio,
+    investor_portfolio: Portfolio,
+    dollars: float,
+    price_by_symbol: dict[str, float],
 ):
-    if investee_portfolio_id == investor_portfolio_id:
-        raise RequestValueError("Self-divest prohibited")
-    investor_dollar_holding = db.get(Holding, (investor_portfolio_id, DOLLAR_SYMBOL))
+    investee_portfolio_id = investee_portfolio.id
+    investor_portfolio_id = investor_portfolio.id
+
+    investor_dollar_holding = _find_holding(investor_portfolio, DOLLAR_SYMBOL)
     if investor_dollar_holding is None:
         raise MissingHoldingError(investor_portfolio_id, DOLLAR_SYMBOL)
-    investor_portfolio_self_ownership = db.get(
-        Ownership, (investor_portfolio_id, investor_portfolio_id)
+    investor_portfolio_self_ownership = _find_ownership(
+        investor_portfolio, investor_portfolio_id
     )
     if investor_portfolio_self_ownership is None:
         raise MissingOwnershipError(investor_portfolio_id, investor_portfolio_id)
 
-    portfolio_by_id = _lock_portfolios(
-        db, [investee_portfolio_id, investor_portfolio_id]
+    investee_portfolio_investor_ownership = _find_ownership(
+        investee_portfolio, investor_portfolio_id
     )
-    investee_portfolio = portfolio_by_id[investee_portfolio_id]
-    investor_portfolio = portfolio_by_id[investor_portfolio_id]
-
-    investee_portfolio_owner_ids = {
-        ownership.owner_id for ownership in investee_portfolio.ownership
-    }
-    if investor_portfolio_id not in investee_portfolio_owner_ids:
+    if investee_portfolio_investor_ownership is None:
         raise MissingOwnershipError(investee_portfolio_id, investor_portfolio_id)
 
-    is_investors = lambda ownership: ownership.owner_id == investor_portfolio_id
-    investee_portfolio_investor_ownership = next(
-        filter(is_investors, investee_portfolio.ownership)
-    )
-
-    price_by_symbol = get_prices(
-        db,
-        symbols=[
-            holding.symbol
-            for holding in investee_portfolio.holdings + investor_portfolio.holdings
-        ],
-        delay_seconds=0,
-    )
     investee_portfolio_value = sum(
         holding.units * price_by_symbol[holding.symbol]
         for holding in investee_portfolio.holdings
     )
-    investee_portfolio_investor_value = (
-        investee_portfolio_value * investee_portfolio_investor_ownership.percent
+    investee_portfolio_investor_value = investee_portfolio_value * ownership_percent(
+        investee_portfolio_investor_ownership
     )
     if dollars > investee_portfolio_investor_value:
         # InsufficientValueError?
@@ -275,8 +373,11 @@ def divest_from_portfolio(
     investee_portfolio_value_percent_decrease = dollars / investee_portfolio_value
     investor_portfolio_value_percent_increase = dollars / investor_portfolio_value
 
-    for holding in investee_portfolio.holdings:
-        holding.units *= 1 - investee_portfolio_value_percent_decrease
+    if investee_portfolio.shares is None:
+        for holding in investee_portfolio.holdings:
+            holding.units *= 1 - investee_portfolio_value_percent_decrease
+    else:
+        _redeem(investee_portfolio, dollars, price_by_symbol)
 
     investor_dollar_holding.units += dollars
 
@@ -289,17 +390,27 @@ def divest_from_portfolio(
     investor_portfolio_self_ownership.cost += cost
     investor_dollar_holding.cost += cost
 
-    investee_portfolio_investor_ownership.percent -= (
-        investee_portfolio_value_percent_decrease
-    )
-    for ownership in investee_portfolio.ownership:
-        ownership.percent /= 1 - investee_portfolio_value_percent_decrease
+    if investee_portfolio.shares is None:
+        investee_portfolio_investor_ownership.percent -= (
+            investee_portfolio_value_percent_decrease
+        )
+        for ownership in investee_portfolio.ownership:
+            ownership.percent /= 1 - investee_portfolio_value_percent_decrease
+    else:
+        shares = investee_portfolio_value_percent_decrease * investee_portfolio.shares
+        investee_portfolio.shares -= shares
+        investee_portfolio_investor_ownership.shares -= shares
 
-    investor_portfolio_self_ownership.percent += (
-        investor_portfolio_value_percent_increase
-    )
-    for ownership in investor_portfolio.ownership:
-        ownership.percent /= 1 + investor_portfolio_value_percent_increase
+    if investor_portfolio.shares is None:
+        investor_portfolio_self_ownership.percent += (
+            investor_portfolio_value_percent_increase
+        )
+        for ownership in investor_portfolio.ownership:
+            ownership.percent /= 1 + investor_portfolio_value_percent_increase
+    else:
+        shares = investor_portfolio_value_percent_increase * investor_portfolio.shares
+        investor_portfolio.shares += shares
+        investor_portfolio_self_ownership.shares += shares
 
     txn = Transaction(
         portfolio_id=investor_portfolio_id,
@@ -308,4 +419,281 @@ def divest_from_portfolio(
         dollars=dollars,
     )
     db.add(txn)
+
+
+@retry_transaction
+def buy_portfolio_holding(
+    db: Session,
+    portfolio_id,
+    symbol: str,
+    dollars: float,
+    price: float | None = None,
+):
+    """Buys holding in owner's portfolio, at price if given (e.g. from a quote
+    token), otherwise at the provider's price fetched before locking."""
+    if price is None:
+        price = get_price(db, symbol=symbol, freshness="trade")
+    portfolio = _lock_portfolios(db, [portfolio_id])[portfolio_id]
+    _apply_buy(db, portfolio, symbol, dollars, price)
+    maybe_commit(db, "Failed to buy holding.")
+
+
+@retry_transaction
+def sell_portfolio_holding(
+    db: Session,
+    portfolio_id: int,
+    symbol: str,
+    dollars: float,
+    price: float | None = None,
+):
+    """Sells holding in owner's portfolio, at price if given (e.g. from a quote
+    token), otherwise at the provider's price fetched before locking."""
+    if price is None:
+        price = get_price(db, symbol=symbol, freshness="trade")
+    portfolio = _lock_portfolios(db, [portfolio_id])[portfolio_id]
+    _apply_sell(db, portfolio, symbol, dollars, price)
+    maybe_commit(db, "Failed to sell holding.")
+
+
+@retry_transaction
+def invest_in_portfolio(
+    db: Session, investee_portfolio_id: int, investor_portfolio_id: int, dollars: float
+):
+    if investee_portfolio_id == investor_portfolio_id:
+        raise RequestValueError("Self-invest prohibited")
+    portfolio_by_id, price_by_symbol = _lock_priced_portfolios(
+        db, [investee_portfolio_id, investor_portfolio_id]
+    )
+    _apply_invest(
+        db,
+        portfolio_by_id[investee_portfolio_id],
+        portfolio_by_id[investor_portfolio_id],
+        dollars,
+        price_by_symbol,
+    )
+    maybe_commit(db, "Failed to invest in portfolio.")
+
+
+@retry_transaction
+def divest_from_portfolio(
+    db: Session, investee_portfolio_id: int, investor_portfolio_id: int, dollars: float
+):
+    if investee_portfolio_id == investor_portfolio_id:
+        raise RequestValueError("Self-divest prohibited")
+    portfolio_by_id, price_by_symbol = _lock_priced_portfolios(
+        db, [investee_portfolio_id, investor_portfolio_id]
+    )
+    _apply_divest(
+        db,
+        portfolio_by_id[investee_portfolio_id],
+        portfolio_by_id[investor_portfolio_id],
+        dollars,
+        price_by_symbol,
+    )
     maybe_commit(db, "Failed to divest from portfolio.")
+
+
+@dataclass(frozen=True)
+class Order:
+    """One leg of execute_orders.
+
+    Buys and sells need symbol, invests and divests investee_portfolio_id. A sell
+    without dollars sells the whole holding.
+    """
+
+    type: TransactionType
+    dollars: float | None = None
+    symbol: str | None = None
+    investee_portfolio_id: int | None = None
+
+
+def _apply_orders(
+    db: Session,
+    portfolio_by_id: dict[int, Portfolio],
+    portfolio_id: int,
+    orders: list["Order"],
+    price_by_symbol: dict[str, float],
+):
+    """Applies the orders to the locked portfolios, rolling back if any fails."""
+    portfolio = portfolio_by_id[portfolio_id]
+    try:
+        for order in orders:
+            if order.type == TransactionType.BUY:
+                _apply_buy(
+                    db,
+                    portfolio,
+                    order.symbol,
+                    order.dollars,
+                    price_by_symbol[order.symbol],
+                )
+            elif order.type == TransactionType.SELL:
+                _apply_sell(
+                    db,
+                    portfolio,
+                    order.symbol,
+                    order.dollars,
+                    price_by_symbol[order.symbol],
+                )
+            elif order.type == TransactionType.INVEST:
+                _apply_invest(
+                    db,
+                    portfolio_by_id[order.investee_portfolio_id],
+                    portfolio,
+                    order.dollars,
+                    price_by_symbol,
+                )
+            else:
+                _apply_divest(
+                    db,
+                    portfolio_by_id[order.investee_portfolio_id],
+                    portfolio,
+                    order.dollars,
+                    price_by_symbol,
+                )
+    except Exception:
+        # a savepoint (see order_queue) rolls back just its own orders
+        if not db.in_nested_transaction():
+            db.rollback()
+        raise
+
+
+def validate_orders(portfolio_id: int, orders: list[Order]):
+    """Raises RequestValueError if any of the owner's orders is malformed."""
+    trades = {TransactionType.BUY, TransactionType.SELL}
+    for order in orders:
+        if order.type in trades and order.symbol is None:
+            raise RequestValueError(f"Missing symbol for {order.type.value} order.")
+        if order.type not in trades and order.investee_portfolio_id is None:
+            raise RequestValueError(
+                f"Missing investee portfolio for {order.type.value} order."
+            )
+        if order.type not in trades and order.investee_portfolio_id == portfolio_id:
+            raise RequestValueError(f"Self-{order.type.value} prohibited")
+        if order.dollars is None and order.type != TransactionType.SELL:
+            raise RequestValueError(f"Missing dollars for {order.type.value} order.")
+
+
+def _lock_priced_order_portfolios(
+    db: Session, portfolio_id: int, orders: list[Order]
+) -> tuple[dict[int, Portfolio], dict[str, float]]:
+    portfolio_ids = sorted(
+        {portfolio_id}.union(
+            order.investee_portfolio_id
+            for order in orders
+            if order.investee_portfolio_id is not None
+        )
+    )
+    return _lock_priced_portfolios(
+        db,
+        portfolio_ids,
+        symbols={order.symbol for order in orders if order.symbol is not None},
+    )
+
+
+@retry_transaction
+def execute_orders(db: Session, portfolio_id: int, orders: list[Order]):
+    """Executes the owner's orders in order, all or nothing.
+
+    Every involved portfolio is locked once, every price is resolved in one
+    get_prices call before the lock, and the orders are committed together.
+    """
+    validate_orders(portfolio_id, orders)
+    if not orders:
+        return
+    portfolio_by_id, price_by_symbol = _lock_priced_order_portfolios(
+        db, portfolio_id, orders
+    )
+    _apply_orders(db, portfolio_by_id, portfolio_id, orders, price_by_symbol)
+    maybe_commit(db, "Failed to execute orders.")
+
+
+def sell_all_portfolio_holdings(db: Session, portfolio_id: int):
+    """Sells every holding in owner's portfolio for cash."""
+    symbols = [
+        symbol
+        for (symbol,) in db.query(Holding.symbol).filter(
+            Holding.portfolio_id == portfolio_id, Holding.symbol != DOLLAR_SYMBOL
+        )
+    ]
+    execute_orders(
+        db,
+        portfolio_id,
+        [Order(TransactionType.SELL, symbol=symbol) for symbol in sorted(symbols)],
+    )
+
+
+def plan_rebalance(
+    portfolio: Portfolio,
+    weight_by_symbol: dict[str, float],
+    price_by_symbol: dict[str, float],
+) -> list[Order]:
+    """Plans the trades moving owner's share of the portfolio to the target weights.
+
+    Symbols without a weight are sold. Sells come before buys so the buys are
+    funded, and trades under a cent are skipped.
+    """
+    self_ownership = _find_ownership(portfolio, portfolio.id)
+    if self_ownership is None:
+        raise MissingOwnershipError(portfolio.id, portfolio.id)
+    self_percent = ownership_percent(self_ownership)
+    units_by_symbol = {holding.symbol: holding.units for holding in portfolio.holdings}
+    symbols = sorted((set(units_by_symbol) | set(weight_by_symbol)) - {DOLLAR_SYMBOL})
+    units = np.array([units_by_symbol.get(symbol, 0.0) for symbol in symbols])
+    prices = np.array([price_by_symbol[symbol] for symbol in symbols])
+    weights = np.array([weight_by_symbol.get(symbol, 0.0) for symbol in symbols])
+
+    values = units * prices * self_percent
+    cash = units_by_symbol.get(DOLLAR_SYMBOL, 0.0) * self_percent
+    deltas = weights * (values.sum() + cash) - values
+
+    orders = []
+    for i in np.flatnonzero(deltas <= -_MIN_REBALANCE_DOLLARS):
+        # exact dollars could overshoot the holding by a rounding error
+        dollars = None if weights[i] == 0 else float(-deltas[i])
+        orders.append(Order(TransactionType.SELL, dollars=dollars, symbol=symbols[i]))
+    # rounding buys down to the cent keeps them within the cash the sells raise
+    buys = np.floor(deltas * 100) / 100
+    for i in np.flatnonzero(buys >= _MIN_REBALANCE_DOLLARS):
+        orders.append(
+            Order(TransactionType.BUY, dollars=float(buys[i]), symbol=symbols[i])
+        )
+    return orders
+
+
+@retry_transaction
+def rebalance_portfolio(
+    db: Session,
+    portfolio_id: int,
+    weight_by_symbol: dict[str, float],
+    dry_run: bool = False,
+) -> list[Order]:
+    """Trades owner's portfolio to the target weights, e.g. {"AAA": 0.6, "USD": 0.4},
+    all or nothing under one lock.
+
+    With dry_run, only plans the trades, without locking or trading. Returns the
+    trades.
+    """
+    if any(weight < 0 for weight in weight_by_symbol.values()):
+        raise RequestValueError("Weights must be non-negative.")
+    if abs(sum(weight_by_symbol.values()) - 1) > _MAX_REBALANCE_WEIGHT_ERROR:
+        raise RequestValueError("Weights must sum to 1.")
+
+    if dry_run:
+        portfolio = db.get(Portfolio, portfolio_id)
+        if portfolio is None:
+            raise MissingPortfolioError(portfolio_id)
+        symbols = {holding.symbol for holding in portfolio.holdings}
+        price_by_symbol = get_prices(
+            db, sorted(symbols.union(weight_by_symbol)), freshness="trade"
+        )
+        return plan_rebalance(portfolio, weight_by_symbol, price_by_symbol)
+
+    portfolio_by_id, price_by_symbol = _lock_priced_portfolios(
+        db, [portfolio_id], symbols=weight_by_symbol
+    )
+    orders = plan_rebalance(
+        portfolio_by_id[portfolio_id], weight_by_symbol, price_by_symbol
+    )
+    _apply_orders(db, portfolio_by_id, portfolio_id, orders, price_by_symbol)
+    maybe_commit(db, "Failed to rebalance portfolio.")
+    return orders
@@ -1,11 +1,71 @@
+import asyncio
 from fastapi import Depends
+from functools import wraps
+import logging
+import os
+import random
+import threading
+import time
 from sherwood.errors import InternalServerError
+from sqlalchemy import create_engine, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import (
+    async_sessionmaker,
+    create_async_engine,
+    AsyncEngine,
+    AsyncSession as SqlAlchemyAsyncSession,
+)
 from sqlalchemy.orm import sessionmaker, Session as SqlAlchemyOrmSession
+from sqlalchemy.util.concurrency import await_, in_greenlet
 from typing import Annotated
 
 POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME = "POSTGRESQL_DATABASE_PASSWORD"
 
+# deadlock_detected, serialization_failure
+_RETRYABLE_PGCODES = frozenset({"40P01", "40001"})
+_MAX_TRANSACTION_ATTEMPTS = 4
+_TRANSACTION_RETRY_BASE_DELAY_SECONDS = 0.05
+_TRANSACTION_RETRY_MAX_DELAY_SECONDS = 1.0
+_LOCK_WAIT_THRESHOLD_SECONDS = 0.01
+
+# sync sessions, for scripts and threads
 Session = sessionmaker(autocommit=False, autoflush=False)
+# async sessions, for the api, see run_sync
+AsyncSession = async_sessionmaker(autoflush=False)
+
+
+def _postgresql_database_url(drivername: str, query=None) -> URL:
+    postgresql_database_password = os.environ.get(
+        POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME
+    )
+    if not postgresql_database_password:
+        raise RuntimeError(
+            f"Environment variable '{POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME}' is not set."
+        )
+    return URL.create(
+        drivername=drivername,
+        username="sherwood",
+        password=postgresql_database_password,
+        host="sql.joemckenna.xyz",
+        port=5432,
+        database="sherwood",
+        query=query or {},
+    )
+
+
+def create_postgresql_engine() -> Engine:
+    return create_engine(
+        _postgresql_database_url("postgresql", query={"sslmode": "require"}),
+        connect_args={"options": "-c timezone=utc"},
+    )
+
+
+def create_postgresql_async_engine() -> AsyncEngine:
+    return create_async_engine(
+        _postgresql_database_url("postgresql+asyncpg"),
+        connect_args={"ssl": "require", "server_settings": {"timezone": "utc"}},
+    )
 
 
 def get_db():
@@ -16,6 +76,68 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSession() as db:
+        yield db
+
+
+def run_sync(f):
+    """Decorator running a route written against a sync Session on the request's
+    AsyncSession, so its queries await the async driver instead of blocking the
+    event loop.
+
+    Example usage:
+
+      @api_router.post("/fake")
+      @handle_errors(...)
+      @run_sync
+      def api_fake(request: FakeRequest, db: AsyncDatabase) -> FakeResponse:
+          ...
+
+      where db is a sqlalchemy.orm.Session inside api_fake, backed by the
+      AsyncSession's connection. Ordinary sync library functions (broker,
+      market_data, registrar) can be called with it.
+
+    api_fake still runs on the event loop, so anything else it blocks on goes
+    through run_blocking or sleep.
+    """
+
+    @wraps(f)
+    async def wrapper(*args, db: SqlAlchemyAsyncSession, **kwargs):
+        return await db.run_sync(lambda sync_db: f(*args, db=sync_db, **kwargs))
+
+    return wrapper
+
+
+def run_blocking(f, *args):
+    """Calls f(*args), which blocks without using the database, e.g. a provider
+    round trip. Inside run_sync it runs on a worker thread while the event loop
+    serves other requests."""
+    if in_greenlet():
+        return await_(asyncio.to_thread(f, *args))
+    return f(*args)
+
+
+def sleep(seconds: float) -> None:
+    """time.sleep, except inside run_sync, where it yields the event loop."""
+    if in_greenlet():
+        await_(asyncio.sleep(seconds))
+    else:
+        time.sleep(seconds)
+
+
+def get_thread_bind(db: SqlAlchemyOrmSession) -> Engine:
+    """The engine for work db hands to another thread.
+
+    A session run by run_sync is bound to an async engine, which only works
+    within its event loop, so other threads use the sync engine instead.
+    """
+    bind = db.get_bind()
+    if bind.dialect.is_async:
+        return Session.kw["bind"]
+    return bind
+
+
 def maybe_commit(db: SqlAlchemyOrmSession, error_message: str):
     try:
         db.commit()
@@ -24,4 +146,87 @@ def maybe_commit(db: SqlAlchemyOrmSession, error_message: str):
         raise InternalServerError(f"{error_message} Error: {exc}") from exc
 
 
+def is_retryable_error(exc: BaseException | None) -> bool:
+    """Whether exc, or an error it was raised from (see maybe_commit), is a
+    deadlock or serialization failure, so the transaction can just be rerun."""
+    while exc is not None:
+        if isinstance(exc, DBAPIError):
+            orig = exc.orig
+            # psycopg2 and psycopg respectively
+            pgcode = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+            if pgcode in _RETRYABLE_PGCODES:
+                return True
+        exc = exc.__cause__
+    return False
+
+
+class RetryTransaction:
+    """Decorator rerunning f(db, ...) when its transaction deadlocks or fails
+    to serialize, after a rollback and a jittered exponential backoff.
+
+    Each call gets max_attempts attempts. Also counts lock waits, see
+    record_lock_wait.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = _MAX_TRANSACTION_ATTEMPTS,
+        base_delay_seconds: float = _TRANSACTION_RETRY_BASE_DELAY_SECONDS,
+        max_delay_seconds: float = _TRANSACTION_RETRY_MAX_DELAY_SECONDS,
+        sleep=sleep,
+    ):
+        self._max_attempts = max_attempts
+        self._base_delay_seconds = base_delay_seconds
+        self._max_delay_seconds = max_delay_seconds
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(db: SqlAlchemyOrmSession, *args, **kwargs):
+            for attempt in range(self._max_attempts):
+                try:
+                    return f(db, *args, **kwargs)
+                except Exception as exc:
+                    if not is_retryable_error(exc):
+                        raise
+                    db.rollback()
+                    if attempt + 1 == self._max_attempts:
+                        self._count("exhausted")
+                        raise
+                    self._count("retries")
+                    delay = min(
+                        self._max_delay_seconds,
+                        self._base_delay_seconds * 2**attempt,
+                    )
+                    logging.info(f"Retrying {f.__name__} after error: {exc}")
+                    self._sleep(random.uniform(0, delay))
+
+        return wrapper
+
+    def _count(self, name: str, seconds: float = 0) -> None:
+        with self._lock:
+            self._counts[name] += 1
+            self._lock_wait_seconds += seconds
+
+    def record_lock_wait(self, seconds: float) -> None:
+        """Counts a lock acquisition that took long enough to have waited."""
+        if seconds >= _LOCK_WAIT_THRESHOLD_SECONDS:
+            self._count("lock_waits", seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts = {"retries": 0, "exhausted": 0, "lock_waits": 0}
+            self._lock_wait_seconds = 0.0
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            return {**self._counts, "lock_wait_seconds": self._lock_wait_seconds}
+
+
+retry_transaction = RetryTransaction()
+
+
 Database = Annotated[SqlAlchemyOrmSession, Depends(get_db)]
+AsyncDatabase = Annotated[SqlAlchemyAsyncSession, Depends(get_async_db)]
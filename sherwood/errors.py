@@ -46,6 +46,15 @@ class InvalidPasswordError(SherwoodError):
         )
 
 
+class InvalidSymbolError(SherwoodError):
+    def __init__(self, symbol: str, headers=None) -> None:
+        super().__init__(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Invalid symbol: {symbol}.",
+            headers=headers,
+        )
+
+
 class IncorrectPasswordError(SherwoodError):
     def __init__(self, headers=None) -> None:
         super().__init__(
@@ -64,6 +73,15 @@ class InvalidAccessTokenError(SherwoodError):
         )
 
 
+class InvalidQuoteTokenError(SherwoodError):
+    def __init__(self, detail: str, headers=None) -> None:
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid quote token: {detail}",
+            headers=headers,
+        )
+
+
 class MissingUserError(SherwoodError):
     def __init__(
         self, user_id: int | None = None, email: str | None = None, headers=None
@@ -87,6 +105,15 @@ class MissingPortfolioError(SherwoodError):
         )
 
 
+class MissingQueuedOrderError(SherwoodError):
+    def __init__(self, order_id: int, headers=None) -> None:
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Queued order with ID {order_id} missing.",
+            headers=headers,
+        )
+
+
 class MissingHoldingError(SherwoodError):
     def __init__(self, portfolio_id: int, symbol: str, headers=None) -> None:
         super().__init__(
@@ -145,6 +172,15 @@ class DuplicateQuoteError(SherwoodError):
         )
 
 
+class IdempotencyKeyInProgressError(SherwoodError):
+    def __init__(self, key: str, headers=None) -> None:
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Request with idempotency key {key} is in progress.",
+            headers=headers,
+        )
+
+
 class InsufficientCashError(SherwoodError):
     def __init__(self, needed: float, actual: float, headers=None) -> None:
         super().__init__(
@@ -187,13 +223,18 @@ __all__ = [
     "RequestValueError",
     "InvalidDisplayNameError",
     "InvalidPasswordError",
+    "InvalidSymbolError",
     "IncorrectPasswordError",
     "InvalidAccessTokenError",
+    "InvalidQuoteTokenError",
     "MissingUserError",
     "MissingPortfolioError",
+    "MissingHoldingError",
+    "MissingQueuedOrderError",
     "MissingOwnershipError",
     "DuplicateUserError",
     "DuplicatePortfolioError",
+    "IdempotencyKeyInProgressError",
     "InsufficientCashError",
     "InsufficientHoldingsError",
     "MarketDataProviderError",
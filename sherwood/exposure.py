@@ -0,0 +1,146 @@
+"""Look-through exposure.
+
+A user's look-through exposure is the units of each symbol they own through
+their own portfolio and their stakes in other portfolios. Stakes belong to
+owners, not portfolios: when a portfolio invests in another, the dollars come
+out of its owner's share (see broker._apply_invest), so the portfolio's other
+investors don't see through to the investee. Exposure is then one sparse
+product of the ownership fractions with the holdings rather than a walk down
+the investment graph.
+"""
+
+import numpy as np
+import threading
+import time
+from sherwood.models import Holding, Ownership, Portfolio
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+_EXPOSURE_LIFETIME_SECONDS = 60
+
+
+def _version(db: Session) -> tuple:
+    """Changes when holdings, ownership or shares do, up to commits landing out
+    of last_modified order, which the cache lifetime bounds."""
+    return db.execute(
+        select(
+            select(func.count()).select_from(Holding).scalar_subquery(),
+            select(func.max(Holding.last_modified)).scalar_subquery(),
+            select(func.count()).select_from(Ownership).scalar_subquery(),
+            select(func.max(Ownership.last_modified)).scalar_subquery(),
+            select(func.max(Portfolio.last_modified)).scalar_subquery(),
+        )
+    ).one()
+
+
+def _fraction(percent, shares, portfolio_shares) -> float:
+    # see models.ownership_percent
+    if portfolio_shares is None:
+        return percent
+    if portfolio_shares == 0:
+        return 0.0
+    return shares / portfolio_shares
+
+
+def compute_units_by_symbol_by_owner(db: Session) -> dict[int, dict[str, float]]:
+    """Every owner's look-through units by symbol, from two bulk queries."""
+    holdings = db.execute(
+        select(Holding.portfolio_id, Holding.symbol, Holding.units).order_by(
+            Holding.portfolio_id
+        )
+    ).all()
+    ownerships = db.execute(
+        select(
+            Ownership.portfolio_id,
+            Ownership.owner_id,
+            Ownership.percent,
+            Ownership.shares,
+            Portfolio.shares,
+        ).join(Portfolio, Portfolio.id == Ownership.portfolio_id)
+    ).all()
+    if not holdings or not ownerships:
+        return {}
+
+    holding_portfolio_ids = np.array([h[0] for h in holdings], dtype=np.int64)
+    symbols, symbol_index = np.unique([h[1] for h in holdings], return_inverse=True)
+    units = np.array([h[2] for h in holdings], dtype=float)
+    portfolio_ids, starts, counts = np.unique(
+        holding_portfolio_ids, return_index=True, return_counts=True
+    )
+
+    fractions = np.array([_fraction(*o[2:]) for o in ownerships], dtype=float)
+    owned_portfolio_ids = np.array([o[0] for o in ownerships], dtype=np.int64)
+    owner_ids = np.array([o[1] for o in ownerships], dtype=np.int64)
+
+    # joins each ownership with its portfolio's holdings
+    position = np.searchsorted(portfolio_ids, owned_portfolio_ids)
+    position = np.minimum(position, len(portfolio_ids) - 1)
+    has_holdings = portfolio_ids[position] == owned_portfolio_ids
+    position = position[has_holdings]
+    fractions = fractions[has_holdings]
+    owner_ids = owner_ids[has_holdings]
+    n = counts[position]
+    offsets = np.repeat(starts[position] - np.cumsum(n) + n, n)
+    holding_index = offsets + np.arange(n.sum())
+
+    keys = np.repeat(owner_ids, n) * len(symbols) + symbol_index[holding_index]
+    keys, key_index = np.unique(keys, return_inverse=True)
+    totals = np.bincount(
+        key_index, weights=np.repeat(fractions, n) * units[holding_index]
+    )
+
+    units_by_symbol_by_owner = {}
+    for key, total in zip(keys.tolist(), totals.tolist()):
+        owner_id, i = divmod(key, len(symbols))
+        units_by_symbol_by_owner.setdefault(owner_id, {})[str(symbols[i])] = total
+    return units_by_symbol_by_owner
+
+
+class LookThroughExposure:
+    """Process-local cache of every owner's look-through units by symbol.
+
+    Units don't depend on prices, so one computation serves every quote
+    snapshot until holdings, ownership or shares change, or lifetime_seconds
+    pass.
+    """
+
+    def __init__(self, lifetime_seconds: float):
+        self._lifetime_seconds = lifetime_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def units_by_symbol(self, db: Session, owner_id: int) -> dict[str, float]:
+        version = _version(db)
+        with self._lock:
+            if (
+                version == self._version
+                and time.monotonic() - self._computed_at < self._lifetime_seconds
+            ):
+                self.hits += 1
+                return dict(self._units_by_symbol_by_owner.get(owner_id, {}))
+            self.misses += 1
+        started_at = time.monotonic()
+        units_by_symbol_by_owner = compute_units_by_symbol_by_owner(db)
+        with self._lock:
+            self._version = version
+            self._computed_at = started_at
+            self._units_by_symbol_by_owner = units_by_symbol_by_owner
+        return dict(units_by_symbol_by_owner.get(owner_id, {}))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._version = None
+            self._computed_at = 0.0
+            self._units_by_symbol_by_owner = {}
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "owners": len(self._units_by_symbol_by_owner),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+look_through_exposure = LookThroughExposure(lifetime_seconds=_EXPOSURE_LIFETIME_SECONDS)
@@ -0,0 +1,129 @@
+"""Quote freshness policies.
+
+A policy decides whether a quote observed at some time is too old to use. Prices
+can't move while the exchange is closed, so calendar-aware policies treat any
+quote observed after the last close as fresh until the next open.
+
+Callers name a policy ("trade", "display", "analytics"), pass one, or pass raw
+delay seconds, which ignore the calendar.
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+import json
+import os
+from zoneinfo import ZoneInfo
+
+_CALENDAR_PATH = os.path.join(os.path.dirname(__file__), "data", "nyse_calendar.json")
+
+# sessions are looked up at most this many days back
+_MAX_CLOSED_DAYS = 10
+
+
+def as_utc(timestamp: datetime) -> datetime:
+    """Treats a naive timestamp as UTC, since sqlite, used by the unit tests,
+    has no timezone-aware type. Imported from models, which imports this module.
+    """
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+class MarketCalendar:
+    """Regular trading sessions of an exchange.
+
+    Days that aren't weekends or listed holidays are sessions, so dates past the
+    end of the holiday list degrade to weekday sessions.
+    """
+
+    def __init__(
+        self,
+        tz: str,
+        open_time: time,
+        close_time: time,
+        holidays: set[date],
+        early_close_by_day: dict[date, time],
+    ):
+        self._tz = ZoneInfo(tz)
+        self._open_time = open_time
+        self._close_time = close_time
+        self._holidays = holidays
+        self._early_close_by_day = early_close_by_day
+
+    @classmethod
+    def from_json(cls, path: str) -> "MarketCalendar":
+        with open(path) as f:
+            calendar = json.load(f)
+        return cls(
+            tz=calendar["timezone"],
+            open_time=time.fromisoformat(calendar["open"]),
+            close_time=time.fromisoformat(calendar["close"]),
+            holidays={date.fromisoformat(day) for day in calendar["holidays"]},
+            early_close_by_day={
+                date.fromisoformat(day): time.fromisoformat(close_time)
+                for day, close_time in calendar["early_closes"].items()
+            },
+        )
+
+    def session(self, day: date) -> tuple[datetime, datetime] | None:
+        """Gets the open and close of the session on day, if it's a trading day."""
+        if day.weekday() >= 5 or day in self._holidays:
+            return None
+        close_time = self._early_close_by_day.get(day, self._close_time)
+        return (
+            datetime.combine(day, self._open_time, self._tz),
+            datetime.combine(day, close_time, self._tz),
+        )
+
+    def is_open(self, at: datetime) -> bool:
+        at = as_utc(at)
+        session = self.session(at.astimezone(self._tz).date())
+        return session is not None and session[0] <= at < session[1]
+
+    def last_close(self, at: datetime) -> datetime | None:
+        at = as_utc(at)
+        day = at.astimezone(self._tz).date()
+        for _ in range(_MAX_CLOSED_DAYS):
+            if (session := self.session(day)) is not None and session[1] <= at:
+                return session[1]
+            day -= timedelta(days=1)
+        return None
+
+
+market_calendar = MarketCalendar.from_json(_CALENDAR_PATH)
+
+
+@dataclass(frozen=True)
+class FreshnessPolicy:
+    delay_seconds: float
+    calendar: MarketCalendar | None = None
+
+    def has_expired(self, as_of: datetime, at: datetime | None = None) -> bool:
+        as_of = as_utc(as_of)
+        at = as_utc(at) if at else datetime.now(timezone.utc)
+        if (at - as_of).total_seconds() <= self.delay_seconds:
+            return False
+        if self.calendar is None or self.calendar.is_open(at):
+            return True
+        last_close = self.calendar.last_close(at)
+        return last_close is None or as_of < last_close
+
+
+FRESHNESS_POLICIES = {
+    # trades always price against the provider
+    "trade": FreshnessPolicy(delay_seconds=0),
+    "display": FreshnessPolicy(delay_seconds=300, calendar=market_calendar),
+    "analytics": FreshnessPolicy(delay_seconds=3600, calendar=market_calendar),
+}
+
+Freshness = float | str | FreshnessPolicy
+
+
+def freshness_policy(freshness: Freshness) -> FreshnessPolicy:
+    if isinstance(freshness, FreshnessPolicy):
+        return freshness
+    if isinstance(freshness, str):
+        if freshness not in FRESHNESS_POLICIES:
+            raise ValueError(f"Unknown freshness class: {freshness}.")
+        return FRESHNESS_POLICIES[freshness]
+    return FreshnessPolicy(delay_seconds=freshness)
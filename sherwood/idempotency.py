@@ -0,0 +1,166 @@
+from datetime import timedelta
+from fastapi import Header
+from fastapi.responses import JSONResponse
+from functools import wraps
+import hashlib
+import json
+from pydantic import BaseModel
+from sherwood.errors import *
+from sherwood.models import as_utc, now, IdempotencyRecord
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Annotated
+
+_IDEMPOTENCY_KEY_LIFETIME_SECONDS = 24 * 60 * 60
+
+IdempotencyKey = Annotated[str | None, Header()]
+
+# 4xx errors that may not recur on retry, e.g. a provider outage
+_TRANSIENT_ERRORS = (IdempotencyKeyInProgressError, MarketDataProviderError)
+
+
+def _fingerprint(f, request: BaseModel) -> str:
+    payload = f"{f.__name__}({request.model_dump_json()})"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _replay(record: IdempotencyRecord, return_type) -> JSONResponse | BaseModel:
+    if record.status_code >= 300:
+        return JSONResponse(
+            status_code=record.status_code, content=json.loads(record.response)
+        )
+    if isinstance(return_type, type) and BaseModel in return_type.__mro__:
+        return return_type.model_validate_json(record.response)
+    return json.loads(record.response)
+
+
+def _is_deterministic(exc: Exception) -> bool:
+    return (
+        isinstance(exc, SherwoodError)
+        and exc.status_code < 500
+        and not isinstance(exc, _TRANSIENT_ERRORS)
+    )
+
+
+def _error_json(exc: SherwoodError) -> str:
+    # see main.error_handler
+    return json.dumps({"error": {"status_code": exc.status_code, "detail": exc.detail}})
+
+
+def _claim(db: Session, user_id: int, key: str, fingerprint: str):
+    record = IdempotencyRecord(user_id=user_id, key=key, fingerprint=fingerprint)
+    db.add(record)
+    try:
+        db.commit()
+    except IntegrityError:
+        # another request claimed the key first
+        db.rollback()
+        raise IdempotencyKeyInProgressError(key)
+    return record
+
+
+def _store(db: Session, record: IdempotencyRecord, status_code: int, response: str):
+    record.status_code = status_code
+    record.response = response
+    db.commit()
+
+
+def _release(db: Session, record: IdempotencyRecord):
+    db.delete(record)
+    db.commit()
+
+
+class Idempotent:
+    """Decorator storing the outcome of requests sent with an Idempotency-Key
+    header, so a retried request gets the stored outcome instead of rerunning f.
+
+    Example usage:
+
+      @api_router.post("/fake")
+      @handle_errors((IdempotencyKeyInProgressError, RequestValueError, ...))
+      @run_sync
+      @idempotent(lifetime_seconds=3600)
+      def api_fake(
+          request: FakeRequest,
+          db: AsyncDatabase,
+          user: AuthorizedUser,
+          idempotency_key: IdempotencyKey = None,
+      ) -> FakeResponse:
+          ...
+
+      where db is a sqlalchemy.orm.Session inside api_fake, see run_sync.
+
+    Keys are scoped to the user and looked up by primary key, so a replay takes
+    no portfolio locks. Successes and deterministic 4xx errors are stored; 5xx
+    errors and transient ones, like MarketDataProviderError, release the key so
+    the request can be retried. A key reused with a different
+    request is rejected, and one whose request is still running gets a 409.
+    If the process dies mid-request the key stays in progress until it
+    expires, so the request isn't run twice.
+    """
+
+    def __init__(self, lifetime_seconds: int = _IDEMPOTENCY_KEY_LIFETIME_SECONDS):
+        self._lifetime_seconds = lifetime_seconds
+
+    def _has_expired(self, record: IdempotencyRecord) -> bool:
+        age = now() - as_utc(record.created)
+        return age > timedelta(seconds=self._lifetime_seconds)
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = kwargs.get("idempotency_key")
+            if key is None:
+                return f(*args, **kwargs)
+            if (request := kwargs.get("request")) is None:
+                raise InternalServerError(f"missing request kwarg.")
+            if (user := kwargs.get("user")) is None:
+                raise InternalServerError(f"missing user kwarg.")
+            if not isinstance(db := kwargs.get("db"), Session):
+                raise InternalServerError(f"db is not a sqlalchemy.orm.Session: {db}.")
+
+            fingerprint = _fingerprint(f, request)
+            record = db.get(IdempotencyRecord, (user.id, key))
+            if record is not None and self._has_expired(record):
+                db.delete(record)
+                db.flush()
+                record = None
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    raise RequestValueError(
+                        f"Idempotency key {key} was used with a different request."
+                    )
+                if record.status_code is None:
+                    raise IdempotencyKeyInProgressError(key)
+                return _replay(record, f.__annotations__.get("return"))
+
+            record = _claim(db, user.id, key, fingerprint)
+
+            try:
+                response = f(*args, **kwargs)
+            except Exception as exc:
+                db.rollback()
+                if _is_deterministic(exc):
+                    _store(db, record, exc.status_code, _error_json(exc))
+                else:
+                    _release(db, record)
+                raise
+            _store(db, record, 200, response.model_dump_json())
+            return response
+
+        return wrapper
+
+
+def purge_expired_idempotency_records(
+    db: Session, lifetime_seconds: int = _IDEMPOTENCY_KEY_LIFETIME_SECONDS
+) -> int:
+    """Deletes records older than lifetime_seconds. Returns the number deleted."""
+    deleted = db.execute(
+        delete(IdempotencyRecord).where(
+            IdempotencyRecord.created < now() - timedelta(seconds=lifetime_seconds)
+        ),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+    db.commit()
+    return deleted
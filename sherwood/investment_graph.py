@@ -0,0 +1,200 @@
+"""In-memory index of who invests in whom.
+
+Edges run from an owner to each other portfolio they hold a stake in, from
+Ownership rows. Commits in this process update the index through session
+hooks; commits in other processes (api workers, the order executor) are picked
+up by comparing a fingerprint of the ownership table at most every
+refresh_interval_seconds.
+
+Cycle checks don't use the index: they run with the portfolio locks held and
+must see other workers' latest commits, so they walk the ownership table in one
+recursive query instead.
+"""
+
+from collections import defaultdict
+import graphlib
+import threading
+import time
+from sherwood.models import Ownership
+from sqlalchemy import event, exists, func, or_, select
+from sqlalchemy.orm import Session
+
+_REFRESH_INTERVAL_SECONDS = 1.0
+# stakes this small are left over from full divests
+_MIN_STAKE = 1e-12
+
+_PENDING_EDGES_KEY = "investment_graph_pending_edges"
+
+
+def _has_stake(percent: float | None, shares: float | None) -> bool:
+    return (percent or 0) > _MIN_STAKE or (shares or 0) > _MIN_STAKE
+
+
+def _is_edge():
+    return (
+        Ownership.owner_id != Ownership.portfolio_id,
+        or_(Ownership.percent > _MIN_STAKE, Ownership.shares > _MIN_STAKE),
+    )
+
+
+def _fingerprint(db: Session) -> tuple:
+    return db.execute(
+        select(func.count(), func.max(Ownership.last_modified)).select_from(Ownership)
+    ).one()
+
+
+class InvestmentGraph:
+    """Adjacency sets of the investment graph, kept in both directions."""
+
+    def __init__(self, refresh_interval_seconds: float):
+        self._refresh_interval_seconds = refresh_interval_seconds
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._investees_by_owner: dict[int, set[int]] = defaultdict(set)
+            self._investors_by_portfolio: dict[int, set[int]] = defaultdict(set)
+            self._fingerprint = None
+            self._checked_at = float("-inf")
+            self.loads = 0
+            self.updates = 0
+
+    def load(self, db: Session) -> None:
+        """Rebuilds the index from the ownership table."""
+        fingerprint = _fingerprint(db)
+        edges = db.execute(
+            select(Ownership.owner_id, Ownership.portfolio_id).where(*_is_edge())
+        ).all()
+        with self._lock:
+            self._investees_by_owner.clear()
+            self._investors_by_portfolio.clear()
+            for owner_id, portfolio_id in edges:
+                self._investees_by_owner[owner_id].add(portfolio_id)
+                self._investors_by_portfolio[portfolio_id].add(owner_id)
+            self._fingerprint = fingerprint
+            self._checked_at = time.monotonic()
+            self.loads += 1
+
+    def refresh(self, db: Session) -> None:
+        """Reloads the index if the ownership table changed since it was built,
+        checking at most every refresh_interval_seconds."""
+        with self._lock:
+            if time.monotonic() - self._checked_at < self._refresh_interval_seconds:
+                return
+            self._checked_at = time.monotonic()
+            fingerprint = self._fingerprint
+        if _fingerprint(db) != fingerprint:
+            self.load(db)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._fingerprint = None
+            self._checked_at = float("-inf")
+
+    def update(self, has_edge_by_edge: dict[tuple[int, int], bool]) -> None:
+        """Applies committed (owner_id, portfolio_id) edge changes."""
+        with self._lock:
+            for (owner_id, portfolio_id), has_edge in has_edge_by_edge.items():
+                if has_edge:
+                    self._investees_by_owner[owner_id].add(portfolio_id)
+                    self._investors_by_portfolio[portfolio_id].add(owner_id)
+                else:
+                    self._investees_by_owner[owner_id].discard(portfolio_id)
+                    self._investors_by_portfolio[portfolio_id].discard(owner_id)
+            self.updates += 1
+
+    def _reach(self, db: Session, start: int, adjacency) -> set[int]:
+        self.refresh(db)
+        with self._lock:
+            reached, frontier = set(), [start]
+            while frontier:
+                for node in adjacency.get(frontier.pop(), ()):
+                    if node not in reached:
+                        reached.add(node)
+                        frontier.append(node)
+            return reached
+
+    def investees(self, db: Session, owner_id: int) -> set[int]:
+        """Portfolios owner_id is transitively invested in."""
+        return self._reach(db, owner_id, self._investees_by_owner)
+
+    def investors(self, db: Session, portfolio_id: int) -> set[int]:
+        """Owners transitively exposed to portfolio_id."""
+        return self._reach(db, portfolio_id, self._investors_by_portfolio)
+
+    def would_create_cycle(self, db: Session, owner_id: int, portfolio_id: int) -> bool:
+        """Whether owner_id investing in portfolio_id would close a cycle, since
+        a portfolio's owner has the portfolio's ID.
+
+        Reads the ownership table rather than the index, which can lag other
+        processes' commits, so call it with both portfolios locked.
+        """
+        if owner_id == portfolio_id:
+            return True
+        reached = (
+            select(Ownership.portfolio_id)
+            .where(Ownership.owner_id == portfolio_id, *_is_edge())
+            .cte("reached", recursive=True)
+        )
+        reached = reached.union(
+            select(Ownership.portfolio_id).where(
+                Ownership.owner_id == reached.c.portfolio_id, *_is_edge()
+            )
+        )
+        return db.scalar(select(exists().where(reached.c.portfolio_id == owner_id)))
+
+    def topological_order(self, db: Session) -> list[int]:
+        """Portfolios ordered so investees come before their investors.
+
+        Raises graphlib.CycleError if the ownership table has a cycle.
+        """
+        self.refresh(db)
+        with self._lock:
+            graph = {
+                owner_id: set(portfolio_ids)
+                for owner_id, portfolio_ids in self._investees_by_owner.items()
+            }
+        return list(graphlib.TopologicalSorter(graph).static_order())
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "edges": sum(map(len, self._investees_by_owner.values())),
+                "loads": self.loads,
+                "updates": self.updates,
+            }
+
+
+investment_graph = InvestmentGraph(refresh_interval_seconds=_REFRESH_INTERVAL_SECONDS)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_ownership_changes(session, flush_context):
+    changed = [
+        (ownership, ownership not in session.deleted)
+        for ownership in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(ownership, Ownership)
+    ]
+    if not changed:
+        return
+    pending = session.info.setdefault(_PENDING_EDGES_KEY, {})
+    for ownership, exists in changed:
+        if ownership.owner_id != ownership.portfolio_id:
+            pending[(ownership.owner_id, ownership.portfolio_id)] = (
+                exists and _has_stake(ownership.percent, ownership.shares)
+            )
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_ownership_changes(session):
+    if pending := session.info.pop(_PENDING_EDGES_KEY, None):
+        investment_graph.update(pending)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_ownership_changes(session, previous_transaction):
+    # a savepoint rollback may undo only some of the pending changes, so the
+    # graph reloads rather than guessing
+    if session.info.pop(_PENDING_EDGES_KEY, None):
+        investment_graph.invalidate()
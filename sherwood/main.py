@@ -8,11 +8,17 @@ import gunicorn.app.base
 import logging
 import os
 from sherwood.api import api_router
-from sherwood.db import Session, POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME
+from sherwood.db import (
+    create_postgresql_async_engine,
+    create_postgresql_engine,
+    AsyncSession,
+    Session,
+)
 from sherwood.errors import SherwoodError
+from sherwood.market_data import set_provider
+from sherwood.market_data_providers import provider_from_env
 from sherwood.models import BaseModel
-from sqlalchemy import create_engine
-from sqlalchemy.engine import URL
+from sherwood.symbols import set_symbol_index, symbol_index_from_env
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -63,32 +69,18 @@ class App(gunicorn.app.base.BaseApplication):
 
     def load(self):
         load_dotenv("/root/.env", override=True)  # TODO: self.cfg.get("env_file")
-        postgresql_database_password = os.environ.get(
-            POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME
-        )
-        if not postgresql_database_password:
-            raise RuntimeError(
-                f"Environment variable '{POSTGRESQL_DATABASE_PASSWORD_ENV_VAR_NAME}' is not set."
-            )
-        postgresql_database_url = URL.create(
-            drivername="postgresql",
-            username="sherwood",
-            password=postgresql_database_password,
-            host="sql.joemckenna.xyz",
-            port=5432,
-            database="sherwood",
-            query={"sslmode": "require"},
-        )
-        engine = create_engine(
-            postgresql_database_url,
-            connect_args={"options": "-c timezone=utc"},
-        )
+        engine = create_postgresql_engine()
         Session.configure(bind=engine)
+        async_engine = create_postgresql_async_engine()
+        AsyncSession.configure(bind=async_engine)
+        set_provider(provider_from_env())
+        set_symbol_index(symbol_index_from_env())
 
         @asynccontextmanager
         async def lifespan(_):
             BaseModel.metadata.create_all(engine)
             yield
+            await async_engine.dispose()
             engine.dispose()
 
         return create_app(title="sherwood", version="0.0.0", lifespan=lifespan)
@@ -1,68 +1,583 @@
-from sherwood.db import maybe_commit
+from collections import OrderedDict
+from concurrent.futures import wait, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import json
+import logging
+import os
+from sherwood.db import get_thread_bind, maybe_commit, run_blocking, sleep
 from sherwood.errors import MarketDataProviderError
-from sherwood.models import has_expired, Quote
+from sherwood.freshness import freshness_policy, Freshness
+from sherwood.market_data_providers import (
+    FETCH_TIMEOUT_SECONDS,
+    MarketDataProvider,
+    YFinanceProvider,
+)
+from sherwood.models import as_utc, has_expired, now, upsert_quotes, Quote
+from sherwood.price_history import record_prices
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
-import yfinance
+import socket
+import tempfile
+import threading
+import time
+from typing import Any
 
-_PRICE_DELAY_SECONDS = 300
+_QUOTE_CACHE_MAX_SIZE = 4096
+
+_REFRESH_WAIT_SECONDS = 2
+_REFRESH_POLL_SECONDS = 0.05
+
+_QUOTE_LOCK_DIR = os.path.join(tempfile.gettempdir(), "sherwood-quote-locks")
+
+_SIDECAR_TIMEOUT_SECONDS = 0.25
+
+_REVALIDATION_MAX_WORKERS = 2
+
+_NEGATIVE_CACHE_TTL_SECONDS = 300
+
+_CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+_CIRCUIT_BREAKER_RESET_SECONDS = 30
 
 DOLLAR_SYMBOL = "USD"
 
+MARKET_DATA_SOCKET_ENV_VAR_NAME = "SHERWOOD_MARKET_DATA_SOCKET"
 
-def _fetch_prices(symbols) -> dict[str, float]:
+_provider: MarketDataProvider = YFinanceProvider()
+
+
+class QuoteCache:
+    """Process-local LRU cache of quotes in front of the quotes table.
+
+    Entries keep the time the price was observed so lookups apply the same
+    freshness rule as has_expired does for Quote rows.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, datetime]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_quote(
+        self, symbol: str, freshness: Freshness
+    ) -> tuple[float, datetime] | None:
+        policy = freshness_policy(freshness)
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is None or policy.has_expired(entry[1]):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(symbol)
+            self.hits += 1
+            return entry
+
+    def get(self, symbol: str, freshness: Freshness) -> float | None:
+        if (entry := self.get_quote(symbol, freshness)) is None:
+            return None
+        return entry[0]
+
+    def put(self, symbol: str, price: float, as_of: datetime) -> None:
+        with self._lock:
+            self._entries[symbol] = (price, as_utc(as_of))
+            self._entries.move_to_end(symbol)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def evict(self, symbol: str) -> None:
+        with self._lock:
+            if self._entries.pop(symbol, None) is not None:
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+quote_cache = QuoteCache(max_size=_QUOTE_CACHE_MAX_SIZE)
+
+
+class SingleFlight:
+    """Coalesces concurrent fetches of the same symbol within a process.
+
+    The first caller to ask for a symbol fetches it; callers asking for it while
+    that fetch is in flight wait for and share its result.
+    """
+
+    def __init__(self, timeout_seconds: float):
+        self._timeout_seconds = timeout_seconds
+        self._future_by_symbol: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, symbols, fetch_fn) -> dict[str, float]:
+        owned, waiting = {}, {}
+        with self._lock:
+            for symbol in symbols:
+                if (future := self._future_by_symbol.get(symbol)) is not None:
+                    waiting[symbol] = future
+                else:
+                    owned[symbol] = self._future_by_symbol[symbol] = Future()
+
+        price_by_symbol = {}
+        if owned:
+            try:
+                price_by_symbol.update(fetch_fn(list(owned)))
+            except Exception as exc:
+                for future in owned.values():
+                    future.set_exception(exc)
+                raise
+            else:
+                for symbol, future in owned.items():
+                    future.set_result(price_by_symbol.get(symbol))
+            finally:
+                with self._lock:
+                    for symbol in owned:
+                        del self._future_by_symbol[symbol]
+
+        if waiting:
+            run_blocking(wait, list(waiting.values()), self._timeout_seconds)
+        for symbol, future in waiting.items():
+            if not future.done():
+                continue
+            if (price := future.result()) is not None:
+                price_by_symbol[symbol] = price
+
+        return price_by_symbol
+
+
+single_flight = SingleFlight(
+    timeout_seconds=FETCH_TIMEOUT_SECONDS + _REFRESH_WAIT_SECONDS
+)
+
+
+class NegativeCache:
+    """Symbols the provider couldn't price, skipped until their entry expires."""
+
+    def __init__(self, ttl_seconds: float):
+        self._ttl_seconds = ttl_seconds
+        self._expires_at_by_symbol: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, symbols) -> None:
+        expires_at = time.monotonic() + self._ttl_seconds
+        with self._lock:
+            for symbol in symbols:
+                self._expires_at_by_symbol[symbol] = expires_at
+
+    def __contains__(self, symbol: str) -> bool:
+        with self._lock:
+            if (expires_at := self._expires_at_by_symbol.get(symbol)) is None:
+                return False
+            if expires_at > time.monotonic():
+                return True
+            del self._expires_at_by_symbol[symbol]
+            return False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._expires_at_by_symbol.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"size": len(self._expires_at_by_symbol)}
+
+
+negative_cache = NegativeCache(ttl_seconds=_NEGATIVE_CACHE_TTL_SECONDS)
+
+
+class CircuitBreaker:
+    """Stops calling the provider after consecutive failures.
+
+    The breaker opens after failure_threshold failures in a row. While open,
+    calls are refused so that reads fall back to the last known prices and
+    trades fail fast. After reset_seconds one trial call is let through
+    (half open), which closes the breaker on success or reopens it on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.rejections = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if (
+                self._state == self.OPEN
+                and time.monotonic() - self._opened_at >= self._reset_seconds
+            ):
+                self._state = self.HALF_OPEN
+                return True
+            self.rejections += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if (
+                self._state == self.HALF_OPEN
+                or self._consecutive_failures >= self._failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self.failures = self.rejections = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "failures": self.failures,
+                "rejections": self.rejections,
+            }
+
+
+circuit_breaker = CircuitBreaker(
+    failure_threshold=_CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    reset_seconds=_CIRCUIT_BREAKER_RESET_SECONDS,
+)
+
+
+def _sidecar_quotes(symbols: list[str]) -> dict[str, tuple[float, datetime]]:
+    """Gets quotes from the market data sidecar, see sherwood.market_data_server.
+
+    Returns no quotes if the sidecar isn't configured or can't be reached, in
+    which case callers fall back to the quotes table and the provider.
+    """
+    if not (socket_path := os.environ.get(MARKET_DATA_SOCKET_ENV_VAR_NAME)):
+        return {}
     try:
-        tickers = yfinance.Tickers(symbols)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(_SIDECAR_TIMEOUT_SECONDS)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps({"symbols": symbols}).encode() + b"\n")
+            with sock.makefile("rb") as response:
+                quotes = json.loads(response.readline())["quotes"]
         return {
-            symbol: tickers.tickers[symbol].info.get("currentPrice")
-            or tickers.tickers[symbol].info["navPrice"]
-            for symbol in symbols
+            symbol: (price, datetime.fromisoformat(as_of))
+            for symbol, (price, as_of) in quotes.items()
         }
+    except (OSError, KeyError, ValueError) as exc:
+        logging.debug(f"Market data sidecar unavailable. Error: {exc}")
+        return {}
+
+
+def set_provider(provider: MarketDataProvider) -> None:
+    global _provider
+    _provider = provider
+
+
+def get_provider() -> MarketDataProvider:
+    return _provider
+
+
+def _fetch_prices(symbols) -> dict[str, float]:
+    """Gets prices from the provider, behind the negative cache and the circuit
+    breaker. Symbols that can't be priced are omitted.
+
+    Only symbols the provider has no price for are negative cached; lookups
+    that failed or timed out count against the breaker instead."""
+    if not (symbols := [symbol for symbol in symbols if symbol not in negative_cache]):
+        return {}
+    if not circuit_breaker.allow():
+        logging.warning(f"Circuit breaker open, not fetching symbols: {symbols}.")
+        return {}
+    try:
+        price_by_symbol, failed = run_blocking(
+            _provider.fetch_prices_and_failures, symbols
+        )
     except Exception as exc:
-        raise MarketDataProviderError(
-            f"Failed to get prices, symbols: {', '.join(symbols)}. Error: {exc}"
-        ) from exc
+        circuit_breaker.record_failure()
+        logging.warning(f"Failed to fetch prices, symbols: {symbols}. Error: {exc}")
+        return {}
+    if failed:
+        circuit_breaker.record_failure()
+    else:
+        circuit_breaker.record_success()
+    negative_cache.add(
+        symbol
+        for symbol in symbols
+        if symbol not in price_by_symbol and symbol not in failed
+    )
+    return price_by_symbol
 
 
-def get_prices(
-    db: Session, symbols: list[str], delay_seconds: float = _PRICE_DELAY_SECONDS
+@contextmanager
+def _quote_refresh_locks(db: Session, symbols: list[str]):
+    """Yields the symbols this worker may refresh, at most one worker per symbol.
+
+    Postgres uses session-level advisory locks taken on a dedicated connection,
+    so they don't depend on when db's transaction ends. Other databases (sqlite)
+    fall back to file locks. Either way, the locks are released on exit.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        with db.get_bind().connect() as connection:
+            rows = connection.execute(
+                text(
+                    "SELECT symbol FROM unnest(:symbols) AS symbol "
+                    "WHERE pg_try_advisory_lock(hashtext('quotes:' || symbol))"
+                ),
+                {"symbols": symbols},
+            )
+            locked_symbols = {row.symbol for row in rows}
+            try:
+                yield locked_symbols
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock_all()"))
+        return
+
+    os.makedirs(_QUOTE_LOCK_DIR, exist_ok=True)
+    lock_file_by_symbol = {}
+    try:
+        for symbol in symbols:
+            path = os.path.join(_QUOTE_LOCK_DIR, f"{symbol.replace(os.sep, '_')}.lock")
+            lock_file = open(path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            lock_file_by_symbol[symbol] = lock_file
+        yield set(lock_file_by_symbol)
+    finally:
+        for lock_file in lock_file_by_symbol.values():
+            lock_file.close()
+
+
+def _store_quotes(db: Session, price_by_symbol: dict[str, float]) -> None:
+    if not price_by_symbol:
+        return
+    as_of = now()
+    upsert_quotes(db, price_by_symbol, as_of)
+    record_prices(db, price_by_symbol, as_of)
+    maybe_commit(db, "Failed to upsert quotes.")
+    for symbol, price in price_by_symbol.items():
+        quote_cache.put(symbol, price, as_of)
+
+
+def _wait_for_refreshed_quotes(
+    db: Session, symbols: list[str], requested_at: datetime
 ) -> dict[str, float]:
-    symbols_by_status = {"current": set(), "expired": set(), "missing": set(symbols)}
+    """Polls for quotes another worker refreshes after requested_at."""
+    deadline = time.monotonic() + _REFRESH_WAIT_SECONDS
     price_by_symbol = {}
+    while True:
+        for quote in (
+            db.query(Quote).filter(Quote.symbol.in_(symbols)).populate_existing().all()
+        ):
+            if as_utc(quote.last_modified) >= requested_at:
+                price_by_symbol[quote.symbol] = quote.price
+                quote_cache.put(quote.symbol, quote.price, quote.last_modified)
+        if len(price_by_symbol) == len(symbols) or time.monotonic() > deadline:
+            return price_by_symbol
+        sleep(_REFRESH_POLL_SECONDS)
+
+
+def _refresh_prices(
+    db: Session, symbols: list[str], requested_at: datetime
+) -> dict[str, float]:
+    """Fetches and stores current prices.
+
+    Symbols another worker is already refreshing are waited on briefly instead
+    of being fetched again.
+    """
+    with _quote_refresh_locks(db, symbols) as locked_symbols:
+        price_by_symbol = (
+            _fetch_prices(sorted(locked_symbols)) if locked_symbols else {}
+        )
+        _store_quotes(db, price_by_symbol)
+
+    if contended := [symbol for symbol in symbols if symbol not in locked_symbols]:
+        price_by_symbol.update(_wait_for_refreshed_quotes(db, contended, requested_at))
+        if remaining := [s for s in contended if s not in price_by_symbol]:
+            fetched_price_by_symbol = _fetch_prices(remaining)
+            _store_quotes(db, fetched_price_by_symbol)
+            price_by_symbol.update(fetched_price_by_symbol)
+
+    return price_by_symbol
+
+
+_revalidation_executor = ThreadPoolExecutor(
+    max_workers=_REVALIDATION_MAX_WORKERS, thread_name_prefix="quote-revalidation"
+)
+_revalidating_symbols: set[str] = set()
+_revalidating_symbols_lock = threading.Lock()
+
+
+def _revalidate_quotes(bind, symbols: list[str]) -> None:
+    db = Session(bind=bind)
+    try:
+        requested_at = now()
+        single_flight.fetch(
+            symbols, lambda symbols: _refresh_prices(db, symbols, requested_at)
+        )
+    except Exception as exc:
+        logging.warning(
+            f"Failed to revalidate quotes, symbols: {symbols}. Error: {exc}"
+        )
+    finally:
+        db.close()
+        with _revalidating_symbols_lock:
+            _revalidating_symbols.difference_update(symbols)
+
+
+def _schedule_revalidation(db: Session, symbols) -> None:
+    """Refreshes the symbols on a background thread with its own session, at most
+    one pending refresh per symbol."""
+    with _revalidating_symbols_lock:
+        if not (symbols := sorted(set(symbols) - _revalidating_symbols)):
+            return
+        _revalidating_symbols.update(symbols)
+    _revalidation_executor.submit(_revalidate_quotes, get_thread_bind(db), symbols)
+
+
+def get_quotes(
+    db: Session,
+    symbols: list[str],
+    freshness: Freshness = "display",
+    stale_while_revalidate: bool = False,
+    partial: bool = False,
+) -> dict[str, tuple[float, datetime]]:
+    """Gets the price of each symbol and the time it was observed.
+
+    freshness is a freshness class name, a FreshnessPolicy or delay seconds. With
+    stale_while_revalidate, expired quotes are returned as is and refreshed in
+    the background, so only symbols without any quote wait on the provider. With
+    partial, symbols that can't be priced are omitted instead of raising
+    MarketDataProviderError.
+    """
+    policy = freshness_policy(freshness)
+    symbols_by_status = {"current": set(), "expired": set(), "missing": set(symbols)}
+    quote_by_symbol = {}
 
     if DOLLAR_SYMBOL in symbols_by_status["missing"]:
         symbols_by_status["missing"].remove(DOLLAR_SYMBOL)
-        price_by_symbol[DOLLAR_SYMBOL] = 1
-        symbols.remove(DOLLAR_SYMBOL)
+        quote_by_symbol[DOLLAR_SYMBOL] = (1, now())
 
-    if not symbols:
-        return price_by_symbol
+    for symbol in list(symbols_by_status["missing"]):
+        if (quote := quote_cache.get_quote(symbol, policy)) is not None:
+            symbols_by_status["missing"].remove(symbol)
+            symbols_by_status["current"].add(symbol)
+            quote_by_symbol[symbol] = quote
+
+    if not symbols_by_status["missing"]:
+        return quote_by_symbol
+
+    sidecar_quotes = {}
+    if policy.delay_seconds > 0:
+        # the sidecar's quotes are never current enough for trades
+        sidecar_quotes = run_blocking(
+            _sidecar_quotes, sorted(symbols_by_status["missing"])
+        )
+    for symbol, (price, as_of) in sidecar_quotes.items():
+        if not policy.has_expired(as_of):
+            symbols_by_status["missing"].remove(symbol)
+            symbols_by_status["current"].add(symbol)
+            quote_by_symbol[symbol] = (price, as_of)
+            quote_cache.put(symbol, price, as_of)
+
+    if not symbols_by_status["missing"]:
+        return quote_by_symbol
 
-    quotes_to_update = []
+    requested_at = now()
+    stale_quote_by_symbol = {}
 
-    for quote in db.query(Quote).filter(Quote.symbol.in_(symbols)).all():
+    for quote in (
+        db.query(Quote).filter(Quote.symbol.in_(symbols_by_status["missing"])).all()
+    ):
         symbols_by_status["missing"].remove(quote.symbol)
-        if has_expired(quote, delay_seconds):
+        as_of = as_utc(quote.last_modified)
+        if has_expired(quote, policy):
             symbols_by_status["expired"].add(quote.symbol)
-            quotes_to_update.append(quote)
+            stale_quote_by_symbol[quote.symbol] = (quote.price, as_of)
         else:
             symbols_by_status["current"].add(quote.symbol)
-            price_by_symbol[quote.symbol] = quote.price
+            quote_by_symbol[quote.symbol] = (quote.price, as_of)
+            quote_cache.put(quote.symbol, quote.price, as_of)
+
+    if stale_while_revalidate and symbols_by_status["expired"]:
+        _schedule_revalidation(db, symbols_by_status["expired"])
+        quote_by_symbol.update(stale_quote_by_symbol)
+        symbols_by_status["expired"].clear()
 
     if s := set.union(symbols_by_status["expired"], symbols_by_status["missing"]):
-        price_by_symbol.update(_fetch_prices(list(s)))
-        for symbol in symbols_by_status["missing"]:
-            db.add(Quote(symbol=symbol, price=price_by_symbol[symbol]))
-        for quote in quotes_to_update:
-            quote.price = price_by_symbol[quote.symbol]
-            flag_modified(quote, "price")
-            db.add(quote)
-        maybe_commit(db, "Failed to upsert quotes.")
+        fetched_price_by_symbol = single_flight.fetch(
+            sorted(s), lambda symbols: _refresh_prices(db, symbols, requested_at)
+        )
+        unpriced = s - set(fetched_price_by_symbol)
+        if policy.delay_seconds > 0:
+            # reads can fall back to the last known price of an expired quote
+            unpriced -= symbols_by_status["expired"]
+        if unpriced and not partial:
+            raise MarketDataProviderError(
+                f"Failed to get prices, symbols: {', '.join(sorted(unpriced))}."
+            )
+        quote_by_symbol.update(
+            (symbol, quote)
+            for symbol, quote in stale_quote_by_symbol.items()
+            if symbol not in unpriced
+        )
+        fetched_at = now()
+        for symbol, price in fetched_price_by_symbol.items():
+            quote_by_symbol[symbol] = (price, fetched_at)
 
-    return price_by_symbol
+    return quote_by_symbol
+
+
+def get_prices(
+    db: Session,
+    symbols: list[str],
+    freshness: Freshness = "display",
+    stale_while_revalidate: bool = False,
+) -> dict[str, float]:
+    return {
+        symbol: price
+        for symbol, (price, _) in get_quotes(
+            db, symbols, freshness, stale_while_revalidate
+        ).items()
+    }
 
 
-def get_price(
-    db: Session, symbol: str, delay_seconds: float = _PRICE_DELAY_SECONDS
-) -> float:
-    return get_prices(db, [symbol], delay_seconds)[symbol]
+def get_price(db: Session, symbol: str, freshness: Freshness = "display") -> float:
+    return get_prices(db, [symbol], freshness)[symbol]
@@ -0,0 +1,230 @@
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import csv
+from datetime import datetime, timezone
+import logging
+import math
+import os
+import pickle
+from sherwood.errors import MarketDataProviderError
+from sherwood.models import as_utc
+import time
+import yfinance
+
+FETCH_TIMEOUT_SECONDS = 5
+
+_FETCH_MAX_WORKERS = 8
+
+MARKET_DATA_REPLAY_PATH_ENV_VAR_NAME = "SHERWOOD_MARKET_DATA_REPLAY_PATH"
+MARKET_DATA_REPLAY_LATENCY_ENV_VAR_NAME = "SHERWOOD_MARKET_DATA_REPLAY_LATENCY_SECONDS"
+MARKET_DATA_REPLAY_START_ENV_VAR_NAME = "SHERWOOD_MARKET_DATA_REPLAY_START"
+MARKET_DATA_REPLAY_SPEED_ENV_VAR_NAME = "SHERWOOD_MARKET_DATA_REPLAY_SPEED"
+
+
+class MarketDataProvider:
+    """Source of current prices used by market_data.get_prices.
+
+    fetch_prices returns whichever of the symbols could be priced; symbols that
+    couldn't be are omitted rather than failing the whole batch. It raises
+    MarketDataProviderError if the provider itself is unavailable.
+
+    fetch_prices_and_failures also returns the omitted symbols whose lookups
+    failed or timed out, as opposed to those the provider has no price for.
+    """
+
+    def fetch_prices(self, symbols: list[str]) -> dict[str, float]:
+        raise NotImplementedError
+
+    def fetch_prices_and_failures(
+        self, symbols: list[str]
+    ) -> tuple[dict[str, float], list[str]]:
+        return self.fetch_prices(symbols), []
+
+
+class YFinanceProvider(MarketDataProvider):
+    def __init__(
+        self,
+        max_workers: int = _FETCH_MAX_WORKERS,
+        timeout_seconds: float = FETCH_TIMEOUT_SECONDS,
+    ):
+        self._timeout_seconds = timeout_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="market-data"
+        )
+
+    def _download_prices(self, symbols: list[str]) -> dict[str, float]:
+        """Gets the latest price of each symbol in one bulk request.
+
+        Symbols the bulk endpoint has no bars for (e.g. mutual funds) are omitted.
+        """
+        bars = yfinance.download(
+            symbols,
+            period="1d",
+            interval="1m",
+            progress=False,
+            threads=False,
+            timeout=self._timeout_seconds,
+            multi_level_index=True,
+        )
+        if bars is None or bars.empty:
+            return {}
+        closes = bars["Close"].ffill().iloc[-1]
+        return {
+            symbol: float(price)
+            for symbol, price in closes.items()
+            if symbol in symbols and not math.isnan(price)
+        }
+
+    def _fetch_price(self, symbol: str) -> float:
+        info = yfinance.Ticker(symbol).info
+        return info.get("currentPrice") or info["navPrice"]
+
+    def fetch_prices(self, symbols: list[str]) -> dict[str, float]:
+        return self.fetch_prices_and_failures(symbols)[0]
+
+    def fetch_prices_and_failures(
+        self, symbols: list[str]
+    ) -> tuple[dict[str, float], list[str]]:
+        """All symbols are requested in one bulk call first. The symbols it misses
+        are looked up individually on a bounded thread pool under a shared deadline.
+
+        Lookups without a price (KeyError) reject the symbol. If nothing is priced
+        and any lookup errored or timed out, yfinance is treated as unavailable.
+        """
+        price_by_symbol = {}
+        try:
+            price_by_symbol.update(self._download_prices(symbols))
+        except Exception as exc:
+            logging.warning(
+                f"Bulk price download failed, symbols: {symbols}. Error: {exc}"
+            )
+
+        remaining = [symbol for symbol in symbols if symbol not in price_by_symbol]
+        future_by_symbol = {
+            symbol: self._executor.submit(self._fetch_price, symbol)
+            for symbol in remaining
+        }
+        deadline = time.monotonic() + self._timeout_seconds
+        failed = []
+        for symbol, future in future_by_symbol.items():
+            try:
+                price = future.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                future.cancel()
+                logging.warning(f"Timed out fetching price, symbol: {symbol}.")
+                failed.append(symbol)
+                continue
+            except KeyError:
+                continue
+            except Exception as exc:
+                logging.warning(
+                    f"Failed to fetch price, symbol: {symbol}. Error: {exc}"
+                )
+                failed.append(symbol)
+                continue
+            if price is not None:
+                price_by_symbol[symbol] = price
+
+        if failed and not price_by_symbol:
+            raise MarketDataProviderError(
+                f"yfinance is unavailable, symbols: {', '.join(failed)}."
+            )
+        return price_by_symbol, failed
+
+
+class ReplayProvider(MarketDataProvider):
+    """Serves recorded prices, for benchmarks and offline load tests.
+
+    The replay clock starts at `start` (default: the first timestamp by which
+    every recorded symbol has a price) and advances `speed` recorded seconds per
+    wall clock second; a speed of 0 freezes it. Each symbol is priced at its last
+    recorded price at or before the replay clock, and every fetch sleeps
+    `latency_seconds` to mimic a provider round trip.
+    """
+
+    def __init__(
+        self,
+        price_by_symbol_and_timestamp: dict[tuple[str, datetime], float],
+        latency_seconds: float = 0,
+        start: datetime | None = None,
+        speed: float = 1,
+    ):
+        prices_by_symbol = {}
+        for (symbol, timestamp), price in sorted(
+            price_by_symbol_and_timestamp.items(),
+            key=lambda item: (item[0][0], as_utc(item[0][1])),
+        ):
+            timestamps, prices = prices_by_symbol.setdefault(symbol, ([], []))
+            timestamps.append(as_utc(timestamp))
+            prices.append(price)
+        self._prices_by_symbol = prices_by_symbol
+        self._latency_seconds = latency_seconds
+        self._start = as_utc(start) if start else self._fully_priced_timestamp()
+        self._speed = speed
+        self._started_at = time.monotonic()
+
+    def _fully_priced_timestamp(self) -> datetime:
+        timestamps = [
+            timestamps[0] for timestamps, _ in self._prices_by_symbol.values()
+        ]
+        return max(timestamps, default=datetime.now(timezone.utc))
+
+    @classmethod
+    def from_pickle(cls, path: str, **kwargs) -> "ReplayProvider":
+        """Loads a (symbol, timestamp) -> price dict, e.g. prices.pkl."""
+        with open(path, "rb") as f:
+            return cls(pickle.load(f), **kwargs)
+
+    @classmethod
+    def from_csv(cls, path: str, **kwargs) -> "ReplayProvider":
+        """Loads bars with symbol, timestamp (ISO 8601) and close or price columns."""
+        price_by_symbol_and_timestamp = {}
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                key = (row["symbol"], datetime.fromisoformat(row["timestamp"]))
+                price_by_symbol_and_timestamp[key] = float(
+                    row["close"] if "close" in row else row["price"]
+                )
+        return cls(price_by_symbol_and_timestamp, **kwargs)
+
+    def now(self) -> datetime:
+        elapsed_seconds = (time.monotonic() - self._started_at) * self._speed
+        return datetime.fromtimestamp(
+            self._start.timestamp() + elapsed_seconds, timezone.utc
+        )
+
+    def fetch_prices(self, symbols: list[str]) -> dict[str, float]:
+        if self._latency_seconds:
+            time.sleep(self._latency_seconds)
+        replay_time = self.now()
+        price_by_symbol = {}
+        for symbol in symbols:
+            if symbol not in self._prices_by_symbol:
+                continue
+            timestamps, prices = self._prices_by_symbol[symbol]
+            if i := bisect_right(timestamps, replay_time):
+                price_by_symbol[symbol] = prices[i - 1]
+        return price_by_symbol
+
+
+def provider_from_env() -> MarketDataProvider:
+    """Replays recorded prices if SHERWOOD_MARKET_DATA_REPLAY_PATH is set (.pkl or
+    .csv), otherwise uses yfinance.
+
+    The replay's latency, start (ISO 8601) and speed are read from
+    SHERWOOD_MARKET_DATA_REPLAY_LATENCY_SECONDS, SHERWOOD_MARKET_DATA_REPLAY_START
+    and SHERWOOD_MARKET_DATA_REPLAY_SPEED, see ReplayProvider.
+    """
+    if not (path := os.environ.get(MARKET_DATA_REPLAY_PATH_ENV_VAR_NAME)):
+        return YFinanceProvider()
+    kwargs = {
+        "latency_seconds": float(
+            os.environ.get(MARKET_DATA_REPLAY_LATENCY_ENV_VAR_NAME, 0)
+        ),
+        "speed": float(os.environ.get(MARKET_DATA_REPLAY_SPEED_ENV_VAR_NAME, 1)),
+    }
+    if start := os.environ.get(MARKET_DATA_REPLAY_START_ENV_VAR_NAME):
+        kwargs["start"] = datetime.fromisoformat(start)
+    if path.endswith(".csv"):
+        return ReplayProvider.from_csv(path, **kwargs)
+    return ReplayProvider.from_pickle(path, **kwargs)
@@ -0,0 +1,184 @@
+"""Market data sidecar.
+
+Keeps the prices of every held symbol in memory, refreshed on a schedule, and
+serves them to the api workers over a Unix socket so that request latency
+never includes a provider call. See market_data._sidecar_quotes for the client.
+
+Protocol: one JSON object per line in each direction.
+
+  request:  {"symbols": ["AAA", "BBB"]}
+  response: {"quotes": {"AAA": [1.0, "2025-01-01T00:00:00+00:00"]}}
+
+Symbols the sidecar has no price for are omitted from the response and added
+to the refresh schedule.
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+from dotenv import load_dotenv
+import json
+import logging
+import os
+from sherwood.db import create_postgresql_engine, Session
+from sherwood.freshness import market_calendar, FreshnessPolicy
+from sherwood.market_data import (
+    _fetch_prices,
+    _store_quotes,
+    set_provider,
+    DOLLAR_SYMBOL,
+    MARKET_DATA_SOCKET_ENV_VAR_NAME,
+)
+from sherwood.market_data_providers import provider_from_env
+from sherwood.models import now, Holding
+from sherwood.price_history import apply_retention_policies
+
+_REFRESH_INTERVAL_SECONDS = 60
+_REQUESTED_SYMBOL_LIFETIME_SECONDS = 3600
+_RETENTION_INTERVAL_SECONDS = 3600
+
+
+class MarketDataServer:
+    def __init__(self, socket_path: str, refresh_interval_seconds: float):
+        self._socket_path = socket_path
+        self._refresh_interval_seconds = refresh_interval_seconds
+        self._quote_by_symbol: dict[str, tuple[float, datetime]] = {}
+        # symbols requested by workers but not held, by last request time
+        self._requested_at_by_symbol: dict[str, datetime] = {}
+        self._retention_applied_at: datetime | None = None
+
+    def _held_symbols(self) -> set[str]:
+        db = Session()
+        try:
+            return {symbol for (symbol,) in db.query(Holding.symbol).distinct()}
+        finally:
+            db.close()
+
+    def _prune_requested_symbols(self) -> None:
+        cutoff = now().timestamp() - _REQUESTED_SYMBOL_LIFETIME_SECONDS
+        self._requested_at_by_symbol = {
+            symbol: requested_at
+            for symbol, requested_at in self._requested_at_by_symbol.items()
+            if requested_at.timestamp() > cutoff
+        }
+
+    def _expired_symbols(self, symbols) -> set[str]:
+        """Symbols without a quote from this refresh interval, or from after the
+        last close while the market is closed."""
+        policy = FreshnessPolicy(self._refresh_interval_seconds, market_calendar)
+        return {
+            symbol
+            for symbol in symbols
+            if (quote := self._quote_by_symbol.get(symbol)) is None
+            or policy.has_expired(quote[1])
+        }
+
+    def refresh(self, symbols) -> None:
+        if not symbols:
+            return
+        price_by_symbol = _fetch_prices(sorted(symbols))
+        db = Session()
+        try:
+            _store_quotes(db, price_by_symbol)
+        finally:
+            db.close()
+        as_of = now()
+        for symbol, price in price_by_symbol.items():
+            self._quote_by_symbol[symbol] = (price, as_of)
+        if missing := set(symbols) - set(price_by_symbol):
+            logging.warning(f"Sidecar failed to refresh symbols: {sorted(missing)}")
+
+    def apply_retention_policies(self) -> None:
+        db = Session()
+        try:
+            deleted = apply_retention_policies(db)
+        finally:
+            db.close()
+        self._retention_applied_at = now()
+        logging.info(f"Sidecar deleted {deleted} quote history rows.")
+
+    def _retention_due(self) -> bool:
+        return (
+            self._retention_applied_at is None
+            or (now() - self._retention_applied_at).total_seconds()
+            > _RETENTION_INTERVAL_SECONDS
+        )
+
+    async def _refresh_forever(self) -> None:
+        while True:
+            try:
+                self._prune_requested_symbols()
+                symbols = await asyncio.to_thread(self._held_symbols)
+                symbols |= set(self._requested_at_by_symbol)
+                symbols.discard(DOLLAR_SYMBOL)
+                await asyncio.to_thread(self.refresh, self._expired_symbols(symbols))
+                if self._retention_due():
+                    await asyncio.to_thread(self.apply_retention_policies)
+            except Exception as exc:
+                logging.exception(f"Sidecar refresh failed. Error: {exc}")
+            await asyncio.sleep(self._refresh_interval_seconds)
+
+    def quotes(self, symbols: list[str]) -> dict[str, tuple[float, str]]:
+        quotes = {}
+        for symbol in symbols:
+            if (quote := self._quote_by_symbol.get(symbol)) is None:
+                self._requested_at_by_symbol[symbol] = now()
+                continue
+            price, as_of = quote
+            quotes[symbol] = (price, as_of.isoformat())
+        return quotes
+
+    async def _handle(self, reader, writer) -> None:
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                response = {"quotes": self.quotes(request["symbols"])}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, KeyError, ValueError) as exc:
+            logging.info(f"Sidecar client error: {exc}")
+        finally:
+            writer.close()
+
+    async def serve_forever(self) -> None:
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self._socket_path)
+        refresher = asyncio.create_task(self._refresh_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get(MARKET_DATA_SOCKET_ENV_VAR_NAME),
+        help=f"Unix socket path, defaults to ${MARKET_DATA_SOCKET_ENV_VAR_NAME}.",
+    )
+    parser.add_argument(
+        "--refresh-interval-seconds",
+        type=float,
+        default=_REFRESH_INTERVAL_SECONDS,
+    )
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error(f"--socket or ${MARKET_DATA_SOCKET_ENV_VAR_NAME} is required.")
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv("/root/.env", override=True)
+    engine = create_postgresql_engine()
+    Session.configure(bind=engine)
+    set_provider(provider_from_env())
+    server = MarketDataServer(args.socket, args.refresh_interval_seconds)
+    try:
+        asyncio.run(server.serve_forever())
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,12 @@ from pydantic import field_validator, BaseModel, EmailStr
 from sherwood.errors import (
     InvalidDisplayNameError,
     InvalidPasswordError,
+    InvalidSymbolError,
     RequestValueError,
 )
 from sherwood.auth import validate_display_name, validate_password
 from sherwood.models import TransactionType
+from sherwood.symbols import is_valid_symbol
 from typing import Any
 
 
@@ -45,10 +47,18 @@ class PasswordValidatorMixin:
         return password
 
 
+class SymbolValidatorMixin:
+    @field_validator("symbol")
+    def validate_symbol(cls, symbol):
+        if symbol is not None and not is_valid_symbol(symbol):
+            raise InvalidSymbolError(symbol)
+        return symbol
+
+
 class DollarsArePositiveValidatorMixin:
     @field_validator("dollars")
     def validate_dollars_are_positive(cls, dollars):
-        if dollars <= 0:
+        if dollars is not None and dollars <= 0:
             raise RequestValueError("Dollars must be positive.")
         return dollars
 
@@ -74,18 +84,31 @@ class SignInResponse(BaseModel):
     redirect_url: str
 
 
-class BuyRequest(BaseModel, DollarsArePositiveValidatorMixin):
+class QuoteRequest(BaseModel, SymbolValidatorMixin):
+    symbol: str
+
+
+class QuoteResponse(BaseModel):
+    symbol: str
+    price: float
+    expiration: datetime
+    quote_token: str
+
+
+class BuyRequest(BaseModel, SymbolValidatorMixin, DollarsArePositiveValidatorMixin):
     symbol: str
     dollars: float
+    quote_token: str | None = None
 
 
 class BuyResponse(BaseModel):
     pass
 
 
-class SellRequest(BaseModel, DollarsArePositiveValidatorMixin):
+class SellRequest(BaseModel, SymbolValidatorMixin, DollarsArePositiveValidatorMixin):
     symbol: str
     dollars: float
+    quote_token: str | None = None
 
 
 class SellResponse(BaseModel):
@@ -110,6 +133,55 @@ class DivestResponse(BaseModel):
     pass
 
 
+class OrdersRequest(BaseModel):
+    class Order(BaseModel, SymbolValidatorMixin, DollarsArePositiveValidatorMixin):
+        type: TransactionType
+        symbol: str | None = None
+        investee_portfolio_id: int | None = None
+        # sells without dollars sell the whole holding
+        dollars: float | None = None
+
+    orders: list[Order]
+
+
+class OrdersResponse(BaseModel):
+    pass
+
+
+class QueuedOrderRequest(
+    BaseModel, SymbolValidatorMixin, DollarsArePositiveValidatorMixin
+):
+    type: TransactionType
+    symbol: str | None = None
+    investee_portfolio_id: int | None = None
+    # sells without dollars sell the whole holding
+    dollars: float | None = None
+
+
+class QueuedOrderResponse(BaseModel):
+    order_id: int
+    status: str
+    # error detail of failed orders
+    detail: str | None = None
+
+
+class RebalanceRequest(BaseModel):
+    weights: dict[str, float]
+    dry_run: bool = False
+
+    @field_validator("weights")
+    def validate_weights(cls, weights):
+        for symbol in weights:
+            if not is_valid_symbol(symbol):
+                raise InvalidSymbolError(symbol)
+        return weights
+
+
+class RebalanceResponse(BaseModel):
+    # sells without dollars sell the whole holding
+    trades: list[OrdersRequest.Order]
+
+
 class LeaderboardRequest(BaseModel):
     class Column(Enum):
         LIFETIME_RETURN = "lifetime_return"
@@ -129,6 +201,8 @@ class LeaderboardResponse(BaseModel):
         columns: dict[str, Any]
 
     rows: list[Row]
+    # observation time of the oldest price the rows are computed from
+    as_of: datetime | None = None
 
 
 class PortfolioHoldingsRequest(BaseModel):
@@ -142,6 +216,8 @@ class PortfolioHoldingsRequest(BaseModel):
     portfolio_id: int
     columns: list[Column]
     sort_by: Column
+    # rows are the owner's units through all their stakes, see exposure
+    look_through: bool = False
 
 
 class PortfolioHoldingsResponse(BaseModel):
@@ -150,6 +226,8 @@ class PortfolioHoldingsResponse(BaseModel):
         columns: dict[str, Any]
 
     rows: list[Row]
+    # observation time of the oldest price the rows are computed from
+    as_of: datetime | None = None
 
 
 class PortfolioHistoryRequest(BaseModel):
@@ -190,6 +268,8 @@ class PortfolioInvestorsResponse(BaseModel):
         columns: dict[str, Any]
 
     rows: list[Row]
+    # observation time of the oldest price the rows are computed from
+    as_of: datetime | None = None
 
 
 class UserInvestmentsRequest(BaseModel):
@@ -211,6 +291,26 @@ class UserInvestmentsResponse(BaseModel):
         columns: dict[str, Any]
 
     rows: list[Row]
+    # observation time of the oldest price the rows are computed from
+    as_of: datetime | None = None
+
+
+class SymbolsResponse(BaseModel):
+    class Row(BaseModel):
+        symbol: str
+        name: str
+
+    rows: list[Row]
+
+
+class StatusResponse(BaseModel):
+    quote_cache: dict[str, int]
+    negative_cache: dict[str, int]
+    circuit_breaker: dict[str, Any]
+    quote_hub: dict[str, int]
+    transactions: dict[str, float]
+    exposure: dict[str, int]
+    investment_graph: dict[str, int]
 
 
 __all__ = [
@@ -218,6 +318,8 @@ __all__ = [
     "SignUpResponse",
     "SignInRequest",
     "SignInResponse",
+    "QuoteRequest",
+    "QuoteResponse",
     "BuyRequest",
     "BuyResponse",
     "SellRequest",
@@ -226,6 +328,12 @@ __all__ = [
     "InvestResponse",
     "DivestRequest",
     "DivestResponse",
+    "OrdersRequest",
+    "OrdersResponse",
+    "QueuedOrderRequest",
+    "QueuedOrderResponse",
+    "RebalanceRequest",
+    "RebalanceResponse",
     "LeaderboardRequest",
     "LeaderboardResponse",
     "PortfolioHoldingsRequest",
@@ -236,4 +344,6 @@ __all__ = [
     "PortfolioInvestorsResponse",
     "UserInvestmentsRequest",
     "UserInvestmentsResponse",
+    "SymbolsResponse",
+    "StatusResponse",
 ]
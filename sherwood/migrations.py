@@ -0,0 +1,111 @@
+"""Data migrations.
+
+  python -m sherwood.migrations columns
+  python -m sherwood.migrations shares [--portfolio-ids 1 2 ...]
+
+columns adds the share columns to existing tables, as create_all only creates
+missing tables. It changes no data, is safe to rerun, and has to run before a
+version mapping the columns starts, see main.sh.
+
+shares moves portfolios from percent-based to share-based ownership, see
+models.ownership_percent. It's a separate, explicit step.
+"""
+
+import argparse
+from dotenv import load_dotenv
+import logging
+from sherwood.broker import _lock_portfolios
+from sherwood.db import create_postgresql_engine, maybe_commit, Session
+from sherwood.models import Portfolio, INITIAL_PORTFOLIO_SHARES
+from sqlalchemy import inspect, text, Engine
+from sqlalchemy.orm import Session as SqlAlchemyOrmSession
+
+_MIGRATED_PORTFOLIO_SHARES = INITIAL_PORTFOLIO_SHARES
+
+
+def add_share_columns(engine: Engine) -> None:
+    """Adds portfolios.shares and ownership.shares, and makes ownership.percent
+    nullable, if the tables predate them. Tables that don't exist yet are left
+    to create_all."""
+    inspector = inspect(engine)
+    if not inspector.has_table("portfolios") or not inspector.has_table("ownership"):
+        return
+    with engine.begin() as connection:
+        for table in ["portfolios", "ownership"]:
+            columns = {column["name"] for column in inspector.get_columns(table)}
+            if "shares" not in columns:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN shares FLOAT"))
+        if engine.dialect.name == "postgresql":
+            connection.execute(
+                text("ALTER TABLE ownership ALTER COLUMN percent DROP NOT NULL")
+            )
+
+
+def migrate_portfolios_to_shares(
+    db: SqlAlchemyOrmSession, portfolio_ids: list[int] | None = None
+) -> int:
+    """Converts each ownership percent to shares of the portfolio.
+
+    Percents are normalized on the way, which also drops any float drift.
+    Returns the number of migrated portfolios.
+    """
+    if portfolio_ids is None:
+        portfolio_ids = [
+            portfolio_id
+            for (portfolio_id,) in db.query(Portfolio.id).filter(
+                Portfolio.shares.is_(None)
+            )
+        ]
+    if not portfolio_ids:
+        return 0
+    migrated = 0
+    for portfolio in _lock_portfolios(db, portfolio_ids).values():
+        if portfolio.shares is not None:
+            continue
+        total_percent = sum(ownership.percent for ownership in portfolio.ownership)
+        if total_percent <= 0:
+            logging.warning(f"Portfolio {portfolio.id} has no ownership to migrate.")
+            continue
+        portfolio.shares = _MIGRATED_PORTFOLIO_SHARES
+        for ownership in portfolio.ownership:
+            ownership.shares = (
+                ownership.percent / total_percent * _MIGRATED_PORTFOLIO_SHARES
+            )
+            ownership.percent = None
+        migrated += 1
+    maybe_commit(db, "Failed to migrate portfolios to shares.")
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="migration", required=True)
+    subparsers.add_parser("columns")
+    shares_parser = subparsers.add_parser("shares")
+    shares_parser.add_argument(
+        "--portfolio-ids",
+        type=int,
+        nargs="+",
+        help="Portfolios to migrate, defaults to all percent-based portfolios.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv("/root/.env", override=True)
+    engine = create_postgresql_engine()
+    Session.configure(bind=engine)
+    try:
+        add_share_columns(engine)
+        if args.migration == "shares":
+            db = Session()
+            try:
+                migrated = migrate_portfolios_to_shares(db, args.portfolio_ids)
+            finally:
+                db.close()
+            logging.info(f"Migrated {migrated} portfolios to shares.")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
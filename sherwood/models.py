@@ -2,12 +2,13 @@ from collections.abc import Iterable
 from dataclasses import fields
 from datetime import datetime, timezone
 from enum import Enum
+import os
 from sherwood.db import maybe_commit
-from sherwood.errors import DuplicateQuoteError, InternalServerError
+from sherwood.errors import InternalServerError
+from sherwood.freshness import as_utc, freshness_policy, Freshness
 from six import string_types
 from sqlalchemy import func, DateTime, ForeignKey, Index
 from sqlalchemy.event import listens_for
-from sqlalchemy.exc import MultipleResultsFound
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -21,6 +22,11 @@ from typing import Any
 
 now = lambda: datetime.now(timezone.utc)
 
+# set to 1 once the share columns are migrated, see migrations.add_share_columns
+SHARE_BASED_PORTFOLIOS_ENV_VAR_NAME = "SHERWOOD_SHARE_BASED_PORTFOLIOS"
+# every share-based portfolio starts out with this many shares, whatever its value
+INITIAL_PORTFOLIO_SHARES = 1_000_000.0
+
 
 class BaseModel(DeclarativeBase, MappedAsDataclass):
     __abstract__ = True
@@ -150,6 +156,15 @@ class Portfolio(BaseModel):
         compare=False,
     )
 
+    # share-based portfolios track ownership.shares instead of ownership.percent,
+    # see ownership_percent
+    shares: Mapped[float | None] = mapped_column(
+        nullable=True,
+        default=None,
+        compare=True,
+        repr=True,
+    )
+
 
 class TransactionType(Enum):
     BUY = "buy"
@@ -219,6 +234,78 @@ def prevent_update_delete(mapper, connection, target):
     )
 
 
+class QueuedOrderStatus(Enum):
+    QUEUED = "queued"
+    EXECUTED = "executed"
+    FAILED = "failed"
+
+
+class QueuedOrder(BaseModel):
+    """An order waiting for, or applied by, the order executor, see order_queue."""
+
+    __tablename__ = "queued_orders"
+
+    id: Mapped[int] = mapped_column(
+        init=False,
+        repr=True,
+        primary_key=True,
+        autoincrement=True,
+        compare=True,
+    )
+
+    portfolio_id: Mapped[int] = mapped_column(
+        ForeignKey("portfolios.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+        compare=True,
+        repr=True,
+    )
+
+    type: Mapped[TransactionType] = mapped_column(
+        nullable=False,
+        repr=True,
+        compare=True,
+    )
+
+    symbol: Mapped[str | None] = mapped_column(
+        nullable=True,
+        repr=True,
+        compare=True,
+        default=None,
+    )
+
+    investee_portfolio_id: Mapped[int | None] = mapped_column(
+        nullable=True,
+        repr=True,
+        compare=True,
+        default=None,
+    )
+
+    # None sells the whole holding
+    dollars: Mapped[float | None] = mapped_column(
+        nullable=True,
+        repr=True,
+        compare=True,
+        default=None,
+    )
+
+    status: Mapped[QueuedOrderStatus] = mapped_column(
+        nullable=False,
+        index=True,
+        repr=True,
+        compare=True,
+        default=QueuedOrderStatus.QUEUED,
+    )
+
+    # error detail of failed orders
+    detail: Mapped[str | None] = mapped_column(
+        nullable=True,
+        repr=True,
+        compare=True,
+        default=None,
+    )
+
+
 class Holding(BaseModel):
     __tablename__ = "holdings"
 
@@ -276,7 +363,9 @@ class Ownership(BaseModel):
         repr=True,
     )
 
-    percent: Mapped[float] = mapped_column(
+    # None for share-based portfolios
+    percent: Mapped[float | None] = mapped_column(
+        nullable=True,
         compare=True,
         repr=True,
     )
@@ -289,6 +378,14 @@ class Ownership(BaseModel):
         compare=False,
     )
 
+    # None for percent-based portfolios
+    shares: Mapped[float | None] = mapped_column(
+        nullable=True,
+        default=None,
+        compare=True,
+        repr=True,
+    )
+
 
 class Quote(BaseModel):
     __tablename__ = "quotes"
@@ -310,6 +407,39 @@ class Quote(BaseModel):
     )
 
 
+class QuoteHistory(BaseModel):
+    __tablename__ = "quote_history"
+
+    symbol: Mapped[str] = mapped_column(
+        primary_key=True,
+        init=True,
+        repr=True,
+        compare=True,
+        nullable=False,
+    )
+
+    timestamp: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        primary_key=True,
+        init=True,
+        repr=True,
+        compare=True,
+        nullable=False,
+    )
+
+    price: Mapped[float] = mapped_column(
+        init=True,
+        repr=True,
+        compare=True,
+        nullable=False,
+    )
+
+
+@listens_for(QuoteHistory, "before_update")
+def prevent_quote_history_update(mapper, connection, target):
+    raise InternalServerError(f"Updates not allowed on {target.__tablename__}.")
+
+
 class Blob(BaseModel):
     __tablename__ = "blobs"
 
@@ -331,13 +461,71 @@ class Blob(BaseModel):
     )
 
 
+class IdempotencyRecord(BaseModel):
+    """The outcome of a request made with an idempotency key, see idempotency."""
+
+    __tablename__ = "idempotency_records"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+        compare=True,
+        repr=True,
+    )
+
+    key: Mapped[str] = mapped_column(
+        primary_key=True,
+        compare=True,
+        repr=True,
+    )
+
+    # hash of the route and request body the key was first used with
+    fingerprint: Mapped[str] = mapped_column(
+        nullable=False,
+        compare=True,
+        repr=True,
+    )
+
+    # None while the request is in progress
+    status_code: Mapped[int | None] = mapped_column(
+        nullable=True,
+        compare=True,
+        repr=True,
+        default=None,
+    )
+
+    response: Mapped[str | None] = mapped_column(
+        nullable=True,
+        compare=True,
+        repr=False,
+        default=None,
+    )
+
+    __table_args__ = (Index("ix_idempotency_records_created", "created"),)
+
+
+def ownership_percent(ownership: Ownership) -> float:
+    """The fraction of its portfolio the ownership holds."""
+    portfolio = ownership.portfolio
+    if portfolio.shares is None:
+        return ownership.percent
+    if portfolio.shares == 0:
+        return 0.0
+    return ownership.shares / portfolio.shares
+
+
 def create_user(
     db: Session,
     email: str,
     display_name: str,
     password: str,
     starting_balance: float = 0,
+    share_based: bool | None = None,
 ) -> User:
+    """Creates the user and their portfolio, which is share-based if share_based
+    or, by default, if SHERWOOD_SHARE_BASED_PORTFOLIOS is 1."""
+    if share_based is None:
+        share_based = os.environ.get(SHARE_BASED_PORTFOLIOS_ENV_VAR_NAME) == "1"
     user = User(email=email, display_name=display_name, password=password)
     db.add(user)
     maybe_commit(db, "Failed to create user.")
@@ -357,9 +545,11 @@ def create_user(
                 portfolio_id=portfolio_id,
                 owner_id=user.id,
                 cost=starting_balance,
-                percent=1,
+                percent=None if share_based else 1,
+                shares=INITIAL_PORTFOLIO_SHARES if share_based else None,
             )
         ],
+        shares=INITIAL_PORTFOLIO_SHARES if share_based else None,
     )
     maybe_commit(db, "Failed to create portfolio for new user.")
     db.refresh(user)
@@ -380,15 +570,47 @@ def update_quote(db: Session, quote: Quote, price: float) -> Quote:
     return quote
 
 
-def upsert_quote(db: Session, symbol: str, price: float) -> Quote:
-    try:
-        quote = db.query(Quote).filter_by(symbol=symbol).with_for_update().one_or_none()
-    except MultipleResultsFound:
-        raise DuplicateQuoteError(symbol=symbol)
-    if quote is None:
-        return create_quote(db, symbol, price)
+def upsert_quotes(
+    db: Session, price_by_symbol: dict[str, float], timestamp: datetime | None = None
+) -> None:
+    """Inserts or updates the quotes in one INSERT ... ON CONFLICT DO UPDATE.
+
+    Rows are written in symbol order so that concurrent upserts lock them in the
+    same order. Not committed; quotes loaded in the session are stale until then.
+    """
+    if not price_by_symbol:
+        return
+    timestamp = timestamp or now()
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
     else:
-        return update_quote(db, quote, price)
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(Quote).values(
+        [
+            {
+                "symbol": symbol,
+                "price": price_by_symbol[symbol],
+                "created": timestamp,
+                "last_modified": timestamp,
+            }
+            for symbol in sorted(price_by_symbol)
+        ]
+    )
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[Quote.symbol],
+            set_={
+                "price": stmt.excluded.price,
+                "last_modified": stmt.excluded.last_modified,
+            },
+        )
+    )
+
+
+def upsert_quote(db: Session, symbol: str, price: float) -> Quote:
+    upsert_quotes(db, {symbol: price})
+    maybe_commit(db, "Failed to upsert quote.")
+    return db.get(Quote, symbol, populate_existing=True)
 
 
 def create_blob(db: Session, key: str, value: str) -> Blob:
@@ -425,10 +647,5 @@ def to_dict(obj: Any) -> dict[str, Any]:
     return obj
 
 
-def has_expired(model: BaseModel, seconds: int):
-    last_modified = model.last_modified
-    # this in mainly for unit tests because sqlite supports
-    # in-memory databases but not timezone-aware types
-    if last_modified.tzinfo is None:
-        last_modified = last_modified.replace(tzinfo=timezone.utc)
-    return (now() - last_modified).total_seconds() > seconds
+def has_expired(model: BaseModel, freshness: Freshness):
+    return freshness_policy(freshness).has_expired(as_utc(model.last_modified))
@@ -0,0 +1,293 @@
+"""Queued order execution.
+
+Instead of trading under row locks in the api workers, clients can enqueue an
+order (POST /api/order-queue) and wait for it (GET or websocket
+/api/order-queue/{order_id}). Orders are rows in queued_orders, so they survive
+restarts, and an executor process applies them in arrival order:
+
+  python -m sherwood.order_queue
+
+With a single writer, queued orders never contend for portfolio locks, and api
+workers don't hold connections waiting on them. Orders are applied with the
+broker's own execute path, so they behave exactly like direct trades.
+
+With --group-commit-size N, up to N queued orders share a transaction and one
+commit, see execute_next_orders.
+
+Executors lock the orders they pick, so a second executor started by mistake
+(or during a deploy) skips them rather than applying them twice.
+
+The executor also purges expired idempotency records, see idempotency.Idempotent.
+"""
+
+import argparse
+import asyncio
+from dotenv import load_dotenv
+import logging
+from sherwood.broker import (
+    _apply_orders,
+    _lock_priced_order_portfolios,
+    _lock_priced_portfolios,
+    validate_orders,
+    Order,
+)
+from sherwood.db import (
+    create_postgresql_engine,
+    is_retryable_error,
+    maybe_commit,
+    retry_transaction,
+    Session,
+)
+from sherwood.errors import SherwoodError
+from sherwood.idempotency import purge_expired_idempotency_records
+from sherwood.market_data import set_provider
+from sherwood.market_data_providers import provider_from_env
+from sherwood.models import now, QueuedOrder, QueuedOrderStatus
+from sqlalchemy.orm import Session as SqlAlchemyOrmSession
+
+_POLL_INTERVAL_SECONDS = 0.5
+_PURGE_INTERVAL_SECONDS = 3600
+
+
+def enqueue_order(db: SqlAlchemyOrmSession, portfolio_id: int, order: Order) -> int:
+    """Queues the owner's order for the executor. Returns the order id."""
+    validate_orders(portfolio_id, [order])
+    queued_order = QueuedOrder(
+        portfolio_id=portfolio_id,
+        type=order.type,
+        symbol=order.symbol,
+        investee_portfolio_id=order.investee_portfolio_id,
+        dollars=order.dollars,
+    )
+    db.add(queued_order)
+    maybe_commit(db, "Failed to enqueue order.")
+    return queued_order.id
+
+
+def _order(queued_order: QueuedOrder) -> Order:
+    return Order(
+        queued_order.type,
+        dollars=queued_order.dollars,
+        symbol=queued_order.symbol,
+        investee_portfolio_id=queued_order.investee_portfolio_id,
+    )
+
+
+def _fail(queued_order: QueuedOrder, exc: Exception) -> None:
+    logging.warning(f"Failed to execute {queued_order}. Error: {exc}")
+    queued_order.status = QueuedOrderStatus.FAILED
+    queued_order.detail = (
+        str(exc.detail) if isinstance(exc, SherwoodError) else "Internal error."
+    )
+
+
+def _queued_orders(db: SqlAlchemyOrmSession):
+    """Queued orders, locked so no other executor picks them too. Orders locked
+    by another executor are skipped. Ignored by sqlite."""
+    return (
+        db.query(QueuedOrder)
+        .filter(QueuedOrder.status == QueuedOrderStatus.QUEUED)
+        .order_by(QueuedOrder.id)
+        .with_for_update(skip_locked=True)
+    )
+
+
+@retry_transaction
+def _execute(db: SqlAlchemyOrmSession, queued_order: QueuedOrder) -> None:
+    # a retry runs after the rollback released the row lock, so another
+    # executor may have applied the order since
+    db.refresh(queued_order, with_for_update=True)
+    if queued_order.status != QueuedOrderStatus.QUEUED:
+        return
+    order = _order(queued_order)
+    portfolio_by_id, price_by_symbol = _lock_priced_order_portfolios(
+        db, queued_order.portfolio_id, [order]
+    )
+    _apply_orders(
+        db, portfolio_by_id, queued_order.portfolio_id, [order], price_by_symbol
+    )
+    # committed with the trade, so an order is never applied twice
+    queued_order.status = QueuedOrderStatus.EXECUTED
+    maybe_commit(db, "Failed to execute queued order.")
+
+
+def execute_next_order(db: SqlAlchemyOrmSession) -> QueuedOrder | None:
+    """Applies the oldest queued order, if any, and returns it."""
+    queued_order = _queued_orders(db).first()
+    if queued_order is None:
+        return None
+    try:
+        _execute(db, queued_order)
+    except Exception as exc:
+        db.rollback()
+        # failing the order rather than retrying keeps one bad order from
+        # blocking the queue
+        _fail(queued_order, exc)
+        maybe_commit(db, "Failed to record failed queued order.")
+    return queued_order
+
+
+@retry_transaction
+def _execute_group(db: SqlAlchemyOrmSession, queued_orders: list[QueuedOrder]) -> None:
+    # as in _execute, relock the orders and skip any applied since a retry
+    queued_orders = (
+        db.query(QueuedOrder)
+        .filter(QueuedOrder.id.in_([queued_order.id for queued_order in queued_orders]))
+        .filter(QueuedOrder.status == QueuedOrderStatus.QUEUED)
+        .order_by(QueuedOrder.id)
+        .with_for_update()
+        .populate_existing()
+        .all()
+    )
+    if not queued_orders:
+        return
+    portfolio_ids, symbols = set(), set()
+    for queued_order in queued_orders:
+        portfolio_ids.add(queued_order.portfolio_id)
+        if queued_order.investee_portfolio_id is not None:
+            portfolio_ids.add(queued_order.investee_portfolio_id)
+        if queued_order.symbol is not None:
+            symbols.add(queued_order.symbol)
+    portfolio_by_id, price_by_symbol = _lock_priced_portfolios(
+        db, sorted(portfolio_ids), symbols=symbols
+    )
+    for queued_order in queued_orders:
+        order = _order(queued_order)
+        try:
+            with db.begin_nested():
+                _apply_orders(
+                    db,
+                    portfolio_by_id,
+                    queued_order.portfolio_id,
+                    [order],
+                    price_by_symbol,
+                )
+        except Exception as exc:
+            if is_retryable_error(exc):
+                raise
+            _fail(queued_order, exc)
+        else:
+            queued_order.status = QueuedOrderStatus.EXECUTED
+    maybe_commit(db, "Failed to execute queued orders.")
+
+
+def execute_next_orders(
+    db: SqlAlchemyOrmSession, max_group_size: int
+) -> list[QueuedOrder]:
+    """Applies up to max_group_size of the oldest queued orders in one
+    transaction, with a savepoint per order, and returns them.
+
+    One commit covers the group, so under a stream of small trades the commit
+    cost is shared. Orders still succeed or fail individually. If the group
+    can't commit, its orders are applied one at a time instead.
+    """
+    queued_orders = _queued_orders(db).limit(max_group_size).all()
+    if len(queued_orders) < 2:
+        return [execute_next_order(db)] if queued_orders else []
+    try:
+        _execute_group(db, queued_orders)
+    except Exception as exc:
+        db.rollback()
+        logging.warning(f"Failed to group commit queued orders. Error: {exc}")
+        for _ in queued_orders:
+            execute_next_order(db)
+    return queued_orders
+
+
+def get_queued_order(
+    db: SqlAlchemyOrmSession, portfolio_id: int, order_id: int
+) -> QueuedOrder | None:
+    """Gets the owner's queued order."""
+    queued_order = db.get(QueuedOrder, order_id, populate_existing=True)
+    if queued_order is None or queued_order.portfolio_id != portfolio_id:
+        return None
+    return queued_order
+
+
+class OrderExecutor:
+    """Polls for queued orders and applies them.
+
+    With a group_commit_size above 1, orders that queue up while the executor is
+    polling or busy are applied group_commit_size at a time, see
+    execute_next_orders.
+    """
+
+    def __init__(
+        self,
+        poll_interval_seconds: float = _POLL_INTERVAL_SECONDS,
+        group_commit_size: int = 1,
+    ):
+        self._poll_interval_seconds = poll_interval_seconds
+        self._group_commit_size = group_commit_size
+        self._purged_at = None
+
+    def drain(self) -> int:
+        """Applies queued orders until none are left. Returns how many."""
+        db = Session()
+        try:
+            executed = 0
+            while queued_orders := execute_next_orders(db, self._group_commit_size):
+                for queued_order in queued_orders:
+                    logging.info(f"Executor applied {queued_order}.")
+                executed += len(queued_orders)
+            return executed
+        finally:
+            db.close()
+
+    def purge_expired_idempotency_records(self) -> int:
+        db = Session()
+        try:
+            purged = purge_expired_idempotency_records(db)
+        finally:
+            db.close()
+        self._purged_at = now()
+        logging.info(f"Executor purged {purged} expired idempotency records.")
+        return purged
+
+    def _purge_due(self) -> bool:
+        return (
+            self._purged_at is None
+            or (now() - self._purged_at).total_seconds() > _PURGE_INTERVAL_SECONDS
+        )
+
+    async def run_forever(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.drain)
+                if self._purge_due():
+                    await asyncio.to_thread(self.purge_expired_idempotency_records)
+            except Exception as exc:
+                logging.exception(f"Executor failed. Error: {exc}")
+            await asyncio.sleep(self._poll_interval_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--poll-interval-seconds", type=float, default=_POLL_INTERVAL_SECONDS
+    )
+    parser.add_argument(
+        "--group-commit-size",
+        type=int,
+        default=1,
+        help="Max queued orders applied per transaction.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv("/root/.env", override=True)
+    engine = create_postgresql_engine()
+    Session.configure(bind=engine)
+    set_provider(provider_from_env())
+    try:
+        asyncio.run(
+            OrderExecutor(
+                args.poll_interval_seconds, args.group_commit_size
+            ).run_forever()
+        )
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from sherwood.db import maybe_commit
+from sherwood.models import as_utc, now, QuoteHistory
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+_DELETE_BATCH_SIZE = 500
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """Prices older than `age` are thinned to the last price per `interval`, or
+    deleted if `interval` is None."""
+
+    age: timedelta
+    interval: timedelta | None
+
+
+DEFAULT_RETENTION_POLICIES = (
+    RetentionPolicy(age=timedelta(days=1), interval=timedelta(minutes=5)),
+    RetentionPolicy(age=timedelta(days=30), interval=timedelta(hours=1)),
+    RetentionPolicy(age=timedelta(days=365), interval=timedelta(days=1)),
+    RetentionPolicy(age=timedelta(days=5 * 365), interval=None),
+)
+
+
+def _bucket(timestamp: datetime, interval: timedelta) -> int:
+    return int(as_utc(timestamp).timestamp() // interval.total_seconds())
+
+
+def record_prices(
+    db: Session, price_by_symbol: dict[str, float], timestamp: datetime
+) -> None:
+    """Appends observed prices to the history in one bulk INSERT. Committed with
+    the caller's transaction."""
+    if not price_by_symbol:
+        return
+    db.execute(
+        insert(QuoteHistory),
+        [
+            {
+                "symbol": symbol,
+                "timestamp": timestamp,
+                "price": price,
+                "created": timestamp,
+                "last_modified": timestamp,
+            }
+            for symbol, price in price_by_symbol.items()
+        ],
+    )
+
+
+def get_price_history(
+    db: Session,
+    symbols: list[str],
+    start: datetime,
+    end: datetime,
+    interval: timedelta | None = None,
+) -> dict[str, list[tuple[datetime, float]]]:
+    """Gets the recorded prices of symbols with start <= timestamp <= end.
+
+    If interval is given, only the last price in each interval is returned.
+    """
+    rows = (
+        db.query(QuoteHistory.symbol, QuoteHistory.timestamp, QuoteHistory.price)
+        .filter(
+            QuoteHistory.symbol.in_(symbols),
+            QuoteHistory.timestamp >= start,
+            QuoteHistory.timestamp <= end,
+        )
+        .order_by(QuoteHistory.symbol, QuoteHistory.timestamp)
+    )
+    history_by_symbol = {symbol: [] for symbol in symbols}
+    for symbol, timestamp, price in rows:
+        history = history_by_symbol[symbol]
+        if (
+            interval is not None
+            and history
+            and _bucket(history[-1][0], interval) == _bucket(timestamp, interval)
+        ):
+            history.pop()
+        history.append((as_utc(timestamp), price))
+    return history_by_symbol
+
+
+def apply_retention_policies(db: Session, policies=DEFAULT_RETENTION_POLICIES) -> int:
+    """Thins and expires old prices so the history stays bounded.
+
+    Returns the number of deleted rows.
+    """
+    deleted = 0
+    for policy in sorted(policies, key=lambda policy: policy.age):
+        cutoff = now() - policy.age
+        if policy.interval is None:
+            deleted += db.execute(
+                delete(QuoteHistory).where(QuoteHistory.timestamp < cutoff),
+                execution_options={"synchronize_session": False},
+            ).rowcount
+            continue
+        rows = (
+            db.query(QuoteHistory.symbol, QuoteHistory.timestamp)
+            .filter(QuoteHistory.timestamp < cutoff)
+            .order_by(QuoteHistory.symbol, QuoteHistory.timestamp.desc())
+        )
+        timestamps_by_symbol = {}
+        last_kept = None
+        for symbol, timestamp in rows:
+            key = (symbol, _bucket(timestamp, policy.interval))
+            if key == last_kept:
+                timestamps_by_symbol.setdefault(symbol, []).append(timestamp)
+            last_kept = key
+        for symbol, timestamps in timestamps_by_symbol.items():
+            for i in range(0, len(timestamps), _DELETE_BATCH_SIZE):
+                deleted += db.execute(
+                    delete(QuoteHistory).where(
+                        QuoteHistory.symbol == symbol,
+                        QuoteHistory.timestamp.in_(
+                            timestamps[i : i + _DELETE_BATCH_SIZE]
+                        ),
+                    ),
+                    execution_options={"synchronize_session": False},
+                ).rowcount
+    maybe_commit(db, "Failed to apply quote history retention policies.")
+    return deleted
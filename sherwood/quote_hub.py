@@ -0,0 +1,131 @@
+"""Fans out live prices to websocket clients, see api_quotes_websocket.
+
+The hub polls prices for the union of all subscribed symbols in one get_quotes
+call per interval, however many clients listen, and pushes changed prices to
+each subscriber's bounded queue. Symbols that can't be priced are skipped
+rather than failing the poll for everyone. An update replaces the symbol's
+undelivered one, so a slow client only ever misses intermediate prices and
+never stalls the hub.
+"""
+
+import asyncio
+from datetime import datetime
+import logging
+from sherwood.db import Session
+from sherwood.market_data import get_quotes
+
+_POLL_INTERVAL_SECONDS = 5
+_SUBSCRIPTION_QUEUE_SIZE = 64
+
+
+def _get_quotes(symbols: list[str]) -> dict[str, tuple[float, datetime]]:
+    db = Session()
+    try:
+        return get_quotes(db, symbols, stale_while_revalidate=True, partial=True)
+    finally:
+        db.close()
+
+
+class Subscription:
+    """Queue of the latest undelivered message per symbol, in the order their
+    symbols were first queued. Messages without a symbol are never coalesced."""
+
+    def __init__(self, queue_size: int):
+        self.symbols: set[str] = set()
+        self._keys: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._message_by_key: dict = {}
+        self.dropped = 0
+
+    def put_latest(self, message: dict) -> None:
+        key = message.get("symbol") or object()
+        if key in self._message_by_key:
+            self._message_by_key[key] = message
+            self.dropped += 1
+            return
+        if self._keys.full():
+            self._message_by_key.pop(self._keys.get_nowait())
+            self.dropped += 1
+        self._message_by_key[key] = message
+        self._keys.put_nowait(key)
+
+    async def get(self) -> dict:
+        return self._message_by_key.pop(await self._keys.get())
+
+    def empty(self) -> bool:
+        return self._keys.empty()
+
+
+class QuoteHub:
+    def __init__(
+        self,
+        poll_interval_seconds: float = _POLL_INTERVAL_SECONDS,
+        queue_size: int = _SUBSCRIPTION_QUEUE_SIZE,
+        get_quotes_fn=_get_quotes,
+    ):
+        self._poll_interval_seconds = poll_interval_seconds
+        self._queue_size = queue_size
+        self._get_quotes_fn = get_quotes_fn
+        self._subscriptions_by_symbol: dict[str, set[Subscription]] = {}
+        self._quote_by_symbol: dict[str, tuple[float, datetime]] = {}
+        self._poller: asyncio.Task | None = None
+
+    def subscription(self) -> Subscription:
+        return Subscription(self._queue_size)
+
+    def subscribe(self, subscription: Subscription, symbols) -> None:
+        for symbol in symbols:
+            subscription.symbols.add(symbol)
+            self._subscriptions_by_symbol.setdefault(symbol, set()).add(subscription)
+            if (quote := self._quote_by_symbol.get(symbol)) is not None:
+                subscription.put_latest(_message(symbol, *quote))
+        if self._subscriptions_by_symbol and self._poller is None:
+            self._poller = asyncio.create_task(self._poll_forever())
+
+    def unsubscribe(self, subscription: Subscription, symbols=None) -> None:
+        for symbol in list(subscription.symbols if symbols is None else symbols):
+            subscription.symbols.discard(symbol)
+            subscriptions = self._subscriptions_by_symbol.get(symbol, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions_by_symbol.pop(symbol, None)
+                self._quote_by_symbol.pop(symbol, None)
+        if not self._subscriptions_by_symbol and self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    def publish(self, quote_by_symbol: dict[str, tuple[float, datetime]]) -> None:
+        """Pushes the quotes whose price or time changed to their subscribers."""
+        for symbol, quote in quote_by_symbol.items():
+            if symbol not in self._subscriptions_by_symbol:
+                continue
+            if self._quote_by_symbol.get(symbol) == quote:
+                continue
+            self._quote_by_symbol[symbol] = quote
+            message = _message(symbol, *quote)
+            for subscription in self._subscriptions_by_symbol[symbol]:
+                subscription.put_latest(message)
+
+    async def _poll_forever(self) -> None:
+        while True:
+            if symbols := sorted(self._subscriptions_by_symbol):
+                try:
+                    self.publish(await asyncio.to_thread(self._get_quotes_fn, symbols))
+                except Exception as exc:
+                    logging.warning(
+                        f"Failed to poll quotes, symbols: {symbols}. Error: {exc}"
+                    )
+            await asyncio.sleep(self._poll_interval_seconds)
+
+    def stats(self) -> dict[str, int]:
+        subscriptions = set().union(*self._subscriptions_by_symbol.values())
+        return {
+            "symbols": len(self._subscriptions_by_symbol),
+            "subscriptions": len(subscriptions),
+        }
+
+
+def _message(symbol: str, price: float, as_of: datetime) -> dict:
+    return {"symbol": symbol, "price": price, "as_of": as_of.isoformat()}
+
+
+quote_hub = QuoteHub()
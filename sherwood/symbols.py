@@ -0,0 +1,103 @@
+"""Ticker universe index.
+
+The universe is a text file with one "SYMBOL<TAB>Name" line per symbol, sorted
+by symbol. It's memory-mapped, so every worker shares one copy through the page
+cache, and each worker only builds an array of line offsets to binary search.
+"""
+
+from array import array
+import logging
+import mmap
+import os
+from sherwood.market_data import DOLLAR_SYMBOL
+
+SYMBOLS_PATH_ENV_VAR_NAME = "SHERWOOD_SYMBOLS_PATH"
+
+_SEARCH_LIMIT = 20
+
+
+class SymbolIndex:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            # mmap can't map an empty file
+            self._data = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if os.fstat(f.fileno()).st_size
+                else b""
+            )
+        self._offsets = array("Q")
+        offset = 0
+        while offset < len(self._data):
+            self._offsets.append(offset)
+            end = self._data.find(b"\n", offset)
+            offset = len(self._data) if end == -1 else end + 1
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _line(self, i: int) -> tuple[bytes, bytes]:
+        start = self._offsets[i]
+        end = self._data.find(b"\n", start)
+        if end == -1:
+            end = len(self._data)
+        symbol, _, name = self._data[start:end].rstrip(b"\r").partition(b"\t")
+        return symbol, name
+
+    def _bisect_left(self, key: bytes) -> int:
+        lo, hi = 0, len(self._offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._line(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def name(self, symbol: str) -> str | None:
+        key = symbol.encode()
+        i = self._bisect_left(key)
+        if i < len(self._offsets) and (line := self._line(i))[0] == key:
+            return line[1].decode()
+        return None
+
+    def __contains__(self, symbol: str) -> bool:
+        return self.name(symbol) is not None
+
+    def search(self, prefix: str, limit: int = _SEARCH_LIMIT) -> list[tuple[str, str]]:
+        """Gets (symbol, name) of up to limit symbols starting with prefix."""
+        key = prefix.encode()
+        matches = []
+        for i in range(self._bisect_left(key), len(self._offsets)):
+            if len(matches) >= limit:
+                break
+            symbol, name = self._line(i)
+            if not symbol.startswith(key):
+                break
+            matches.append((symbol.decode(), name.decode()))
+        return matches
+
+
+_symbol_index: SymbolIndex | None = None
+
+
+def set_symbol_index(symbol_index: SymbolIndex | None) -> None:
+    global _symbol_index
+    _symbol_index = symbol_index
+
+
+def get_symbol_index() -> SymbolIndex | None:
+    return _symbol_index
+
+
+def symbol_index_from_env() -> SymbolIndex | None:
+    """Loads the index from SHERWOOD_SYMBOLS_PATH, if set."""
+    if not (path := os.environ.get(SYMBOLS_PATH_ENV_VAR_NAME)):
+        logging.info("No ticker universe configured, symbols aren't validated.")
+        return None
+    return SymbolIndex(path)
+
+
+def is_valid_symbol(symbol: str) -> bool:
+    """Symbols are checked against the universe, or all accepted without one.
+    Dollars are always valid, whether or not the universe lists them."""
+    return symbol == DOLLAR_SYMBOL or _symbol_index is None or symbol in _symbol_index
@@ -14,12 +14,16 @@ from sherwood.auth import (
     _JWT_ISSUER,
     JWT_SECRET_KEY_ENV_VAR_NAME,
 )
-from sherwood.db import get_db, Session
+from sherwood.db import get_db, AsyncSession, Session
+from sherwood.investment_graph import investment_graph
 from sherwood.main import create_app
 from sherwood import market_data
+from sherwood.market_data_providers import ReplayProvider
 from sherwood.models import BaseModel
 from sqlalchemy import create_engine
 from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
 from typing import Iterator
 
 
@@ -29,6 +33,12 @@ engine = create_engine(
     connect_args={"check_same_thread": False},
 )
 Session.configure(bind=engine)
+# the api's database, one shared connection so every request sees the same tables
+async_engine = create_async_engine(
+    URL.create(drivername="sqlite+aiosqlite", database=":memory:"),
+    poolclass=StaticPool,
+)
+AsyncSession.configure(bind=async_engine)
 
 
 @pytest.fixture(scope="function")
@@ -43,9 +53,11 @@ def client():
 
     @asynccontextmanager
     async def lifespan(_):
-        BaseModel.metadata.create_all(engine)
+        async with async_engine.begin() as connection:
+            await connection.run_sync(BaseModel.metadata.create_all)
         yield
-        BaseModel.metadata.drop_all(engine)
+        async with async_engine.begin() as connection:
+            await connection.run_sync(BaseModel.metadata.drop_all)
 
     app = create_app(lifespan=lifespan)
     app.dependency_overrides[get_cookie_security] = lambda: False
@@ -57,13 +69,28 @@ def client():
 
 @pytest.fixture(autouse=True)
 def mock_get_price(mocker):
-    mocker.patch.object(
-        market_data,
-        "_fetch_prices",
-        side_effect=lambda symbols: {
-            symbol: {"AAA": 1, "BBB": 2}[symbol] for symbol in symbols
-        },
-    )
+    recorded_at = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    provider = ReplayProvider({("AAA", recorded_at): 1, ("BBB", recorded_at): 2})
+    mocker.patch.object(market_data, "_provider", provider)
+    mocker.spy(market_data, "_fetch_prices")
+
+
+@pytest.fixture(autouse=True)
+def clear_quote_cache():
+    market_data.quote_cache.clear()
+    market_data.negative_cache.clear()
+    market_data.circuit_breaker.reset()
+    yield
+    market_data.quote_cache.clear()
+    market_data.negative_cache.clear()
+    market_data.circuit_breaker.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_investment_graph():
+    investment_graph.reset()
+    yield
+    investment_graph.reset()
 
 
 @pytest.fixture
@@ -1,4 +1,10 @@
+import pytest
+from sherwood import market_data, quote_hub
+from sherwood.db import AsyncSession
+from sherwood.models import now
+from sherwood.order_queue import execute_next_order
 from sherwood.registrar import STARTING_BALANCE
+from sherwood.symbols import set_symbol_index, SymbolIndex
 
 
 def test_sign_up_success(client, valid_email, valid_display_name, valid_password):
@@ -256,6 +262,218 @@ def test_sell_portfolio_holding_success(
     assert user["portfolio"]["ownership"][0]["percent"] == 1.0
 
 
+def test_buy_portfolio_holding_at_quoted_price(
+    client, valid_email, valid_display_name, valid_password
+):
+    sign_up_response = client.post(
+        "/api/sign-up",
+        json={
+            "email": valid_email,
+            "display_name": valid_display_name,
+            "password": valid_password,
+        },
+    )
+    assert sign_up_response.status_code == 200
+    sign_in_response = client.post(
+        "/api/sign-in", json={"email": valid_email, "password": valid_password}
+    )
+    assert sign_in_response.status_code == 200
+    quote_response = client.post("/api/quote", json={"symbol": "BBB"})
+    assert quote_response.status_code == 200
+    quote = quote_response.json()
+    assert quote["price"] == 2
+    market_data._fetch_prices.reset_mock()
+    buy_response = client.post(
+        "/api/buy",
+        json={"symbol": "BBB", "dollars": 50, "quote_token": quote["quote_token"]},
+    )
+    assert buy_response.status_code == 200
+    market_data._fetch_prices.assert_not_called()
+    replayed_buy_response = client.post(
+        "/api/buy",
+        json={"symbol": "BBB", "dollars": 50, "quote_token": quote["quote_token"]},
+    )
+    assert replayed_buy_response.status_code == 400
+    get_user_response = client.get("/api/user")
+    assert get_user_response.status_code == 200
+    user = get_user_response.json()
+    assert user["portfolio"]["holdings"][0]["symbol"] == "BBB"
+    assert user["portfolio"]["holdings"][0]["units"] == 25.0
+    sell_response = client.post(
+        "/api/sell",
+        json={"symbol": "AAA", "dollars": 10, "quote_token": quote["quote_token"]},
+    )
+    assert sell_response.status_code == 400
+
+
+def test_orders_success(client, valid_email, valid_display_name, valid_password):
+    sign_up_response = client.post(
+        "/api/sign-up",
+        json={
+            "email": valid_email,
+            "display_name": valid_display_name,
+            "password": valid_password,
+        },
+    )
+    assert sign_up_response.status_code == 200
+    sign_in_response = client.post(
+        "/api/sign-in", json={"email": valid_email, "password": valid_password}
+    )
+    assert sign_in_response.status_code == 200
+    market_data._fetch_prices.reset_mock()
+    orders_response = client.post(
+        "/api/orders",
+        json={
+            "orders": [
+                {"type": "buy", "symbol": "AAA", "dollars": 50},
+                {"type": "buy", "symbol": "BBB", "dollars": 50},
+                {"type": "sell", "symbol": "AAA"},
+            ]
+        },
+    )
+    assert orders_response.status_code == 200
+    market_data._fetch_prices.assert_called_once()
+    get_user_response = client.get("/api/user")
+    assert get_user_response.status_code == 200
+    user = get_user_response.json()
+    assert user["portfolio"]["holdings"][0]["symbol"] == "AAA"
+    assert user["portfolio"]["holdings"][0]["units"] == 0
+    assert user["portfolio"]["holdings"][1]["symbol"] == "BBB"
+    assert user["portfolio"]["holdings"][1]["units"] == 25.0
+    assert user["portfolio"]["holdings"][2]["symbol"] == "USD"
+    assert user["portfolio"]["holdings"][2]["units"] == STARTING_BALANCE - 50
+    orders_response = client.post(
+        "/api/orders", json={"orders": [{"type": "buy", "symbol": "AAA"}]}
+    )
+    assert orders_response.status_code == 422
+    orders_response = client.post(
+        "/api/orders",
+        json={
+            "orders": [{"type": "invest", "investee_portfolio_id": 1000, "dollars": 10}]
+        },
+    )
+    assert orders_response.status_code == 404
+
+
+def test_rebalance_success(client, valid_email, valid_display_name, valid_password):
+    sign_up_response = client.post(
+        "/api/sign-up",
+        json={
+            "email": valid_email,
+            "display_name": valid_display_name,
+            "password": valid_password,
+        },
+    )
+    assert sign_up_response.status_code == 200
+    sign_in_response = client.post(
+        "/api/sign-in", json={"email": valid_email, "password": valid_password}
+    )
+    assert sign_in_response.status_code == 200
+    rebalance_response = client.post(
+        "/api/rebalance",
+        json={"weights": {"AAA": 0.25, "USD": 0.75}, "dry_run": True},
+    )
+    assert rebalance_response.status_code == 200
+    assert rebalance_response.json()["trades"] == [
+        {
+            "type": "buy",
+            "symbol": "AAA",
+            "investee_portfolio_id": None,
+            "dollars": STARTING_BALANCE / 4,
+        }
+    ]
+    rebalance_response = client.post(
+        "/api/rebalance", json={"weights": {"AAA": 0.25, "USD": 0.75}}
+    )
+    assert rebalance_response.status_code == 200
+    get_user_response = client.get("/api/user")
+    assert get_user_response.status_code == 200
+    user = get_user_response.json()
+    assert user["portfolio"]["holdings"][0]["symbol"] == "AAA"
+    assert user["portfolio"]["holdings"][0]["units"] == STARTING_BALANCE / 4
+
+
+def test_buy_idempotency_key(client, valid_email, valid_display_name, valid_password):
+    sign_up_response = client.post(
+        "/api/sign-up",
+        json={
+            "email": valid_email,
+            "display_name": valid_display_name,
+            "password": valid_password,
+        },
+    )
+    assert sign_up_response.status_code == 200
+    sign_in_response = client.post(
+        "/api/sign-in", json={"email": valid_email, "password": valid_password}
+    )
+    assert sign_in_response.status_code == 200
+    for _ in range(2):
+        buy_response = client.post(
+            "/api/buy",
+            json={"symbol": "AAA", "dollars": 50},
+            headers={"Idempotency-Key": "a"},
+        )
+        assert buy_response.status_code == 200
+    buy_response = client.post(
+        "/api/buy",
+        json={"symbol": "AAA", "dollars": 60},
+        headers={"Idempotency-Key": "a"},
+    )
+    assert buy_response.status_code == 422
+    for _ in range(2):
+        buy_response = client.post(
+            "/api/buy",
+            json={"symbol": "AAA", "dollars": 2 * STARTING_BALANCE},
+            headers={"Idempotency-Key": "b"},
+        )
+        assert buy_response.status_code == 400
+        assert buy_response.json()["error"]["status_code"] == 400
+    user = client.get("/api/user").json()
+    assert user["portfolio"]["holdings"][0]["symbol"] == "AAA"
+    assert user["portfolio"]["holdings"][0]["units"] == 50
+
+
+def test_order_queue(client, valid_email, valid_display_name, valid_password):
+    sign_up_response = client.post(
+        "/api/sign-up",
+        json={
+            "email": valid_email,
+            "display_name": valid_display_name,
+            "password": valid_password,
+        },
+    )
+    assert sign_up_response.status_code == 200
+    sign_in_response = client.post(
+        "/api/sign-in", json={"email": valid_email, "password": valid_password}
+    )
+    assert sign_in_response.status_code == 200
+    queue_response = client.post(
+        "/api/order-queue", json={"type": "buy", "symbol": "AAA", "dollars": 50}
+    )
+    assert queue_response.status_code == 200
+    order_id = queue_response.json()["order_id"]
+    status_response = client.get(f"/api/order-queue/{order_id}")
+    assert status_response.status_code == 200
+    assert status_response.json()["status"] == "queued"
+    assert client.get(f"/api/order-queue/{order_id + 1}").status_code == 404
+
+    async def execute_queued_orders():
+        async with AsyncSession() as db:
+            while await db.run_sync(execute_next_order) is not None:
+                pass
+
+    client.portal.call(execute_queued_orders)
+    with client.websocket_connect(f"/api/order-queue/{order_id}") as web_socket:
+        assert web_socket.receive_json() == {
+            "order_id": order_id,
+            "status": "executed",
+            "detail": None,
+        }
+    user = client.get("/api/user").json()
+    assert user["portfolio"]["holdings"][0]["symbol"] == "AAA"
+    assert user["portfolio"]["holdings"][0]["units"] == 50
+
+
 def test_sell_portfolio_holding_insufficient_holdings(
     client, valid_email, valid_display_name, valid_password
 ):
@@ -456,7 +674,9 @@ def test_get_leaderboard_success(
         },
     )
     assert leaderboard_response.status_code == 200
-    assert leaderboard_response.json() == {
+    leaderboard = leaderboard_response.json()
+    assert leaderboard.pop("as_of") is not None
+    assert leaderboard == {
         "rows": [
             {
                 "user_id": 1,
@@ -477,6 +697,53 @@ def test_get_portfolio_holdings_success():
     pass
 
 
+def test_get_portfolio_holdings_look_through(
+    client, valid_email, valid_display_name, valid_password
+):
+    sign_up_response = client.post(
+        "/api/sign-up",
+        json={
+            "email": valid_email,
+            "display_name": valid_display_name,
+            "password": valid_password,
+        },
+    )
+    assert sign_up_response.status_code == 200
+    sign_in_response = client.post(
+        "/api/sign-in", json={"email": valid_email, "password": valid_password}
+    )
+    assert sign_in_response.status_code == 200
+    buy_response = client.post("/api/buy", json={"symbol": "BBB", "dollars": 50})
+    assert buy_response.status_code == 200
+    holdings_response = client.post(
+        "/api/portfolio-holdings",
+        json={
+            "portfolio_id": 1,
+            "columns": ["units", "value"],
+            "sort_by": "value",
+            "look_through": True,
+        },
+    )
+    assert holdings_response.status_code == 200
+    assert holdings_response.json()["rows"] == [
+        {
+            "symbol": "USD",
+            "columns": {"units": STARTING_BALANCE - 50, "value": STARTING_BALANCE - 50},
+        },
+        {"symbol": "BBB", "columns": {"units": 25, "value": 50}},
+    ]
+    holdings_response = client.post(
+        "/api/portfolio-holdings",
+        json={
+            "portfolio_id": 1,
+            "columns": ["units", "lifetime_return"],
+            "sort_by": "units",
+            "look_through": True,
+        },
+    )
+    assert holdings_response.status_code == 422
+
+
 # TODO
 def test_get_portfolio_investors_success():
     pass
@@ -485,3 +752,96 @@ def test_get_portfolio_investors_success():
 # TODO
 def test_get_user_investments_success():
     pass
+
+
+def test_get_status_success(client):
+    status_response = client.get("/api/status")
+    assert status_response.status_code == 200
+    assert status_response.json()["circuit_breaker"]["state"] == "closed"
+    assert status_response.json()["quote_cache"]["size"] == 0
+    assert status_response.json()["transactions"]["retries"] == 0
+    assert "hits" in status_response.json()["exposure"]
+    assert status_response.json()["investment_graph"]["edges"] == 0
+
+
+@pytest.fixture
+def symbol_index(tmp_path):
+    path = tmp_path / "symbols.tsv"
+    path.write_text("AAA\tAaa Inc\nAAB\tAab Corp\nBBB\tBbb Ltd\n")
+    set_symbol_index(SymbolIndex(str(path)))
+    yield
+    set_symbol_index(None)
+
+
+def test_buy_invalid_symbol(
+    client, symbol_index, valid_email, valid_display_name, valid_password
+):
+    sign_up_response = client.post(
+        "/api/sign-up",
+        json={
+            "email": valid_email,
+            "display_name": valid_display_name,
+            "password": valid_password,
+        },
+    )
+    assert sign_up_response.status_code == 200
+    sign_in_response = client.post(
+        "/api/sign-in", json={"email": valid_email, "password": valid_password}
+    )
+    assert sign_in_response.status_code == 200
+    buy_response = client.post("/api/buy", json={"symbol": "CCC", "dollars": 50})
+    assert buy_response.status_code == 422
+    assert buy_response.json()["error"]["detail"] == "Invalid symbol: CCC."
+
+
+def test_rebalance_dollars_outside_universe(
+    client, symbol_index, valid_email, valid_display_name, valid_password
+):
+    sign_up_response = client.post(
+        "/api/sign-up",
+        json={
+            "email": valid_email,
+            "display_name": valid_display_name,
+            "password": valid_password,
+        },
+    )
+    assert sign_up_response.status_code == 200
+    sign_in_response = client.post(
+        "/api/sign-in", json={"email": valid_email, "password": valid_password}
+    )
+    assert sign_in_response.status_code == 200
+    rebalance_response = client.post(
+        "/api/rebalance",
+        json={"weights": {"AAA": 0.25, "USD": 0.75}, "dry_run": True},
+    )
+    assert rebalance_response.status_code == 200
+    rebalance_response = client.post(
+        "/api/rebalance", json={"weights": {"CCC": 1}, "dry_run": True}
+    )
+    assert rebalance_response.status_code == 422
+    assert rebalance_response.json()["error"]["detail"] == "Invalid symbol: CCC."
+
+
+def test_get_symbols_success(client, symbol_index):
+    symbols_response = client.get("/api/symbols", params={"prefix": "aa"})
+    assert symbols_response.status_code == 200
+    assert symbols_response.json() == {
+        "rows": [
+            {"symbol": "AAA", "name": "Aaa Inc"},
+            {"symbol": "AAB", "name": "Aab Corp"},
+        ]
+    }
+
+
+def test_quotes_websocket(client, symbol_index, monkeypatch):
+    monkeypatch.setattr(
+        quote_hub.quote_hub,
+        "_get_quotes_fn",
+        lambda symbols: {symbol: (1, now()) for symbol in symbols},
+    )
+    with client.websocket_connect("/api/quotes") as web_socket:
+        web_socket.send_json({"subscribe": ["AAA", "CCC"]})
+        assert web_socket.receive_json() == {"invalid_symbols": ["CCC"]}
+        quote = web_socket.receive_json()
+        assert quote["symbol"] == "AAA"
+        assert quote["price"] == 1
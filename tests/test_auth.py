@@ -1,11 +1,15 @@
 import pytest
 from sherwood.auth import (
     _decode_access_token,
+    consume_quote_token,
+    decode_quote_token,
     generate_access_token,
+    generate_quote_token,
     validate_password,
     ReasonPasswordInvalid,
     _JWT_ISSUER,
 )
+from sherwood.errors import InvalidAccessTokenError, InvalidQuoteTokenError
 from sherwood.models import create_user
 
 
@@ -19,6 +23,32 @@ def test_encode_and_decode_jwt_for_user(
     assert payload["sub"] == str(user.id)
 
 
+def test_quote_token_is_bound_to_user_and_symbol(
+    db, valid_emails, valid_display_names, valid_password
+):
+    user, other_user = [
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password)
+        for i in range(2)
+    ]
+    quote_token, _ = generate_quote_token(user, "AAA", 1.5)
+    assert decode_quote_token(quote_token, user, "AAA") == 1.5
+    with pytest.raises(InvalidQuoteTokenError):
+        decode_quote_token(quote_token, user, "BBB")
+    with pytest.raises(InvalidQuoteTokenError):
+        decode_quote_token(quote_token, other_user, "AAA")
+    with pytest.raises(InvalidAccessTokenError):
+        _decode_access_token(quote_token)
+    with pytest.raises(InvalidQuoteTokenError):
+        decode_quote_token(generate_access_token(user), user, "AAA")
+
+
+def test_quote_token_expires(db, valid_email, valid_display_name, valid_password):
+    user = create_user(db, valid_email, valid_display_name, valid_password)
+    quote_token, _ = generate_quote_token(user, "AAA", 1.5, seconds=-1)
+    with pytest.raises(InvalidQuoteTokenError):
+        decode_quote_token(quote_token, user, "AAA")
+
+
 @pytest.mark.parametrize(
     ("password", "expected_reasons"),
     [
@@ -67,3 +97,13 @@ def test_encode_and_decode_jwt_for_user(
 def test_validate_password(password, expected_reasons):
     reasons = validate_password(password)
     assert reasons == expected_reasons
+
+
+def test_quote_token_is_single_use(db, valid_email, valid_display_name, valid_password):
+    user = create_user(db, valid_email, valid_display_name, valid_password)
+    quote_token, _ = generate_quote_token(user, "AAA", 1.5)
+    assert consume_quote_token(db, quote_token, user, "AAA") == 1.5
+    with pytest.raises(InvalidQuoteTokenError):
+        consume_quote_token(db, quote_token, user, "AAA")
+    other_quote_token, _ = generate_quote_token(user, "AAA", 1.5)
+    assert consume_quote_token(db, other_quote_token, user, "AAA") == 1.5
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+import math
+import numpy as np
+from sherwood.bars import BarStore
+
+T0 = datetime(2025, 1, 28, 14, tzinfo=timezone.utc)
+HOUR = 3600
+
+
+def _fetch_bars(calls):
+    def fetch_bars(symbols, start, end):
+        calls.append((sorted(symbols), start, end))
+        timestamps = np.arange(
+            int(start.timestamp()) // HOUR * HOUR, int(end.timestamp()), HOUR
+        )
+        timestamps = timestamps[timestamps >= int(start.timestamp())]
+        return {
+            symbol: (timestamps, timestamps / HOUR, timestamps / HOUR + 0.5)
+            for symbol in symbols
+            if symbol != "CCC"
+        }
+
+    return fetch_bars
+
+
+def test_bar_store_fetches_missing_ranges_in_bulk(tmp_path):
+    calls = []
+    store = BarStore(str(tmp_path), _fetch_bars(calls))
+    store.ensure(
+        {
+            "AAA": (T0, T0 + timedelta(hours=4)),
+            "BBB": (T0, T0 + timedelta(hours=4)),
+        }
+    )
+    assert calls == [(["AAA", "BBB"], T0, T0 + timedelta(hours=4))]
+
+    store.ensure(
+        {
+            "AAA": (T0 + timedelta(hours=2), T0 + timedelta(hours=6)),
+            "BBB": (T0, T0 + timedelta(hours=4)),
+            "CCC": (T0, T0 + timedelta(hours=4)),
+        }
+    )
+    assert calls[1:] == [
+        (["CCC"], T0, T0 + timedelta(hours=4)),
+        (["AAA"], T0 + timedelta(hours=4), T0 + timedelta(hours=6)),
+    ]
+    assert len(store.bars("AAA")["timestamp"]) == 6
+
+    # ranges without bars aren't fetched again
+    store.ensure({"CCC": (T0, T0 + timedelta(hours=4))})
+    assert len(calls) == 3
+
+
+def test_bar_store_price_at_or_before(tmp_path):
+    store = BarStore(str(tmp_path), _fetch_bars([]))
+    store.ensure({"AAA": (T0, T0 + timedelta(hours=4))})
+    t0 = int(T0.timestamp())
+    prices = store.prices_at("AAA", [t0 - 1, t0, t0 + HOUR + 1, t0 + 10 * HOUR])
+    assert math.isnan(prices[0])
+    assert list(prices[1:]) == [t0 / HOUR, t0 / HOUR + 1, t0 / HOUR + 3]
+    assert store.price_at("AAA", T0 + timedelta(minutes=30), "close") == (
+        t0 / HOUR + 0.5
+    )
+    # reopened from disk
+    bars = BarStore(str(tmp_path), _fetch_bars([])).bars("AAA")
+    assert {field: len(column) for field, column in bars.items()} == {
+        "timestamp": 4,
+        "open": 4,
+        "close": 4,
+    }
+    assert isinstance(bars["open"], np.memmap)
@@ -1,12 +1,22 @@
-from pytest import approx
+import pytest
+from pytest import approx, raises
+from sherwood import broker
 from sherwood.broker import (
     buy_portfolio_holding,
     sell_portfolio_holding,
     invest_in_portfolio,
     divest_from_portfolio,
+    execute_orders,
+    rebalance_portfolio,
+    sell_all_portfolio_holdings,
+    Order,
 )
+from sherwood.migrations import migrate_portfolios_to_shares
+from sqlalchemy import event
+from sherwood.errors import InsufficientCashError, RequestValueError
 from sherwood.models import (
     create_user,
+    ownership_percent,
     Holding,
     Ownership,
     Portfolio,
@@ -14,6 +24,7 @@ from sherwood.models import (
     TransactionType,
     User,
 )
+import time
 
 
 def test_buy_portfolio_holding(db, valid_email, valid_display_name, valid_password):
@@ -199,6 +210,31 @@ def test_invest_in_portfolio_success(
     assert users == expected
 
 
+def test_invest_reprices_holdings_bought_while_pricing(
+    db, valid_emails, valid_display_names, valid_password, mocker
+):
+    users = [
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+        for i in range(2)
+    ]
+    buy_portfolio_holding(db, users[0].portfolio.id, "AAA", 90)
+    get_prices = broker.get_prices
+
+    def get_prices_racing_a_buy(db, symbols, **kwargs):
+        price_by_symbol = get_prices(db, symbols, **kwargs)
+        if get_prices_spy.call_count == 1:
+            buy_portfolio_holding(db, users[0].portfolio.id, "BBB", 10)
+        return price_by_symbol
+
+    get_prices_spy = mocker.patch.object(
+        broker, "get_prices", side_effect=get_prices_racing_a_buy
+    )
+    invest_in_portfolio(db, users[0].portfolio.id, users[1].portfolio.id, 10)
+    assert get_prices_spy.call_count == 2
+    assert get_prices_spy.call_args.args[1] == ["AAA", "BBB", "USD"]
+    assert db.get(Ownership, (1, 2)).percent == approx(10 / 1010)
+
+
 def test_divest_from_portfolio(db, valid_emails, valid_display_names, valid_password):
     expected = [
         User(email="user0@web.com", display_name="user0", password=valid_password),
@@ -256,3 +292,230 @@ def test_divest_from_portfolio(db, valid_emails, valid_display_names, valid_pass
             assert user_ownership.owner_id == expected_ownership.owner_id
             assert user_ownership.cost == approx(expected_ownership.cost)
             assert user_ownership.percent == approx(expected_ownership.percent)
+
+
+def test_execute_orders(db, valid_emails, valid_display_names, valid_password):
+    users = [
+        create_user(
+            db,
+            valid_emails[i],
+            valid_display_names[i],
+            valid_password,
+            starting_balance=1000,
+        )
+        for i in [0, 1]
+    ]
+    execute_orders(
+        db,
+        users[0].portfolio.id,
+        [
+            Order(TransactionType.BUY, dollars=100, symbol="AAA"),
+            Order(TransactionType.BUY, dollars=200, symbol="BBB"),
+            Order(TransactionType.SELL, dollars=50, symbol="AAA"),
+        ],
+    )
+    execute_orders(
+        db,
+        users[1].portfolio.id,
+        [
+            Order(TransactionType.INVEST, dollars=400, investee_portfolio_id=1),
+            Order(TransactionType.DIVEST, dollars=100, investee_portfolio_id=1),
+        ],
+    )
+
+    holdings = {h.symbol: h for h in db.get(Portfolio, 1).holdings}
+    assert holdings["AAA"].units == approx(50 * 1.3)
+    assert holdings["BBB"].units == approx(100 * 1.3)
+    assert holdings["USD"].units == approx(750 * 1.3)
+    ownership = {o.owner_id: o for o in db.get(Portfolio, 1).ownership}
+    assert ownership[2].percent == approx(300 / 1300)
+    assert db.get(Portfolio, 2).holdings[0].units == approx(700)
+    assert [txn.type for txn in db.get(Portfolio, 1).history] == [
+        TransactionType.BUY,
+        TransactionType.BUY,
+        TransactionType.SELL,
+    ]
+
+
+def test_execute_orders_is_all_or_nothing(
+    db, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    with raises(InsufficientCashError):
+        execute_orders(
+            db,
+            user.portfolio.id,
+            [
+                Order(TransactionType.BUY, dollars=600, symbol="AAA"),
+                Order(TransactionType.BUY, dollars=600, symbol="BBB"),
+            ],
+        )
+    portfolio = db.get(Portfolio, user.portfolio.id)
+    assert [(h.symbol, h.units) for h in portfolio.holdings] == [("USD", 1000)]
+    assert portfolio.history == []
+
+
+def test_sell_all_portfolio_holdings(
+    db, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    buy_portfolio_holding(db, user.portfolio.id, "AAA", 100)
+    buy_portfolio_holding(db, user.portfolio.id, "BBB", 300)
+    sell_all_portfolio_holdings(db, user.portfolio.id)
+
+    holdings = {h.symbol: h for h in db.get(Portfolio, user.portfolio.id).holdings}
+    assert holdings["AAA"].units == 0
+    assert holdings["BBB"].units == 0
+    assert holdings["USD"].units == approx(1000)
+
+
+def test_rebalance_portfolio(db, valid_email, valid_display_name, valid_password):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    buy_portfolio_holding(db, user.portfolio.id, "AAA", 500)
+    weights = {"BBB": 0.6, "USD": 0.4}
+
+    planned = rebalance_portfolio(db, user.portfolio.id, weights, dry_run=True)
+    assert planned == [
+        Order(TransactionType.SELL, dollars=None, symbol="AAA"),
+        Order(TransactionType.BUY, dollars=600, symbol="BBB"),
+    ]
+    holdings = {h.symbol: h.units for h in db.get(Portfolio, 1).holdings}
+    assert holdings == {"AAA": 500, "USD": 500}
+
+    assert rebalance_portfolio(db, user.portfolio.id, weights) == planned
+    holdings = {h.symbol: h.units for h in db.get(Portfolio, 1).holdings}
+    assert holdings == approx({"AAA": 0, "BBB": 300, "USD": 400})
+    assert rebalance_portfolio(db, user.portfolio.id, weights, dry_run=True) == []
+
+
+def test_rebalance_portfolio_invalid_weights(
+    db, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    with raises(RequestValueError):
+        rebalance_portfolio(db, user.portfolio.id, {"AAA": 0.5})
+    with raises(RequestValueError):
+        rebalance_portfolio(db, user.portfolio.id, {"AAA": 1.5, "USD": -0.5})
+
+
+_PRICE_BY_SYMBOL = {"AAA": 1, "BBB": 2, "USD": 1}
+
+
+def _ownership_values(db):
+    """(value, cost) by (portfolio id, owner id)."""
+    values = {}
+    for portfolio in db.query(Portfolio):
+        portfolio_value = sum(
+            holding.units * _PRICE_BY_SYMBOL[holding.symbol]
+            for holding in portfolio.holdings
+        )
+        for ownership in portfolio.ownership:
+            values[(portfolio.id, ownership.owner_id)] = (
+                portfolio_value * ownership_percent(ownership),
+                ownership.cost,
+            )
+    return values
+
+
+def _run_fund_scenario(db, emails, display_names, password, shares):
+    users = [
+        create_user(db, emails[i], display_names[i], password, 1000) for i in range(4)
+    ]
+    ids = [user.portfolio.id for user in users]
+    if shares:
+        migrate_portfolios_to_shares(db)
+    buy_portfolio_holding(db, ids[0], "AAA", 300)
+    buy_portfolio_holding(db, ids[0], "BBB", 200)
+    buy_portfolio_holding(db, ids[1], "BBB", 100)
+    invest_in_portfolio(db, ids[0], ids[1], 400)
+    invest_in_portfolio(db, ids[0], ids[2], 200)
+    invest_in_portfolio(db, ids[1], ids[3], 300)
+    sell_portfolio_holding(db, ids[0], "AAA", 100)
+    divest_from_portfolio(db, ids[0], ids[1], 150)
+    with raises(RequestValueError, match="cycle"):
+        invest_in_portfolio(db, ids[2], ids[0], 100)
+    invest_in_portfolio(db, ids[2], ids[3], 100)
+    divest_from_portfolio(db, ids[0], ids[2], 200)
+    divest_from_portfolio(db, ids[1], ids[3], 250)
+    buy_portfolio_holding(db, ids[0], "BBB", 50)
+    divest_from_portfolio(db, ids[0], ids[1], 250)
+    return _ownership_values(db)
+
+
+def test_share_accounting_is_equivalent(
+    db, valid_emails, valid_display_names, valid_password
+):
+    expected = _run_fund_scenario(
+        db, valid_emails, valid_display_names, valid_password, shares=False
+    )
+    bind = db.get_bind()
+    db.close()
+    Portfolio.metadata.drop_all(bind)
+    Portfolio.metadata.create_all(bind)
+
+    actual = _run_fund_scenario(
+        db, valid_emails, valid_display_names, valid_password, shares=True
+    )
+    assert actual.keys() == expected.keys()
+    for key, (value, cost) in expected.items():
+        assert actual[key] == (approx(value), approx(cost))
+
+
+@pytest.mark.parametrize("investors", [1, 6])
+def test_share_invest_writes_constant_rows(
+    db, valid_emails, valid_display_names, valid_password, investors
+):
+    users = [
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+        for i in range(investors + 2)
+    ]
+    migrate_portfolios_to_shares(db)
+    buy_portfolio_holding(db, users[0].portfolio.id, "AAA", 500)
+    for user in users[1:-1]:
+        invest_in_portfolio(db, users[0].portfolio.id, user.portfolio.id, 100)
+
+    updated_tables = []
+
+    def count_updates(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE"):
+            rows = len(parameters) if executemany else 1
+            updated_tables.extend([statement.split()[1]] * rows)
+
+    bind = db.get_bind()
+    event.listen(bind, "before_cursor_execute", count_updates)
+    try:
+        invest_in_portfolio(db, users[0].portfolio.id, users[-1].portfolio.id, 100)
+    finally:
+        event.remove(bind, "before_cursor_execute", count_updates)
+
+    # both portfolios, both cash holdings and the investor's self-ownership,
+    # however many investors the investee has
+    assert sorted(updated_tables) == [
+        "holdings",
+        "holdings",
+        "ownership",
+        "portfolios",
+        "portfolios",
+    ]
+
+
+def test_lock_wait_times_only_the_locking_statement(
+    db, valid_email, valid_display_name, valid_password, mocker
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    record_lock_wait = mocker.patch.object(broker.retry_transaction, "record_lock_wait")
+
+    def slow_eager_loads(conn, cursor, statement, parameters, context, executemany):
+        if "FROM holdings" in statement or "FROM ownership" in statement:
+            time.sleep(0.05)
+
+    bind = db.get_bind()
+    event.listen(bind, "before_cursor_execute", slow_eager_loads)
+    try:
+        assert broker._lock_portfolios(db, [user.portfolio.id]) == {
+            user.portfolio.id: user.portfolio
+        }
+    finally:
+        event.remove(bind, "before_cursor_execute", slow_eager_loads)
+    [(seconds,)] = [call.args for call in record_lock_wait.call_args_list]
+    assert seconds < 0.05
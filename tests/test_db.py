@@ -0,0 +1,128 @@
+import asyncio
+import pytest
+import time
+from sherwood.db import (
+    get_thread_bind,
+    is_retryable_error,
+    maybe_commit,
+    run_blocking,
+    run_sync,
+    sleep,
+    AsyncSession,
+    RetryTransaction,
+    Session,
+)
+from sherwood.errors import InternalServerError
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from unittest import mock
+
+
+class _PgError(Exception):
+    def __init__(self, pgcode):
+        self.pgcode = pgcode
+
+
+def _db_error(pgcode):
+    return OperationalError("SELECT 1", {}, _PgError(pgcode))
+
+
+def _transaction(side_effect):
+    f = mock.Mock(side_effect=side_effect)
+    f.__name__ = "transaction"
+    return f
+
+
+def test_is_retryable_error():
+    assert is_retryable_error(_db_error("40P01"))
+    assert is_retryable_error(_db_error("40001"))
+    assert not is_retryable_error(_db_error("23505"))
+    assert not is_retryable_error(ValueError())
+
+    db = mock.Mock()
+    db.commit.side_effect = _db_error("40P01")
+    with pytest.raises(InternalServerError) as exc_info:
+        maybe_commit(db, "Failed.")
+    assert is_retryable_error(exc_info.value)
+
+
+def test_retry_transaction():
+    sleep = mock.Mock()
+    retry = RetryTransaction(max_attempts=3, sleep=sleep)
+    db = mock.Mock()
+    f = _transaction([_db_error("40P01"), _db_error("40001"), "done"])
+
+    assert retry(f)(db, 1, x=2) == "done"
+    f.assert_called_with(db, 1, x=2)
+    assert db.rollback.call_count == 2
+    assert sleep.call_count == 2
+    assert retry.stats()["retries"] == 2
+
+    f = _transaction(_db_error("40P01"))
+    with pytest.raises(OperationalError):
+        retry(f)(db)
+    assert f.call_count == 3
+    assert retry.stats()["exhausted"] == 1
+
+    f = _transaction(_db_error("23505"))
+    with pytest.raises(OperationalError):
+        retry(f)(db)
+    assert f.call_count == 1
+
+
+def test_retry_transaction_lock_waits():
+    retry = RetryTransaction()
+    retry.record_lock_wait(0)
+    retry.record_lock_wait(0.5)
+    assert retry.stats()["lock_waits"] == 1
+    assert retry.stats()["lock_wait_seconds"] == 0.5
+
+
+def test_run_sync():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+
+    @run_sync
+    def route(x, db):
+        assert get_thread_bind(db) is Session.kw["bind"]
+        return db.execute(text("SELECT :x"), {"x": x}).scalar()
+
+    async def request():
+        async with AsyncSession(bind=engine) as db:
+            return await route(1, db=db)
+
+    assert asyncio.run(request()) == 1
+    asyncio.run(engine.dispose())
+
+
+def test_run_sync_blocking_calls_yield_the_event_loop():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+
+    @run_sync
+    def route(db):
+        sleep(0.05)
+        run_blocking(time.sleep, 0.05)
+        return db.execute(text("SELECT 1")).scalar()
+
+    async def request():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        async with AsyncSession(bind=engine) as db:
+            result = await route(db=db)
+        ticker.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(request())
+    assert result == 1
+    assert ticks >= 5
+    asyncio.run(engine.dispose())
+    # outside run_sync they're plain blocking calls
+    assert run_blocking(lambda x: x + 1, 1) == 2
+    sleep(0)
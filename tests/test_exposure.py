@@ -0,0 +1,73 @@
+from pytest import approx, raises
+from sherwood.broker import buy_portfolio_holding, invest_in_portfolio
+from sherwood.errors import RequestValueError
+from sherwood.exposure import compute_units_by_symbol_by_owner, LookThroughExposure
+from sherwood.migrations import migrate_portfolios_to_shares
+from sherwood.models import create_user, ownership_percent, Portfolio
+
+
+def _invest_in_a_cycle(db, valid_emails, valid_display_names, valid_password):
+    users = [
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+        for i in range(3)
+    ]
+    buy_portfolio_holding(db, 1, "AAA", 500)
+    invest_in_portfolio(db, 1, 2, 200)
+    with raises(RequestValueError, match="cycle"):
+        invest_in_portfolio(db, 2, 1, 100)
+    invest_in_portfolio(db, 2, 3, 100)
+    invest_in_portfolio(db, 1, 3, 300)
+    buy_portfolio_holding(db, 2, "BBB", 100)
+    return users
+
+
+def _expected_units_by_symbol_by_owner(db):
+    expected = {}
+    for portfolio in db.query(Portfolio):
+        for ownership in portfolio.ownership:
+            units_by_symbol = expected.setdefault(ownership.owner_id, {})
+            for holding in portfolio.holdings:
+                units_by_symbol[holding.symbol] = units_by_symbol.get(
+                    holding.symbol, 0
+                ) + holding.units * ownership_percent(ownership)
+    return expected
+
+
+def test_compute_units_by_symbol_by_owner(
+    db, valid_emails, valid_display_names, valid_password
+):
+    _invest_in_a_cycle(db, valid_emails, valid_display_names, valid_password)
+    expected = _expected_units_by_symbol_by_owner(db)
+    actual = compute_units_by_symbol_by_owner(db)
+    assert actual.keys() == expected.keys()
+    for owner_id, units_by_symbol in expected.items():
+        assert actual[owner_id] == approx(units_by_symbol)
+    # every unit held is owned by someone
+    for symbol in ["AAA", "BBB", "USD"]:
+        held = sum(
+            h.units
+            for p in db.query(Portfolio)
+            for h in p.holdings
+            if h.symbol == symbol
+        )
+        assert sum(u.get(symbol, 0) for u in actual.values()) == approx(held)
+
+    migrate_portfolios_to_shares(db)
+    shares = compute_units_by_symbol_by_owner(db)
+    for owner_id, units_by_symbol in actual.items():
+        assert shares[owner_id] == approx(units_by_symbol)
+
+
+def test_look_through_exposure_cache(
+    db, valid_emails, valid_display_names, valid_password
+):
+    _invest_in_a_cycle(db, valid_emails, valid_display_names, valid_password)
+    exposure = LookThroughExposure(lifetime_seconds=60)
+    units_by_symbol = exposure.units_by_symbol(db, 3)
+    assert units_by_symbol == approx(compute_units_by_symbol_by_owner(db)[3])
+    assert exposure.units_by_symbol(db, 3) == units_by_symbol
+    assert exposure.stats() == {"owners": 3, "hits": 1, "misses": 1}
+
+    buy_portfolio_holding(db, 1, "BBB", 100)
+    assert exposure.units_by_symbol(db, 3)["BBB"] > 0
+    assert exposure.stats()["misses"] == 2
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from sherwood.freshness import (
+    freshness_policy,
+    market_calendar,
+    FreshnessPolicy,
+    FRESHNESS_POLICIES,
+)
+
+# Friday 2025-01-31, 16:00 New York time
+FRIDAY_CLOSE = datetime(2025, 1, 31, 21, tzinfo=timezone.utc)
+
+
+def test_market_calendar_sessions():
+    assert market_calendar.is_open(FRIDAY_CLOSE - timedelta(minutes=1))
+    assert not market_calendar.is_open(FRIDAY_CLOSE)
+    saturday = FRIDAY_CLOSE + timedelta(days=1)
+    assert not market_calendar.is_open(saturday)
+    assert market_calendar.last_close(saturday) == FRIDAY_CLOSE
+    # Good Friday and the early close the day after Thanksgiving
+    assert market_calendar.session(datetime(2025, 4, 18).date()) is None
+    _, close = market_calendar.session(datetime(2025, 11, 28).date())
+    assert close == datetime(2025, 11, 28, 18, tzinfo=timezone.utc)
+
+
+def test_quotes_after_close_stay_fresh_until_open():
+    policy = FRESHNESS_POLICIES["display"]
+    monday_open = FRIDAY_CLOSE + timedelta(days=2, hours=17, minutes=30)
+    after_close = FRIDAY_CLOSE + timedelta(minutes=1)
+    before_close = FRIDAY_CLOSE - timedelta(minutes=10)
+    sunday = FRIDAY_CLOSE + timedelta(days=2)
+    assert not policy.has_expired(after_close, at=sunday)
+    assert policy.has_expired(before_close, at=sunday)
+    assert policy.has_expired(after_close, at=monday_open + timedelta(minutes=10))
+    # raw delays ignore the calendar
+    assert FreshnessPolicy(300).has_expired(after_close, at=sunday)
+
+
+def test_freshness_policy_resolution():
+    assert freshness_policy("trade") == FreshnessPolicy(0)
+    assert freshness_policy(60) == FreshnessPolicy(60)
+    with pytest.raises(ValueError):
+        freshness_policy("realtime")
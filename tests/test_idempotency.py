@@ -0,0 +1,108 @@
+from datetime import timedelta
+import pytest
+from sherwood.broker import buy_portfolio_holding
+from sherwood.errors import (
+    IdempotencyKeyInProgressError,
+    InsufficientCashError,
+    MarketDataProviderError,
+    RequestValueError,
+)
+from sherwood.idempotency import purge_expired_idempotency_records, Idempotent
+from sherwood.messages import BuyRequest, BuyResponse
+from sherwood.models import create_user, now, IdempotencyRecord, Portfolio
+
+
+@pytest.fixture
+def buy(mocker):
+    calls = mocker.Mock()
+
+    @Idempotent(lifetime_seconds=60)
+    def buy(request, db, user, idempotency_key=None) -> BuyResponse:
+        calls()
+        buy_portfolio_holding(db, user.portfolio.id, request.symbol, request.dollars)
+        return BuyResponse()
+
+    buy.calls = calls
+    return buy
+
+
+def test_idempotent_replays_stored_outcome(
+    db, buy, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 100)
+    request = BuyRequest(symbol="AAA", dollars=10)
+    assert buy(request=request, db=db, user=user, idempotency_key="a") == BuyResponse()
+    assert buy(request=request, db=db, user=user, idempotency_key="a") == BuyResponse()
+    assert buy.calls.call_count == 1
+    holdings = {h.symbol: h.units for h in db.get(Portfolio, user.id).holdings}
+    assert holdings == {"AAA": 10, "USD": 90}
+
+    with pytest.raises(RequestValueError):
+        buy(
+            request=BuyRequest(symbol="AAA", dollars=20),
+            db=db,
+            user=user,
+            idempotency_key="a",
+        )
+
+    request = BuyRequest(symbol="AAA", dollars=1000)
+    with pytest.raises(InsufficientCashError):
+        buy(request=request, db=db, user=user, idempotency_key="b")
+    response = buy(request=request, db=db, user=user, idempotency_key="b")
+    assert response.status_code == 400
+    assert buy.calls.call_count == 2
+
+    buy(request=BuyRequest(symbol="AAA", dollars=10), db=db, user=user)
+    buy(request=BuyRequest(symbol="AAA", dollars=10), db=db, user=user)
+    assert buy.calls.call_count == 4
+
+
+def test_idempotent_releases_key_on_provider_error(
+    db, buy, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 100)
+    request = BuyRequest(symbol="ZZZZ", dollars=10)
+    for _ in range(2):
+        with pytest.raises(MarketDataProviderError):
+            buy(request=request, db=db, user=user, idempotency_key="a")
+    assert buy.calls.call_count == 2
+    assert db.get(IdempotencyRecord, (user.id, "a")) is None
+
+
+def test_idempotent_rejects_in_progress_key(
+    db, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 100)
+
+    @Idempotent()
+    def retry_while_running(request, db, user, idempotency_key=None):
+        assert db.get(IdempotencyRecord, (user.id, idempotency_key)).status_code is None
+        return retry_while_running(
+            request=request, db=db, user=user, idempotency_key=idempotency_key
+        )
+
+    with pytest.raises(IdempotencyKeyInProgressError):
+        retry_while_running(
+            request=BuyRequest(symbol="AAA", dollars=10),
+            db=db,
+            user=user,
+            idempotency_key="a",
+        )
+
+
+def test_idempotent_expires_keys(
+    db, buy, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 100)
+    request = BuyRequest(symbol="AAA", dollars=10)
+    buy(request=request, db=db, user=user, idempotency_key="a")
+    record = db.get(IdempotencyRecord, (user.id, "a"))
+    record.created = now() - timedelta(seconds=61)
+    db.commit()
+    buy(request=request, db=db, user=user, idempotency_key="a")
+    assert buy.calls.call_count == 2
+
+    db.get(IdempotencyRecord, (user.id, "a")).created = now() - timedelta(seconds=61)
+    db.commit()
+    assert purge_expired_idempotency_records(db, lifetime_seconds=60) == 1
+    assert db.get(IdempotencyRecord, (user.id, "a")) is None
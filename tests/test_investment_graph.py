@@ -0,0 +1,86 @@
+import graphlib
+from pytest import raises
+from sherwood.broker import divest_from_portfolio, invest_in_portfolio
+from sherwood.errors import RequestValueError
+from sherwood.investment_graph import investment_graph, InvestmentGraph
+from sherwood.models import create_user, ownership_percent, Ownership
+
+
+def test_investment_graph_tracks_commits(
+    db, valid_emails, valid_display_names, valid_password
+):
+    for i in range(4):
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+    investment_graph.load(db)
+    invest_in_portfolio(db, 1, 2, 100)
+    invest_in_portfolio(db, 2, 3, 100)
+    invest_in_portfolio(db, 1, 4, 100)
+    assert investment_graph.stats()["loads"] == 1
+    assert investment_graph.investees(db, 3) == {1, 2}
+    assert investment_graph.investors(db, 1) == {2, 3, 4}
+    assert investment_graph.investors(db, 2) == {3}
+    order = investment_graph.topological_order(db)
+    assert order.index(1) < order.index(2) < order.index(3)
+
+    with raises(RequestValueError):
+        invest_in_portfolio(db, 3, 1, 100)
+    assert investment_graph.would_create_cycle(db, 1, 3)
+    assert not investment_graph.would_create_cycle(db, 4, 3)
+
+    stake = db.get(Ownership, (2, 3))
+    value = ownership_percent(stake) * sum(h.units for h in stake.portfolio.holdings)
+    divest_from_portfolio(db, 2, 3, value)
+    assert investment_graph.investors(db, 1) == {2, 4}
+    invest_in_portfolio(db, 3, 1, 100)
+    assert investment_graph.investees(db, 1) == {3}
+
+
+def test_investment_graph_reloads_changes_from_other_processes(
+    db, valid_emails, valid_display_names, valid_password
+):
+    for i in range(2):
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+    graph = InvestmentGraph(refresh_interval_seconds=0)
+    assert graph.investors(db, 1) == set()
+    # written without the hooks, as by another process
+    db.add(Ownership(1, 2, 10, 0.01))
+    db.commit()
+    graph.update({})
+    assert graph.investors(db, 1) == {2}
+    assert graph.stats() == {"edges": 1, "loads": 2, "updates": 1}
+
+    db.add(Ownership(2, 1, 10, 0.01))
+    db.commit()
+    with raises(graphlib.CycleError):
+        graph.topological_order(db)
+
+
+def test_investment_graph_discards_rolled_back_changes(
+    db, valid_emails, valid_display_names, valid_password
+):
+    for i in range(2):
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+    investment_graph.load(db)
+    db.add(Ownership(1, 2, 10, 0.01))
+    db.flush()
+    db.rollback()
+    db.commit()
+    assert investment_graph.investors(db, 1) == set()
+    assert investment_graph.stats()["loads"] == 2
+
+
+def test_cycle_check_sees_commits_the_index_has_not(
+    db, valid_emails, valid_display_names, valid_password
+):
+    for i in range(3):
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+    graph = InvestmentGraph(refresh_interval_seconds=3600)
+    graph.load(db)
+    # written without the hooks, as by another process
+    db.add(Ownership(1, 2, 10, 0.01))
+    db.add(Ownership(2, 3, 10, 0.01))
+    db.commit()
+    assert graph.investors(db, 1) == set()
+    assert graph.would_create_cycle(db, 1, 3)
+    assert graph.would_create_cycle(db, 2, 3)
+    assert not graph.would_create_cycle(db, 3, 1)
@@ -0,0 +1,267 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import os
+import pytest
+from sherwood import market_data, market_data_providers
+from sherwood.errors import MarketDataProviderError
+from sherwood.market_data import (
+    _revalidate_quotes,
+    _sidecar_quotes,
+    get_prices,
+    get_quotes,
+    quote_cache,
+    CircuitBreaker,
+    NegativeCache,
+    QuoteCache,
+    SingleFlight,
+    MARKET_DATA_SOCKET_ENV_VAR_NAME,
+)
+from sherwood.market_data_providers import YFinanceProvider
+from sherwood.market_data_server import MarketDataServer
+from sherwood.models import create_quote, now, Quote
+import threading
+import time
+
+
+def test_get_prices_raises_for_unpriced_missing_symbol(db):
+    with pytest.raises(MarketDataProviderError):
+        get_prices(db, ["AAA", "CCC"])
+
+
+def test_get_prices_serves_expired_quote_when_refresh_fails(db, mocker):
+    create_quote(db, "CCC", 3)
+    time.sleep(0.1)
+    assert get_prices(db, ["CCC"], freshness=0.05) == {"CCC": 3}
+    with pytest.raises(MarketDataProviderError):
+        get_prices(db, ["CCC"], freshness=0)
+    assert db.get(Quote, "CCC").price == 3
+
+
+def test_quote_cache_evicts_least_recently_used():
+    cache = QuoteCache(max_size=2)
+    cache.put("AAA", 1, now())
+    cache.put("BBB", 2, now())
+    assert cache.get("AAA", 60) == 1
+    cache.put("CCC", 3, now())
+    assert cache.get("BBB", 60) is None
+    assert cache.get("AAA", 60) == 1
+    assert cache.get("CCC", 60) == 3
+    assert cache.stats() == {
+        "size": 2,
+        "max_size": 2,
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+    }
+
+
+def test_quote_cache_honors_delay_seconds():
+    cache = QuoteCache(max_size=2)
+    cache.put("AAA", 1, now() - timedelta(seconds=10))
+    assert cache.get("AAA", 60) == 1
+    assert cache.get("AAA", 5) is None
+
+
+def test_get_prices_reads_quote_table_only_on_cache_miss(db, mocker):
+    assert get_prices(db, ["AAA", "BBB"]) == {"AAA": 1, "BBB": 2}
+    query = mocker.spy(db, "query")
+    assert get_prices(db, ["AAA", "BBB", "USD"]) == {"AAA": 1, "BBB": 2, "USD": 1}
+    query.assert_not_called()
+    quote_cache.evict("AAA")
+    assert get_prices(db, ["AAA", "BBB"]) == {"AAA": 1, "BBB": 2}
+    query.assert_called_once()
+    market_data._fetch_prices.assert_called_once()
+
+
+def test_single_flight_coalesces_concurrent_fetches():
+    single_flight = SingleFlight(timeout_seconds=1)
+    calls = []
+
+    def fetch_fn(symbols):
+        calls.append(symbols)
+        time.sleep(0.1)
+        return {symbol: 1 for symbol in symbols}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(lambda _: single_flight.fetch(["AAA"], fetch_fn), range(4))
+        )
+
+    assert results == 4 * [{"AAA": 1}]
+    assert calls == [["AAA"]]
+
+
+def test_get_prices_waits_for_quote_refreshed_by_another_worker(db, mocker):
+    wait = mocker.patch.object(
+        market_data, "_wait_for_refreshed_quotes", return_value={"AAA": 5}
+    )
+    with market_data._quote_refresh_locks(db, ["AAA"]) as locked_symbols:
+        assert locked_symbols == {"AAA"}
+        assert get_prices(db, ["AAA", "BBB"]) == {"AAA": 5, "BBB": 2}
+    assert wait.call_args.args[1] == ["AAA"]
+    market_data._fetch_prices.assert_called_once_with(["BBB"])
+
+
+def test_postgres_quote_refresh_locks_are_released_on_exit(mocker):
+    db = mocker.MagicMock()
+    db.get_bind.return_value.dialect.name = "postgresql"
+    connection = db.get_bind.return_value.connect.return_value.__enter__.return_value
+    connection.execute.return_value = [mocker.Mock(symbol="AAA")]
+    with pytest.raises(MarketDataProviderError):
+        with market_data._quote_refresh_locks(db, ["AAA", "BBB"]) as locked_symbols:
+            assert locked_symbols == {"AAA"}
+            raise MarketDataProviderError("down")
+    unlock = connection.execute.call_args.args[0]
+    assert str(unlock) == "SELECT pg_advisory_unlock_all()"
+    db.execute.assert_not_called()
+
+
+def test_get_quotes_serves_stale_quote_and_revalidates_in_background(db, mocker):
+    executor = mocker.patch.object(market_data, "_revalidation_executor")
+    create_quote(db, "AAA", 5)
+    time.sleep(0.1)
+    [(price, as_of)] = get_quotes(
+        db, ["AAA"], freshness=0.05, stale_while_revalidate=True
+    ).values()
+    assert price == 5
+    assert 0.1 <= (now() - as_of).total_seconds() < 1
+    market_data._fetch_prices.assert_not_called()
+    # pending revalidations aren't scheduled twice
+    get_quotes(db, ["AAA"], freshness=0.05, stale_while_revalidate=True)
+    executor.submit.assert_called_once_with(_revalidate_quotes, db.get_bind(), ["AAA"])
+
+    _revalidate_quotes(db.get_bind(), ["AAA"])
+    assert not market_data._revalidating_symbols
+    assert db.get(Quote, "AAA", populate_existing=True).price == 1
+
+
+def test_get_quotes_partial_omits_unpriceable_symbols(db):
+    with pytest.raises(MarketDataProviderError):
+        get_quotes(db, ["AAA", "ZZZZ"])
+    assert get_prices(db, ["AAA"]) == {"AAA": 1}
+    quote_by_symbol = get_quotes(db, ["AAA", "ZZZZ"], partial=True)
+    assert list(quote_by_symbol) == ["AAA"]
+
+
+def test_negative_cache_skips_rejected_symbols(db, mocker):
+    fetch_prices = mocker.spy(market_data._provider, "fetch_prices")
+    for _ in range(2):
+        with pytest.raises(MarketDataProviderError):
+            get_prices(db, ["CCC"])
+    fetch_prices.assert_called_once_with(["CCC"])
+    assert market_data.negative_cache.stats() == {"size": 1}
+
+
+def test_negative_cache_skips_timed_out_symbols(db, mocker):
+    provider = YFinanceProvider(timeout_seconds=0.1)
+    mocker.patch.object(market_data, "_provider", provider)
+    mocker.patch.object(
+        market_data_providers.yfinance, "download", side_effect=RuntimeError
+    )
+
+    def _fetch_price(symbol):
+        if symbol == "SLOW":
+            time.sleep(0.5)
+        return 1
+
+    mocker.patch.object(provider, "_fetch_price", side_effect=_fetch_price)
+    with pytest.raises(MarketDataProviderError):
+        get_prices(db, ["AAA", "SLOW"])
+    assert "SLOW" not in market_data.negative_cache
+    assert market_data.circuit_breaker.stats()["failures"] == 1
+    assert get_prices(db, ["AAA"]) == {"AAA": 1}
+
+
+def test_negative_cache_entries_expire():
+    cache = NegativeCache(ttl_seconds=0.05)
+    cache.add(["CCC"])
+    assert "CCC" in cache
+    time.sleep(0.1)
+    assert "CCC" not in cache
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    time.sleep(0.1)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_circuit_breaker_serves_stale_quotes(db, mocker):
+    mocker.patch.object(
+        market_data._provider,
+        "fetch_prices",
+        side_effect=MarketDataProviderError("down"),
+    )
+    create_quote(db, "AAA", 5)
+    time.sleep(0.1)
+    for _ in range(market_data._CIRCUIT_BREAKER_FAILURE_THRESHOLD):
+        quote_cache.clear()
+        assert get_prices(db, ["AAA"], freshness=0.05) == {"AAA": 5}
+    assert market_data.circuit_breaker.state == CircuitBreaker.OPEN
+    quote_cache.clear()
+    assert get_prices(db, ["AAA"], freshness=0.05) == {"AAA": 5}
+    assert market_data._provider.fetch_prices.call_count == (
+        market_data._CIRCUIT_BREAKER_FAILURE_THRESHOLD
+    )
+    with pytest.raises(MarketDataProviderError):
+        get_prices(db, ["AAA"], freshness=0)
+
+
+@pytest.fixture
+def sidecar(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "market-data.sock")
+    server = MarketDataServer(socket_path, refresh_interval_seconds=3600)
+    monkeypatch.setattr(server, "_refresh_forever", asyncio.sleep)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    serving = asyncio.run_coroutine_threadsafe(server.serve_forever(), loop)
+    while not os.path.exists(socket_path):
+        time.sleep(0.01)
+    monkeypatch.setenv(MARKET_DATA_SOCKET_ENV_VAR_NAME, socket_path)
+    yield server
+    serving.cancel()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def test_get_prices_answers_from_sidecar(db, mocker, sidecar):
+    sidecar._quote_by_symbol["AAA"] = (5, now())
+    sidecar._quote_by_symbol["BBB"] = (6, now() - timedelta(seconds=600))
+    query = mocker.spy(db, "query")
+    assert get_prices(db, ["AAA"], freshness=300) == {"AAA": 5}
+    query.assert_not_called()
+    # expired sidecar quotes fall back to the direct path
+    assert get_prices(db, ["BBB"], freshness=300) == {"BBB": 2}
+    query.assert_called()
+
+
+def test_trade_prices_skip_sidecar(db, mocker, sidecar):
+    sidecar._quote_by_symbol["AAA"] = (5, now())
+    sidecar_quotes = mocker.spy(market_data, "_sidecar_quotes")
+    assert get_prices(db, ["AAA"], freshness="trade") == {"AAA": 1}
+    sidecar_quotes.assert_not_called()
+
+
+def test_sidecar_schedules_unknown_symbols(sidecar):
+    assert _sidecar_quotes(["CCC"]) == {}
+    assert set(sidecar._requested_at_by_symbol) == {"CCC"}
+
+
+def test_get_prices_falls_back_when_sidecar_is_down(db, tmp_path, monkeypatch):
+    monkeypatch.setenv(MARKET_DATA_SOCKET_ENV_VAR_NAME, str(tmp_path / "missing.sock"))
+    assert get_prices(db, ["AAA"]) == {"AAA": 1}
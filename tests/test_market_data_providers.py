@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import pickle
+import pytest
+from sherwood import market_data_providers
+from sherwood.errors import MarketDataProviderError
+from sherwood.market_data_providers import (
+    provider_from_env,
+    ReplayProvider,
+    YFinanceProvider,
+    MARKET_DATA_REPLAY_PATH_ENV_VAR_NAME,
+    MARKET_DATA_REPLAY_SPEED_ENV_VAR_NAME,
+    MARKET_DATA_REPLAY_START_ENV_VAR_NAME,
+)
+import time
+
+T0 = datetime(2025, 1, 28, 14, 30, tzinfo=timezone.utc)
+
+
+def _bars(price_by_symbol):
+    columns = pd.MultiIndex.from_product([["Close"], list(price_by_symbol)])
+    return pd.DataFrame([list(price_by_symbol.values())], columns=columns)
+
+
+def test_yfinance_provider_uses_bulk_download(mocker):
+    download = mocker.patch.object(
+        market_data_providers.yfinance,
+        "download",
+        return_value=_bars({"AAA": 1, "BBB": 2}),
+    )
+    ticker = mocker.patch.object(market_data_providers.yfinance, "Ticker")
+    assert YFinanceProvider().fetch_prices(["AAA", "BBB"]) == {"AAA": 1, "BBB": 2}
+    download.assert_called_once()
+    ticker.assert_not_called()
+
+
+def test_yfinance_provider_falls_back_to_per_symbol_lookup(mocker):
+    mocker.patch.object(
+        market_data_providers.yfinance,
+        "download",
+        return_value=_bars({"AAA": 1, "FUND": float("nan")}),
+    )
+    ticker = mocker.patch.object(market_data_providers.yfinance, "Ticker")
+    ticker.return_value.info = {"currentPrice": None, "navPrice": 3}
+    assert YFinanceProvider().fetch_prices(["AAA", "FUND"]) == {"AAA": 1, "FUND": 3}
+    ticker.assert_called_once_with("FUND")
+
+
+def test_yfinance_provider_returns_partial_results(mocker):
+    mocker.patch.object(
+        market_data_providers.yfinance, "download", side_effect=RuntimeError
+    )
+    provider = YFinanceProvider(timeout_seconds=0.1)
+
+    def _fetch_price(symbol):
+        if symbol == "SLOW":
+            time.sleep(0.5)
+        if symbol == "BAD":
+            raise KeyError("navPrice")
+        return 1
+
+    mocker.patch.object(provider, "_fetch_price", side_effect=_fetch_price)
+    assert provider.fetch_prices_and_failures(["AAA", "SLOW", "BAD"]) == (
+        {"AAA": 1},
+        ["SLOW"],
+    )
+
+
+def test_yfinance_provider_raises_when_unavailable(mocker):
+    mocker.patch.object(
+        market_data_providers.yfinance, "download", side_effect=RuntimeError
+    )
+    ticker = mocker.patch.object(market_data_providers.yfinance, "Ticker")
+    type(ticker.return_value).info = mocker.PropertyMock(side_effect=ConnectionError)
+    with pytest.raises(MarketDataProviderError):
+        YFinanceProvider().fetch_prices(["AAA", "BBB"])
+
+
+def test_replay_provider_serves_price_at_or_before_replay_clock():
+    provider = ReplayProvider(
+        {
+            ("AAA", T0): 1,
+            ("AAA", T0 + timedelta(hours=1)): 2,
+            ("BBB", T0 + timedelta(hours=2)): 3,
+        },
+        start=T0 + timedelta(minutes=90),
+        speed=0,
+    )
+    assert provider.fetch_prices(["AAA", "BBB", "CCC"]) == {"AAA": 2}
+
+
+def test_replay_provider_clock_advances_with_speed():
+    provider = ReplayProvider(
+        {("AAA", T0): 1, ("AAA", T0 + timedelta(hours=1)): 2}, speed=3600 * 10
+    )
+    assert provider.fetch_prices(["AAA"]) == {"AAA": 1}
+    time.sleep(0.2)
+    assert provider.fetch_prices(["AAA"]) == {"AAA": 2}
+
+
+def test_replay_provider_starts_once_every_symbol_is_priced():
+    provider = ReplayProvider(
+        {
+            ("AAA", T0): 1,
+            ("BBB", T0 + timedelta(hours=1)): 2,
+            ("AAA", T0 + timedelta(hours=2)): 3,
+        },
+        speed=0,
+    )
+    assert provider.fetch_prices(["AAA", "BBB"]) == {"AAA": 1, "BBB": 2}
+
+
+def test_replay_provider_from_env(tmp_path, monkeypatch):
+    pkl_path = tmp_path / "prices.pkl"
+    with open(pkl_path, "wb") as f:
+        pickle.dump({("AAA", T0): 1.5}, f)
+    monkeypatch.setenv(MARKET_DATA_REPLAY_PATH_ENV_VAR_NAME, str(pkl_path))
+    assert provider_from_env().fetch_prices(["AAA"]) == {"AAA": 1.5}
+
+    csv_path = tmp_path / "bars.csv"
+    csv_path.write_text(
+        "symbol,timestamp,open,close\n" f"AAA,{T0.isoformat()},1.0,2.5\n"
+    )
+    monkeypatch.setenv(MARKET_DATA_REPLAY_PATH_ENV_VAR_NAME, str(csv_path))
+    assert provider_from_env().fetch_prices(["AAA"]) == {"AAA": 2.5}
+
+    with open(pkl_path, "wb") as f:
+        pickle.dump({("AAA", T0): 1.5, ("AAA", T0 + timedelta(hours=1)): 2}, f)
+    monkeypatch.setenv(MARKET_DATA_REPLAY_PATH_ENV_VAR_NAME, str(pkl_path))
+    monkeypatch.setenv(
+        MARKET_DATA_REPLAY_START_ENV_VAR_NAME,
+        (T0 + timedelta(minutes=90)).isoformat(),
+    )
+    monkeypatch.setenv(MARKET_DATA_REPLAY_SPEED_ENV_VAR_NAME, "0")
+    provider = provider_from_env()
+    assert provider.now() == T0 + timedelta(minutes=90)
+    assert provider.fetch_prices(["AAA"]) == {"AAA": 2}
@@ -0,0 +1,51 @@
+from pytest import approx
+from sherwood.broker import buy_portfolio_holding, invest_in_portfolio
+from sherwood.migrations import (
+    add_share_columns,
+    migrate_portfolios_to_shares,
+    _MIGRATED_PORTFOLIO_SHARES,
+)
+from sherwood.models import create_user, ownership_percent, Portfolio
+from sqlalchemy import create_engine, inspect, text
+
+
+def test_add_share_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sherwood.db'}")
+    # a new database is left to create_all
+    add_share_columns(engine)
+    assert not inspect(engine).has_table("portfolios")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE portfolios (id INTEGER PRIMARY KEY)"))
+        connection.execute(text("CREATE TABLE ownership (percent FLOAT NOT NULL)"))
+    add_share_columns(engine)
+    add_share_columns(engine)
+    for table in ["portfolios", "ownership"]:
+        columns = {column["name"] for column in inspect(engine).get_columns(table)}
+        assert "shares" in columns
+    engine.dispose()
+
+
+def test_migrate_portfolios_to_shares(
+    db, valid_emails, valid_display_names, valid_password
+):
+    users = [
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+        for i in [0, 1]
+    ]
+    buy_portfolio_holding(db, users[0].portfolio.id, "AAA", 500)
+    invest_in_portfolio(db, users[0].portfolio.id, users[1].portfolio.id, 250)
+    percent_by_owner = {
+        ownership.owner_id: ownership.percent
+        for ownership in db.get(Portfolio, users[0].portfolio.id).ownership
+    }
+
+    assert migrate_portfolios_to_shares(db) == 2
+    assert migrate_portfolios_to_shares(db) == 0
+
+    portfolio = db.get(Portfolio, users[0].portfolio.id)
+    assert portfolio.shares == _MIGRATED_PORTFOLIO_SHARES
+    for ownership in portfolio.ownership:
+        assert ownership.percent is None
+        assert ownership_percent(ownership) == approx(
+            percent_by_owner[ownership.owner_id]
+        )
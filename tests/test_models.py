@@ -2,15 +2,22 @@ import pytest
 import sqlalchemy
 import time
 
+from sherwood.broker import invest_in_portfolio
 from sherwood.models import (
     create_quote,
     create_user,
     has_expired,
+    ownership_percent,
     to_dict,
     upsert_quote,
+    upsert_quotes,
     Holding,
+    Ownership,
     Portfolio,
+    Quote,
     User,
+    INITIAL_PORTFOLIO_SHARES,
+    SHARE_BASED_PORTFOLIOS_ENV_VAR_NAME,
 )
 
 
@@ -69,6 +76,18 @@ def test_last_modified_changes_on_quote_update(db):
     assert t < quote.last_modified
 
 
+def test_upsert_quotes_inserts_and_updates_in_one_statement(db, mocker):
+    create_quote(db, symbol="AAA", price=1)
+    execute = mocker.spy(db, "execute")
+    upsert_quotes(db, {"AAA": 2, "BBB": 3})
+    db.commit()
+    execute.assert_called_once()
+    assert {quote.symbol: quote.price for quote in db.query(Quote)} == {
+        "AAA": 2,
+        "BBB": 3,
+    }
+
+
 def test_create_user_success(db, valid_email, valid_display_name, valid_password):
     expected = create_user(
         db, valid_email, valid_display_name, valid_password, starting_balance=100
@@ -77,6 +96,27 @@ def test_create_user_success(db, valid_email, valid_display_name, valid_password
     assert expected == user
 
 
+def test_create_share_based_user(
+    db, valid_emails, valid_display_names, valid_password, monkeypatch
+):
+    user = create_user(db, valid_emails[0], valid_display_names[0], valid_password, 100)
+    assert user.portfolio.shares is None
+    assert user.portfolio.ownership[0].percent == 1
+
+    monkeypatch.setenv(SHARE_BASED_PORTFOLIOS_ENV_VAR_NAME, "1")
+    user = create_user(db, valid_emails[1], valid_display_names[1], valid_password, 100)
+    assert user.portfolio.shares == INITIAL_PORTFOLIO_SHARES
+    ownership = db.get(Ownership, (user.id, user.id))
+    assert ownership.shares == INITIAL_PORTFOLIO_SHARES
+    assert ownership.percent is None
+    assert ownership_percent(ownership) == 1
+
+    invest_in_portfolio(db, user.id, 1, 50)
+    db.refresh(user.portfolio)
+    assert user.portfolio.shares == 1.5 * INITIAL_PORTFOLIO_SHARES
+    assert ownership_percent(db.get(Ownership, (user.id, 1))) == pytest.approx(1 / 3)
+
+
 def test_to_dict_success(db, valid_email, valid_display_name, valid_password):
     user = create_user(
         db, valid_email, valid_display_name, valid_password, starting_balance=100
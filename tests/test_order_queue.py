@@ -0,0 +1,142 @@
+from datetime import timedelta
+import pytest
+from pytest import approx
+from sherwood.broker import Order
+from sherwood.errors import RequestValueError
+from sherwood import order_queue
+from sherwood.models import (
+    create_user,
+    now,
+    IdempotencyRecord,
+    Portfolio,
+    QueuedOrder,
+    QueuedOrderStatus,
+    TransactionType,
+)
+from sherwood.order_queue import (
+    enqueue_order,
+    execute_next_order,
+    execute_next_orders,
+    get_queued_order,
+    OrderExecutor,
+)
+from sqlalchemy import update
+
+
+def test_execute_queued_orders_in_arrival_order(
+    db, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    order_ids = [
+        enqueue_order(db, user.portfolio.id, order)
+        for order in [
+            Order(TransactionType.BUY, dollars=600, symbol="AAA"),
+            Order(TransactionType.BUY, dollars=600, symbol="BBB"),
+            Order(TransactionType.SELL, symbol="AAA"),
+        ]
+    ]
+    queued_order = get_queued_order(db, user.portfolio.id, order_ids[0])
+    assert queued_order.status == QueuedOrderStatus.QUEUED
+    assert get_queued_order(db, user.portfolio.id + 1, order_ids[0]) is None
+
+    assert execute_next_order(db).id == order_ids[0]
+    assert execute_next_order(db).id == order_ids[1]
+    assert execute_next_order(db).id == order_ids[2]
+    assert execute_next_order(db) is None
+
+    statuses = [
+        get_queued_order(db, user.portfolio.id, order_id).status
+        for order_id in order_ids
+    ]
+    assert statuses == [
+        QueuedOrderStatus.EXECUTED,
+        QueuedOrderStatus.FAILED,
+        QueuedOrderStatus.EXECUTED,
+    ]
+    assert "Insufficient cash" in get_queued_order(db, 1, order_ids[1]).detail
+    holdings = {h.symbol: h.units for h in db.get(Portfolio, 1).holdings}
+    assert holdings == {"AAA": 0, "USD": 1000}
+
+
+def test_group_commit_queued_orders(
+    db, valid_emails, valid_display_names, valid_password, mocker
+):
+    for i in range(2):
+        create_user(db, valid_emails[i], valid_display_names[i], valid_password, 1000)
+    orders = [
+        (1, Order(TransactionType.BUY, dollars=600, symbol="AAA")),
+        (2, Order(TransactionType.BUY, dollars=100, symbol="BBB")),
+        (1, Order(TransactionType.BUY, dollars=600, symbol="BBB")),
+        (2, Order(TransactionType.INVEST, dollars=100, investee_portfolio_id=1)),
+        (1, Order(TransactionType.SELL, symbol="AAA")),
+    ]
+    order_ids = [enqueue_order(db, *order) for order in orders]
+    commit = mocker.spy(order_queue, "maybe_commit")
+
+    queued_orders = execute_next_orders(db, 4)
+    assert [queued_order.id for queued_order in queued_orders] == order_ids[:4]
+    assert commit.call_count == 1
+    assert OrderExecutor(group_commit_size=4).drain() == 1
+
+    statuses = [
+        get_queued_order(db, portfolio_id, order_id).status
+        for (portfolio_id, _), order_id in zip(orders, order_ids)
+    ]
+    assert statuses == [
+        QueuedOrderStatus.EXECUTED,
+        QueuedOrderStatus.EXECUTED,
+        QueuedOrderStatus.FAILED,
+        QueuedOrderStatus.EXECUTED,
+        QueuedOrderStatus.EXECUTED,
+    ]
+    holdings = {h.symbol: h.units for h in db.get(Portfolio, 1).holdings}
+    assert holdings == {"AAA": 0, "USD": approx(1100)}
+    holdings = {h.symbol: h.units for h in db.get(Portfolio, 2).holdings}
+    assert holdings == {"BBB": 50, "USD": 800}
+
+
+def test_execute_skips_order_applied_by_another_executor(
+    db, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    order_ids = [
+        enqueue_order(db, user.portfolio.id, order)
+        for order in [
+            Order(TransactionType.BUY, dollars=600, symbol="AAA"),
+            Order(TransactionType.BUY, dollars=100, symbol="BBB"),
+        ]
+    ]
+    queued_orders = order_queue._queued_orders(db).all()
+    # as if another executor applied them after these were read
+    db.execute(
+        update(QueuedOrder)
+        .where(QueuedOrder.id.in_(order_ids))
+        .values(status=QueuedOrderStatus.EXECUTED),
+        execution_options={"synchronize_session": False},
+    )
+    order_queue._execute(db, queued_orders[0])
+    order_queue._execute_group(db, queued_orders)
+    holdings = {h.symbol: h.units for h in db.get(Portfolio, 1).holdings}
+    assert holdings == {"USD": 1000}
+
+
+def test_enqueue_invalid_order(db, valid_email, valid_display_name, valid_password):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    with pytest.raises(RequestValueError):
+        enqueue_order(db, user.portfolio.id, Order(TransactionType.BUY, dollars=1))
+
+
+def test_executor_purges_expired_idempotency_records(
+    db, valid_email, valid_display_name, valid_password
+):
+    user = create_user(db, valid_email, valid_display_name, valid_password, 1000)
+    for key in ["a", "b"]:
+        db.add(IdempotencyRecord(user_id=user.id, key=key, fingerprint=""))
+    db.commit()
+    db.get(IdempotencyRecord, (user.id, "a")).created = now() - timedelta(days=2)
+    db.commit()
+    executor = OrderExecutor()
+    assert executor._purge_due()
+    assert executor.purge_expired_idempotency_records() == 1
+    assert not executor._purge_due()
+    assert db.get(IdempotencyRecord, (user.id, "b")) is not None
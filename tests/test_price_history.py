@@ -0,0 +1,56 @@
+from datetime import timedelta
+from sherwood.market_data import get_prices
+from sherwood.models import now, QuoteHistory
+from sherwood.price_history import (
+    apply_retention_policies,
+    get_price_history,
+    record_prices,
+    RetentionPolicy,
+)
+
+
+def test_get_prices_appends_to_history(db):
+    start = now()
+    get_prices(db, ["AAA", "BBB"])
+    get_prices(db, ["AAA"], freshness=0)
+    history = get_price_history(db, ["AAA", "BBB"], start, now())
+    assert [price for _, price in history["AAA"]] == [1, 1]
+    assert [price for _, price in history["BBB"]] == [2]
+
+
+def test_get_price_history_range_and_downsampling(db):
+    t0 = now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+    for minutes in range(0, 180, 15):
+        record_prices(db, {"AAA": minutes}, t0 + timedelta(minutes=minutes))
+    db.commit()
+
+    history = get_price_history(
+        db, ["AAA", "BBB"], t0 + timedelta(minutes=30), t0 + timedelta(minutes=90)
+    )
+    assert [price for _, price in history["AAA"]] == [30, 45, 60, 75, 90]
+    assert history["BBB"] == []
+
+    history = get_price_history(
+        db, ["AAA"], t0, t0 + timedelta(hours=3), interval=timedelta(hours=1)
+    )
+    assert [price for _, price in history["AAA"]] == [45, 105, 165]
+    assert history["AAA"][0][0] == t0 + timedelta(minutes=45)
+
+
+def test_apply_retention_policies(db):
+    t0 = now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for hours in [1, 50, 50.5, 51, 500]:
+        record_prices(db, {"AAA": hours}, t0 - timedelta(hours=hours))
+    db.commit()
+
+    deleted = apply_retention_policies(
+        db,
+        [
+            RetentionPolicy(age=timedelta(days=1), interval=timedelta(hours=2)),
+            RetentionPolicy(age=timedelta(days=10), interval=None),
+        ],
+    )
+
+    assert deleted == 2
+    prices = sorted(row.price for row in db.query(QuoteHistory))
+    assert prices == [1, 50, 50.5]
@@ -0,0 +1,67 @@
+import asyncio
+from sherwood.models import now
+from sherwood.quote_hub import QuoteHub
+
+
+def test_quote_hub_polls_each_symbol_once_for_all_subscribers():
+    calls = []
+    as_of = now()
+
+    def get_quotes_fn(symbols):
+        calls.append(symbols)
+        return {symbol: (1, as_of) for symbol in symbols}
+
+    async def main():
+        hub = QuoteHub(poll_interval_seconds=0.01, get_quotes_fn=get_quotes_fn)
+        subscriptions = [hub.subscription() for _ in range(3)]
+        for subscription in subscriptions:
+            hub.subscribe(subscription, ["AAA", "BBB"])
+        messages = [[await s.get(), await s.get()] for s in subscriptions]
+        await asyncio.sleep(0.05)
+        for subscription in subscriptions:
+            # unchanged quotes aren't pushed again
+            assert subscription.empty()
+            hub.unsubscribe(subscription)
+        assert hub.stats() == {"symbols": 0, "subscriptions": 0}
+        return messages
+
+    messages = asyncio.run(main())
+    assert all(symbols == ["AAA", "BBB"] for symbols in calls)
+    assert messages == 3 * [
+        [
+            {"symbol": "AAA", "price": 1, "as_of": as_of.isoformat()},
+            {"symbol": "BBB", "price": 1, "as_of": as_of.isoformat()},
+        ]
+    ]
+
+
+def test_subscription_coalesces_updates_per_symbol():
+    async def main():
+        hub = QuoteHub(get_quotes_fn=lambda symbols: {})
+        subscription = hub.subscription()
+        hub.subscribe(subscription, ["AAA", "BBB"])
+        for price in range(5):
+            hub.publish({"AAA": (price, now())})
+        hub.publish({"BBB": (10, now())})
+        hub.publish({"AAA": (5, now())})
+        hub.unsubscribe(subscription)
+        return [await subscription.get(), await subscription.get()], subscription
+
+    messages, subscription = asyncio.run(main())
+    assert [(m["symbol"], m["price"]) for m in messages] == [("AAA", 5), ("BBB", 10)]
+    assert subscription.dropped == 5
+    assert subscription.empty()
+
+
+def test_subscription_drops_oldest_symbol_when_full():
+    async def main():
+        hub = QuoteHub(queue_size=2, get_quotes_fn=lambda symbols: {})
+        subscription = hub.subscription()
+        hub.subscribe(subscription, ["AAA", "BBB", "CCC"])
+        hub.publish({symbol: (1, now()) for symbol in ["AAA", "BBB", "CCC"]})
+        hub.unsubscribe(subscription)
+        return [await subscription.get(), await subscription.get()], subscription
+
+    messages, subscription = asyncio.run(main())
+    assert [m["symbol"] for m in messages] == ["BBB", "CCC"]
+    assert subscription.dropped == 1
@@ -0,0 +1,63 @@
+import pytest
+from sherwood.symbols import (
+    is_valid_symbol,
+    set_symbol_index,
+    symbol_index_from_env,
+    SymbolIndex,
+    SYMBOLS_PATH_ENV_VAR_NAME,
+)
+
+
+@pytest.fixture
+def symbols_path(tmp_path):
+    path = tmp_path / "symbols.tsv"
+    path.write_text("AAA\tAaa Inc\nAAB\tAab Corp\nBBB\tBbb Ltd\nUSD\tUS Dollar")
+    return str(path)
+
+
+def test_symbol_index_lookup(symbols_path):
+    symbol_index = SymbolIndex(symbols_path)
+    assert len(symbol_index) == 4
+    assert "AAA" in symbol_index
+    assert "USD" in symbol_index
+    assert "AA" not in symbol_index
+    assert "CCC" not in symbol_index
+    assert symbol_index.name("BBB") == "Bbb Ltd"
+
+
+def test_symbol_index_search(symbols_path):
+    symbol_index = SymbolIndex(symbols_path)
+    assert symbol_index.search("AA") == [("AAA", "Aaa Inc"), ("AAB", "Aab Corp")]
+    assert symbol_index.search("AA", limit=1) == [("AAA", "Aaa Inc")]
+    assert symbol_index.search("C") == []
+
+
+def test_empty_symbol_index(tmp_path):
+    path = tmp_path / "symbols.tsv"
+    path.write_text("")
+    symbol_index = SymbolIndex(str(path))
+    assert len(symbol_index) == 0
+    assert "AAA" not in symbol_index
+
+
+def test_symbols_are_valid_without_index(symbols_path, monkeypatch):
+    assert symbol_index_from_env() is None
+    assert is_valid_symbol("CCC")
+    monkeypatch.setenv(SYMBOLS_PATH_ENV_VAR_NAME, symbols_path)
+    set_symbol_index(symbol_index_from_env())
+    try:
+        assert is_valid_symbol("AAA")
+        assert not is_valid_symbol("CCC")
+    finally:
+        set_symbol_index(None)
+
+
+def test_dollars_are_valid_outside_universe(tmp_path):
+    path = tmp_path / "symbols.tsv"
+    path.write_text("AAA\tAaa Inc\nBBB\tBbb Ltd")
+    set_symbol_index(SymbolIndex(str(path)))
+    try:
+        assert is_valid_symbol("USD")
+        assert not is_valid_symbol("CCC")
+    finally:
+        set_symbol_index(None)